@@ -1,5 +1,33 @@
-from polaris.component import Component
-from polaris.model_step import ModelStep
-from polaris.step import Step
-from polaris.testcase import TestCase
-from polaris.testgroup import TestGroup
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from polaris.component import Component
+    from polaris.model_step import ModelStep
+    from polaris.step import Step
+    from polaris.testcase import TestCase
+    from polaris.testgroup import TestGroup
+
+# the modules the classes at the top level of the package come from.  They
+# are imported the first time a class is used (PEP 562) so that
+# ``import polaris`` (e.g. for the ``polaris`` command or ``polaris.version``)
+# doesn't import xarray, lxml and the rest of the model-step machinery
+_lazy_classes = {'Component': 'polaris.component',
+                 'ModelStep': 'polaris.model_step',
+                 'Step': 'polaris.step',
+                 'TestCase': 'polaris.testcase',
+                 'TestGroup': 'polaris.testgroup'}
+
+__all__ = list(_lazy_classes)
+
+
+def __getattr__(name):
+    if name not in _lazy_classes:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_lazy_classes[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -1,13 +1,24 @@
 #!/usr/bin/env python3
 
 import argparse
+import importlib
 import os
 import sys
 
-import polaris.run.serial as run_serial
-from polaris import cache, list, setup, suite
 from polaris.version import __version__
 
+# the module with the ``main()`` function for each command.  Modules are only
+# imported when their command is run because some of them (indirectly)
+# import every test case and the plotting and meshing packages they use
+COMMANDS = {'list': 'polaris.list',
+            'setup': 'polaris.setup',
+            'suite': 'polaris.suite',
+            'serial': 'polaris.run.serial',
+            'run': 'polaris.run.parallel',
+            'daemon': 'polaris.run.daemon',
+            'timings': 'polaris.run.timings',
+            'database': 'polaris.database'}
+
 
 def main():
     """
@@ -24,6 +35,10 @@ The available polaris commands are:
     setup   Set up a test case
     suite   Manage a regression test suite
     serial  Run a suite, test case or step in task serial
+    run     Run a suite, test case or step in task parallel
+    daemon  Start, stop or check on a daemon for running steps quickly
+    timings List the steps that used the most resources
+    database Manage the local databases of downloaded files
 
  To get help on an individual command, run:
 
@@ -41,17 +56,14 @@ The available polaris commands are:
 
     args = parser.parse_args(sys.argv[1:2])
 
-    commands = {'list': list.main,
-                'setup': setup.main,
-                'suite': suite.main,
-                'serial': run_serial.main}
+    commands = dict(COMMANDS)
 
     # only allow the "polaris cache" command if we're on Anvil or Chrysalis
     allow_cache = ('POLARIS_MACHINE' in os.environ and
                    os.environ['POLARIS_MACHINE'] in ['anvil', 'chrysalis'])
 
     if allow_cache:
-        commands['cache'] = cache.main
+        commands['cache'] = 'polaris.cache'
 
     if args.command not in commands:
         print(f'Unrecognized command {args.command}')
@@ -59,7 +71,8 @@ The available polaris commands are:
         exit(1)
 
     # call the function associated with the requested command
-    commands[args.command]()
+    module = importlib.import_module(commands[args.command])
+    module.main()
 
 
 if __name__ == "__main__":
@@ -1,21 +1,24 @@
 import argparse
 import json
 import os
-import pickle
-import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List
 
-from polaris import Step
+from polaris.component import parse_cached_file
 from polaris.config import PolarisConfigParser
-from polaris.io import imp_res
+from polaris.database import DatabaseStore
+from polaris.io import compute_sha256, imp_res, stage_file
+from polaris.manifest import read_step_manifest
 
 
-def update_cache(step_paths, date_string=None, dry_run=False):
+def update_cache(step_paths, date_string=None, dry_run=False, jobs=8):
     """
     Cache one or more polaris output files for use in a cached variant of the
-    test case or step
+    test case or step.  The SHA-256 checksum and size of each file are
+    recorded in ``<component>_cached_files.json``, and a file whose contents
+    are already in the cache (e.g. from an earlier date) is not copied again.
 
     Parameters
     ----------
@@ -29,6 +32,9 @@ def update_cache(step_paths, date_string=None, dry_run=False):
     dry_run : bool, optional
         Whether this is a dry run (producing the json file but not copying
         files to the LCRC server)
+
+    jobs : int, optional
+        The number of files to compute checksums of and copy at the same time
     """
     if 'POLARIS_MACHINE' not in os.environ:
         machine = None
@@ -46,13 +52,13 @@ def update_cache(step_paths, date_string=None, dry_run=False):
     if date_string is None:
         date_string = datetime.now().strftime("%y%m%d")
 
-    # make a dictionary with components as keys, and lists of steps as values
-    steps: Dict[str, List[Step]] = dict()
+    # make a dictionary with components as keys, and lists of step manifests
+    # as values
+    steps: Dict[str, List[Dict]] = dict()
     for path in step_paths:
-        with open(f'{path}/step.pickle', 'rb') as handle:
-            _, step = pickle.load(handle)
+        step = read_step_manifest(path)
 
-        component = step.component.name
+        component = step['component']['name']
 
         if component in steps:
             steps[component].append(step)
@@ -60,56 +66,114 @@ def update_cache(step_paths, date_string=None, dry_run=False):
             steps[component] = [step]
 
     # now, iterate over cores and steps
+    database_root = config.get('paths', 'database_root')
+    # the copies are added to the database's manifest of checksums
+    store = DatabaseStore(database_root)
     for component in steps:
-        database_root = config.get('paths', 'database_root')
         cache_root = f'{database_root}/{component}/polaris_cache'
 
-        package = f'polaris.{component}'
-        try:
-            with open(f'{component}_cached_files.json') as data_file:
-                cached_files = json.load(data_file)
-        except FileNotFoundError:
-            # we don't have a local version of the file yet, let's see if
-            # there's a remote one for this component
-            try:
-                pkg_file = imp_res.files(package).joinpath('cached_files.json')
-                with pkg_file.open('r') as data_file:
-                    cached_files = json.load(data_file)
-            except FileNotFoundError:
-                # no cached files yet for this core
-                cached_files = dict()
+        cached_files = _read_cached_files(component)
 
+        # the outputs to cache and the names they would have in the cache
+        outputs = list()
         for step in steps[component]:
-            # load the step from its pickle file
-
-            step_path = step.path
+            step_path = step['step']['path']
 
-            for output in step.outputs:
+            for output in step['outputs']:
                 output = os.path.basename(output)
                 out_filename = os.path.join(step_path, output)
                 # remove the component from the file path
                 target = out_filename[len(component) + 1:]
                 path, ext = os.path.splitext(target)
                 target = f'{path}.{date_string}{ext}'
-                cached_files[out_filename] = target
-
-                print(out_filename)
-                print(f'  ==> {target}')
+                outputs.append((out_filename, target))
+
+        # files already in the cache, with their checksums as keys
+        cached_checksums = _get_cached_checksums(cached_files, cache_root,
+                                                 store)
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            checksums = list(executor.map(
+                compute_sha256,
+                [out_filename for out_filename, _ in outputs]))
+
+        copies = list()
+        for (out_filename, target), sha256 in zip(outputs, checksums):
+            print(out_filename)
+            if sha256 in cached_checksums:
+                # the same contents were cached before (e.g. on another date)
+                target = cached_checksums[sha256]
+                print(f'  ==> {target} (already cached)')
+            else:
+                cached_checksums[sha256] = target
                 output_path = f'{cache_root}/{target}'
+                print(f'  ==> {target}')
                 print(f'  copy to: {output_path}')
-                print()
-                if not dry_run:
-                    directory = os.path.dirname(output_path)
-                    try:
-                        os.makedirs(directory)
-                    except FileExistsError:
-                        pass
-                    shutil.copyfile(out_filename, output_path)
+                copies.append((out_filename, output_path, sha256))
+            print()
+            cached_files[out_filename] = dict(
+                filename=target, sha256=sha256,
+                size=os.path.getsize(out_filename))
+
+        if not dry_run:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                list(executor.map(lambda copy: _copy_to_cache(store, *copy),
+                                  copies))
 
         out_filename = f'{component}_cached_files.json'
         with open(out_filename, 'w') as data_file:
             json.dump(cached_files, data_file, indent=4)
 
+    store.write()
+
+
+def _read_cached_files(component):
+    """
+    Read the local ``<component>_cached_files.json`` or, if there isn't one
+    yet, the one in the component's package
+    """
+    package = f'polaris.{component}'
+    try:
+        with open(f'{component}_cached_files.json') as data_file:
+            cached_files = json.load(data_file)
+    except FileNotFoundError:
+        # we don't have a local version of the file yet, let's see if
+        # there's a remote one for this component
+        try:
+            pkg_file = imp_res.files(package).joinpath('cached_files.json')
+            with pkg_file.open('r') as data_file:
+                cached_files = json.load(data_file)
+        except FileNotFoundError:
+            # no cached files yet for this core
+            cached_files = dict()
+    return cached_files
+
+
+def _get_cached_checksums(cached_files, cache_root, store):
+    """
+    Get the names of the files in the cache with their checksums as keys,
+    looking up the checksums of older entries in the database's manifest
+    """
+    cached_checksums = dict()
+    for value in cached_files.values():
+        cached_file = parse_cached_file(value)
+        sha256 = cached_file['sha256']
+        if sha256 is None:
+            sha256 = store.get_sha256(
+                f'{cache_root}/{cached_file["filename"]}')
+        if sha256 is not None:
+            cached_checksums[sha256] = cached_file['filename']
+    return cached_checksums
+
+
+def _copy_to_cache(store, out_filename, output_path, sha256):
+    """
+    Copy a file to the cache and add it to the database's manifest
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    stage_file(out_filename, output_path)
+    store.add(output_path, sha256)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -130,6 +194,10 @@ def main():
                              "file but not copying files to the LCRC server).",
                         action="store_true")
 
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=8,
+                        help="The number of files to copy at the same time "
+                             "(default 8)",
+                        metavar="N")
     args = parser.parse_args(sys.argv[2:])
     update_cache(step_paths=args.orig_steps, date_string=args.date_string,
-                 dry_run=args.dry_run)
+                 dry_run=args.dry_run, jobs=args.jobs)
@@ -20,6 +20,11 @@ class Component:
         A dictionary that maps from output file names in test cases to cached
         files in the ``polaris_cache`` database for the component.  These
         file mappings are read in from ``cached_files.json`` in the component.
+        Each value is either the name of the cached file or, for files cached
+        more recently, a dictionary with the name (``filename``), SHA-256
+        checksum (``sha256``) and size in bytes (``size``) of the cached
+        file.  Use :py:meth:`polaris.Component.get_cached_file()` to get
+        either kind in the same form.
     """
 
     def __init__(self, name):
@@ -50,6 +55,27 @@ class Component:
         """
         self.test_groups[test_group.name] = test_group
 
+    def get_cached_file(self, filename):
+        """
+        Get the cached file for an output file of a step
+
+        Parameters
+        ----------
+        filename : str
+            The path of the output file relative to the base work directory
+
+        Returns
+        -------
+        cached_file : dict
+            The name of the file within the ``polaris_cache`` database
+            (``filename``) and its SHA-256 checksum (``sha256``) and size in
+            bytes (``size``), which are ``None`` if they weren't recorded
+        """
+        if filename not in self.cached_files:
+            raise ValueError(f'The file {filename} has not been added to the '
+                             f'cache database')
+        return parse_cached_file(self.cached_files[filename])
+
     def configure(self, config):
         """
         Configure the component
@@ -73,3 +99,26 @@ class Component:
         except FileNotFoundError:
             # no cached files for this core
             pass
+
+
+def parse_cached_file(value):
+    """
+    Get the information about a cached file from ``cached_files.json``,
+    which is just the name of the file for older entries
+
+    Parameters
+    ----------
+    value : str or dict
+        The value in ``cached_files.json``
+
+    Returns
+    -------
+    cached_file : dict
+        The name (``filename``), SHA-256 checksum (``sha256``) and size in
+        bytes (``size``) of the cached file, the last two of which may be
+        ``None``
+    """
+    if isinstance(value, str):
+        return dict(filename=value, sha256=None, size=None)
+    return dict(filename=value['filename'], sha256=value.get('sha256'),
+                size=value.get('size'))
@@ -0,0 +1,355 @@
+import os
+from typing import Dict, List, Set
+
+
+class StepGraph:
+    """
+    A directed acyclic graph (DAG) describing which steps depend on which
+    other steps, possibly across test cases.  A step depends on another if
+    any of its ``inputs`` (typically symlinks added with
+    :py:meth:`polaris.Step.add_input_file()`) are among the ``outputs`` of
+    the other step (added with :py:meth:`polaris.Step.add_output_file()`).
+
+    Attributes
+    ----------
+    nodes : dict
+        A dictionary with the paths of steps within the base work directory
+        as keys and dictionaries with the path of the test case (``test_case``)
+        the name of the step (``step``), the target number of cores
+        (``cores``) and the minimum number of cores (``min_cores``) as values
+
+    dependencies : dict
+        A dictionary with step paths as keys and sets of the paths of steps
+        they depend on as values
+
+    missing : dict
+        A dictionary with step paths as keys and lists of input files in the
+        base work directory that are not produced by any step in the graph
+        and do not (yet) exist as values
+    """
+
+    def __init__(self):
+        """
+        Create an empty graph
+        """
+        self.nodes: Dict[str, Dict] = dict()
+        self.dependencies: Dict[str, Set[str]] = dict()
+        self.missing: Dict[str, List[str]] = dict()
+
+        # these are only needed until the graph is resolved
+        self._inputs: Dict[str, List[str]] = dict()
+        self._outputs: Dict[str, List[str]] = dict()
+        self._base_work_dirs: Set[str] = set()
+
+    @classmethod
+    def from_test_cases(cls, test_cases):
+        """
+        Build and resolve the graph for the steps in the given test cases,
+        which must already have been set up
+
+        Parameters
+        ----------
+        test_cases : dict of polaris.TestCase
+            The test cases with their paths as keys
+
+        Returns
+        -------
+        graph : polaris.dag.StepGraph
+            The resolved graph
+        """
+        graph = cls()
+        for test_case in test_cases.values():
+            graph.add_test_case(test_case)
+        graph.resolve()
+        return graph
+
+    def add_test_case(self, test_case):
+        """
+        Add the steps of a test case to the graph.  The steps' inputs and
+        outputs must already have been converted to absolute paths during
+        setup.
+
+        Parameters
+        ----------
+        test_case : polaris.TestCase
+            The test case to add
+        """
+        for step in test_case.steps.values():
+            if step.ntasks is None or step.cpus_per_task is None:
+                # resources will only be determined at runtime
+                cores = 1
+                min_cores = 1
+            else:
+                cores = step.cpus_per_task * step.ntasks
+                min_cores = step.min_cpus_per_task * step.min_tasks
+            self.nodes[step.path] = dict(
+                test_case=test_case.path,
+                step=step.name,
+                cores=cores,
+                min_cores=min_cores)
+            self._inputs[step.path] = list(step.inputs)
+            self._outputs[step.path] = list(step.outputs)
+            self._base_work_dirs.add(step.base_work_dir)
+
+    def resolve(self):
+        """
+        Link each step to the steps that produce its inputs, find inputs in
+        the work directory that no step produces, and check for cycles
+
+        Raises
+        ------
+        ValueError
+            If two steps produce the same output or if the steps depend on
+            one another in a cycle
+        """
+        producers: Dict[str, str] = dict()
+        for path, outputs in self._outputs.items():
+            for output in outputs:
+                if output in producers and producers[output] != path:
+                    raise ValueError(
+                        f'Output {output} is produced by both '
+                        f'{producers[output]} and {path}')
+                producers[output] = path
+
+        self.dependencies = dict()
+        self.missing = dict()
+        for path, inputs in self._inputs.items():
+            self.dependencies[path] = set()
+            for input_file in inputs:
+                if input_file in producers:
+                    if producers[input_file] != path:
+                        self.dependencies[path].add(producers[input_file])
+                elif (self._in_work_dir(input_file) and
+                      not os.path.exists(input_file)):
+                    if path not in self.missing:
+                        self.missing[path] = list()
+                    self.missing[path].append(input_file)
+
+        # make sure there are no cycles
+        self.topological_order()
+
+        self._inputs = dict()
+        self._outputs = dict()
+        self._base_work_dirs = set()
+
+    def to_dict(self):
+        """
+        Convert the resolved graph to plain python data that can be stored
+        without pickling this class
+
+        Returns
+        -------
+        data : dict
+            The ``nodes``, ``dependencies`` (as sorted lists) and ``missing``
+            inputs of the graph
+        """
+        dependencies = {path: sorted(dependencies) for path, dependencies in
+                        self.dependencies.items()}
+        return dict(nodes=self.nodes, dependencies=dependencies,
+                    missing=self.missing)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create a resolved graph from the data produced by
+        :py:meth:`polaris.dag.StepGraph.to_dict()`
+
+        Parameters
+        ----------
+        data : dict
+            The ``nodes``, ``dependencies`` and ``missing`` inputs of the
+            graph
+
+        Returns
+        -------
+        graph : polaris.dag.StepGraph
+            The graph
+        """
+        graph = cls()
+        graph.nodes = dict(data['nodes'])
+        graph.dependencies = {path: set(dependencies) for path, dependencies
+                              in data['dependencies'].items()}
+        graph.missing = dict(data['missing'])
+        return graph
+
+    def subgraph(self, paths):
+        """
+        Get the graph restricted to the given steps.  Dependencies on steps
+        that are not included are dropped, under the assumption that those
+        steps have already been run (or their outputs are cached).
+
+        Parameters
+        ----------
+        paths : iterable of str
+            The paths of the steps to include
+
+        Returns
+        -------
+        graph : polaris.dag.StepGraph
+            The subgraph
+        """
+        paths = set(paths)
+        graph = StepGraph()
+        for path in self.nodes:
+            if path not in paths:
+                continue
+            graph.nodes[path] = self.nodes[path]
+            graph.dependencies[path] = self.dependencies[path] & paths
+            if path in self.missing:
+                graph.missing[path] = self.missing[path]
+        return graph
+
+    def topological_order(self):
+        """
+        Get the steps in an order in which every step comes after all the
+        steps it depends on
+
+        Returns
+        -------
+        order : list of str
+            The paths of the steps in topological order
+
+        Raises
+        ------
+        ValueError
+            If the steps depend on one another in a cycle
+        """
+        remaining = {path: len(self.dependencies[path])
+                     for path in self.nodes}
+        dependents = self._get_dependents()
+        ready = [path for path in self.nodes if remaining[path] == 0]
+        order = list()
+        while len(ready) > 0:
+            path = ready.pop(0)
+            order.append(path)
+            for dependent in dependents[path]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(order) < len(self.nodes):
+            cycle = [path for path in self.nodes if remaining[path] > 0]
+            cycle_str = '\n  '.join(cycle)
+            raise ValueError(f'The following steps depend on one another in '
+                             f'a cycle:\n  {cycle_str}')
+        return order
+
+    def critical_path(self, durations=None):
+        """
+        Find the longest chain of dependent steps, which determines the
+        shortest time in which the steps could run no matter how many cores
+        are available
+
+        Parameters
+        ----------
+        durations : dict, optional
+            The expected runtime of each step (with step paths as keys).  By
+            default, or for steps that are not in ``durations``, each step is
+            assumed to take one unit of time.
+
+        Returns
+        -------
+        length : float
+            The sum of the durations of the steps on the critical path
+
+        path : list of str
+            The paths of the steps on the critical path
+        """
+        finish: Dict[str, float] = dict()
+        previous: Dict[str, str] = dict()
+        for path in self.topological_order():
+            start = 0.
+            for dependency in self.dependencies[path]:
+                if finish[dependency] > start:
+                    start = finish[dependency]
+                    previous[path] = dependency
+            finish[path] = start + self._get_duration(path, durations)
+
+        if len(finish) == 0:
+            return 0., list()
+
+        last = max(finish, key=lambda path: finish[path])
+        length = finish[last]
+        critical = [last]
+        while critical[0] in previous:
+            critical.insert(0, previous[critical[0]])
+        return length, critical
+
+    def makespan_lower_bound(self, cores, durations=None):
+        """
+        Compute a lower bound on the time it takes to run all steps on the
+        given number of cores.  No schedule can be shorter than the critical
+        path or than the total work (cores times duration) divided evenly
+        over all cores.
+
+        Parameters
+        ----------
+        cores : int
+            The number of cores available for running steps
+
+        durations : dict, optional
+            The expected runtime of each step (with step paths as keys).  By
+            default, or for steps that are not in ``durations``, each step is
+            assumed to take one unit of time.
+
+        Returns
+        -------
+        makespan : float
+            A lower bound on the time to run all steps
+        """
+        critical_length, _ = self.critical_path(durations)
+        work = 0.
+        for path, node in self.nodes.items():
+            step_cores = max(1, min(node['cores'], cores))
+            work += step_cores * self._get_duration(path, durations)
+        return max(critical_length, work / cores)
+
+    def bottom_levels(self, durations=None):
+        """
+        Compute the length of the longest chain of steps starting with each
+        step (including the step itself), useful for prioritizing steps on
+        the critical path
+
+        Parameters
+        ----------
+        durations : dict, optional
+            The expected runtime of each step (with step paths as keys).  By
+            default, or for steps that are not in ``durations``, each step is
+            assumed to take one unit of time.
+
+        Returns
+        -------
+        levels : dict
+            The bottom level of each step, with step paths as keys
+        """
+        dependents = self._get_dependents()
+        levels: Dict[str, float] = dict()
+        for path in reversed(self.topological_order()):
+            longest = 0.
+            for dependent in dependents[path]:
+                longest = max(longest, levels[dependent])
+            levels[path] = longest + self._get_duration(path, durations)
+        return levels
+
+    def _get_dependents(self):
+        """ Find the steps that depend on each step """
+        dependents: Dict[str, List[str]] = {path: list() for path in
+                                            self.nodes}
+        for path in self.nodes:
+            for dependency in self.dependencies[path]:
+                dependents[dependency].append(path)
+        return dependents
+
+    def _in_work_dir(self, filename):
+        """ Whether a file is in one of the base work directories """
+        for base_work_dir in self._base_work_dirs:
+            if filename.startswith(f'{base_work_dir}{os.sep}'):
+                return True
+        return False
+
+    @staticmethod
+    def _get_duration(path, durations):
+        """ Get the duration of a step, defaulting to 1 """
+        if durations is not None and path in durations:
+            return durations[path]
+        return 1.
@@ -0,0 +1,938 @@
+import argparse
+import contextlib
+import fcntl
+import grp
+import json
+import os
+import re
+import stat
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from typing import Dict, List, Optional
+
+from polaris.config import PolarisConfigParser
+from polaris.io import compute_sha256, symlink
+
+MANIFEST_FILENAME = 'database_manifest.json'
+OBJECTS_DIRNAME = '.objects'
+MANIFEST_VERSION = 1
+
+
+class DatabaseStore:
+    """
+    The local copy of the databases of files (meshes, initial conditions,
+    cached outputs, etc.) under ``database_root``, stored by content.
+
+    Each file is stored once in ``<database_root>/.objects`` under its
+    SHA-256 checksum, and its usual path (e.g.
+    ``<database_root>/ocean/global_convergence/mesh.nc``) is a hard link to
+    that copy (or a symlink if hard links aren't possible).  Files with the
+    same contents under different names share the same copy.  A manifest,
+    ``<database_root>/database_manifest.json``, records the checksum, size
+    and modification time of each file.
+
+    The manifest also records when each file was last used by a setup and
+    the work directories that were set up with files from the databases, so
+    :py:meth:`polaris.database.DatabaseStore.prune()` can remove the least
+    recently used files that no work directory links to.
+
+    Files are verified lazily, when they are used: a file whose size and
+    modification time match the manifest is assumed to be fine, while any
+    other file has its checksum computed and compared with the manifest.
+    Files that don't match are removed so they can be downloaded again, and
+    files not yet in the manifest are added to it.
+
+    The methods for verifying and adding files may be called from several
+    threads at once.  Changes to the manifest are only saved by
+    :py:meth:`polaris.database.DatabaseStore.write()`.
+
+    Attributes
+    ----------
+    database_root : str
+        The absolute path of the root of the databases
+
+    group : str or None
+        The group that new directories and the manifest should belong to
+        (and be writable by), as for downloaded files
+    """
+
+    def __init__(self, database_root, group=None):
+        """
+        Open the store of files under a database root
+
+        Parameters
+        ----------
+        database_root : str
+            The path of the root of the databases
+
+        group : str, optional
+            The group that new directories and the manifest should belong
+            to, typically the ``group`` config option in the
+            ``e3sm_unified`` section
+        """
+        self.database_root = os.path.abspath(database_root)
+        self.group = group
+        manifest = _read_manifest(self.database_root)
+        self._files: Dict[str, Dict] = manifest['files']
+        self._work_dirs: Dict[str, float] = manifest['work_dirs']
+        self._changed: Dict[str, Optional[Dict]] = dict()
+        self._changed_work_dirs: Dict[str, Optional[float]] = dict()
+        self._added: List[str] = list()
+        self._lock = threading.Lock()
+
+    def get_sha256(self, filename):
+        """
+        Get the checksum of a file from the manifest
+
+        Parameters
+        ----------
+        filename : str
+            The path of the file
+
+        Returns
+        -------
+        sha256 : str or None
+            The SHA-256 checksum of the file, or ``None`` if it isn't in the
+            manifest
+        """
+        with self._lock:
+            entry = self._files.get(self._relpath(filename))
+        if entry is None:
+            return None
+        return entry['sha256']
+
+    def get_current_sha256(self, filename):
+        """
+        Get the checksum of a file from the manifest, as long as its size and
+        modification time show that it hasn't changed since it was recorded
+
+        Parameters
+        ----------
+        filename : str
+            The path of the file
+
+        Returns
+        -------
+        sha256 : str or None
+            The SHA-256 checksum of the file, or ``None`` if it isn't in the
+            manifest or may have changed
+        """
+        with self._lock:
+            entry = self._files.get(self._relpath(filename))
+        if entry is None:
+            return None
+        try:
+            file_stat = os.stat(filename)
+        except OSError:
+            return None
+        if entry['size'] != file_stat.st_size or \
+                entry['mtime_ns'] != file_stat.st_mtime_ns:
+            return None
+        return entry['sha256']
+
+    def verify(self, filename, sha256=None):
+        """
+        Verify a file against the manifest (or a given checksum), adding it
+        to the manifest if it isn't there yet
+
+        Parameters
+        ----------
+        filename : str
+            The path of the file, which must exist
+
+        sha256 : str, optional
+            The checksum the file must have.  By default, the checksum in
+            the manifest, if any.
+
+        Returns
+        -------
+        valid : bool
+            Whether the file is valid.  An invalid file has been removed.
+        """
+        path = self._relpath(filename)
+        with self._lock:
+            entry = self._files.get(path)
+        if sha256 is None and entry is not None:
+            sha256 = entry['sha256']
+        file_stat = os.stat(filename)
+        if entry is not None and entry['sha256'] == sha256 and \
+                entry['size'] == file_stat.st_size and \
+                entry['mtime_ns'] == file_stat.st_mtime_ns:
+            return True
+        actual = compute_sha256(filename)
+        if sha256 is not None and actual != sha256:
+            print(f'Warning: {filename} does not have the expected checksum '
+                  f'and will be downloaded again.')
+            for checksum in {actual, sha256}:
+                self._remove_object(filename, checksum)
+            self._remove(filename)
+            return False
+        self._store(filename, actual)
+        return True
+
+    def add(self, filename, sha256=None):
+        """
+        Add a new (e.g. newly downloaded) file to the store and the manifest
+
+        Parameters
+        ----------
+        filename : str
+            The path of the file
+
+        sha256 : str, optional
+            The checksum of the file, if it is already known
+        """
+        if sha256 is None:
+            sha256 = compute_sha256(filename)
+        self._store(filename, sha256)
+        with self._lock:
+            self._added.append(os.path.abspath(filename))
+
+    def fix_permissions(self, max_workers=8):
+        """
+        Let the store's group read and write the files added with
+        :py:meth:`polaris.database.DatabaseStore.add()` since this was last
+        called, and the directories they are in
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            The maximum number of threads changing permissions at once
+        """
+        with self._lock:
+            added = self._added
+            self._added = list()
+        if self.group is not None:
+            fix_new_file_permissions(self.database_root, added, self.group,
+                                     max_workers=max_workers)
+
+    def touch(self, filename):
+        """
+        Record that a file in the store was just used
+
+        Parameters
+        ----------
+        filename : str
+            The path of the file
+        """
+        path = self._relpath(filename)
+        with self._lock:
+            if path not in self._files:
+                return
+            entry = dict(self._files[path], last_used=time.time())
+            self._files[path] = entry
+            self._changed[path] = entry
+
+    def register_work_dir(self, work_dir):
+        """
+        Record a work directory that may link to files in the store, so they
+        aren't pruned while it exists
+
+        Parameters
+        ----------
+        work_dir : str
+            The base work directory of a test suite or test case
+        """
+        work_dir = os.path.abspath(work_dir)
+        with self._lock:
+            self._work_dirs[work_dir] = time.time()
+            self._changed_work_dirs[work_dir] = self._work_dirs[work_dir]
+
+    def write(self):
+        """
+        Save the changes to the manifest, merging them with changes made in
+        the meantime by other processes
+        """
+        with self._lock:
+            if len(self._changed) == 0 and len(self._changed_work_dirs) == 0:
+                return
+        with self._locked_manifest():
+            pass
+
+    def remove(self, filename):
+        """
+        Remove a file from the store and the manifest, along with the stored
+        copy of its contents if no other file shares it
+
+        Parameters
+        ----------
+        filename : str
+            The path of the file
+        """
+        path = self._relpath(filename)
+        with self._lock:
+            entry = self._files.pop(path, None)
+            self._changed[path] = None
+            shared = entry is not None and any(
+                other['sha256'] == entry['sha256']
+                for other in self._files.values())
+        if os.path.lexists(filename):
+            os.remove(filename)
+        if entry is not None and not shared:
+            object_filename = self.get_object_filename(entry['sha256'])
+            if os.path.exists(object_filename):
+                os.remove(object_filename)
+
+    def prune(self, max_size, work_dirs=None, dry_run=False, subdir=None):
+        """
+        Remove the least recently used files until the files in the store
+        take up no more than ``max_size`` bytes.  Files that a registered
+        work directory (or one of ``work_dirs``) still links to are never
+        removed.  Registered work directories that no longer exist are
+        forgotten.
+
+        Parameters
+        ----------
+        max_size : int
+            The maximum total size of the files in bytes
+
+        work_dirs : list of str, optional
+            More work directories whose links to files should be respected
+
+        dry_run : bool, optional
+            Whether to only print the files that would be removed
+
+        subdir : str, optional
+            A directory relative to the database root.  If given, only the
+            files in this directory are counted and removed.  Their contents
+            are kept if files elsewhere in the store share them.
+
+        Returns
+        -------
+        removed : list of str
+            The paths (relative to the database root) of the files that were
+            (or would be) removed
+
+        size : int
+            The total size of the files left in the store (or in ``subdir``)
+            in bytes
+        """
+        with self._locked_manifest():
+            with self._lock:
+                for work_dir in list(self._work_dirs):
+                    if not os.path.isdir(work_dir):
+                        self._work_dirs.pop(work_dir)
+                        self._changed_work_dirs[work_dir] = None
+                all_work_dirs = set(self._work_dirs)
+                files = dict(self._files)
+            if subdir is not None:
+                prefix = f'{os.path.normpath(subdir)}{os.sep}'
+                outside = {entry['sha256'] for path, entry in files.items()
+                           if not path.startswith(prefix)}
+                files = {path: entry for path, entry in files.items()
+                         if path.startswith(prefix)}
+            else:
+                outside = set()
+
+            # the files with the same contents are removed together
+            contents: Dict[str, Dict] = dict()
+            for path, entry in files.items():
+                sha256 = entry['sha256']
+                if sha256 not in contents:
+                    contents[sha256] = dict(paths=list(), size=entry['size'],
+                                            last_used=0., linked=False)
+                content = contents[sha256]
+                content['paths'].append(path)
+                last_used = entry.get('last_used', 1e-9 * entry['mtime_ns'])
+                content['last_used'] = max(content['last_used'], last_used)
+            for sha256 in outside.intersection(contents):
+                # removing these files wouldn't free up any space
+                contents[sha256].update(size=0, linked=True)
+
+            size = sum(content['size'] for content in contents.values())
+            if size <= max_size:
+                return list(), size
+
+            if work_dirs is not None:
+                all_work_dirs.update(os.path.abspath(work_dir)
+                                     for work_dir in work_dirs)
+            linked = set()
+            for work_dir in sorted(all_work_dirs):
+                linked.update(self._find_linked_files(work_dir))
+            for content in contents.values():
+                for path in content['paths']:
+                    filename = os.path.join(self.database_root, path)
+                    if os.path.realpath(filename) in linked:
+                        content['linked'] = True
+
+            removed = list()
+            for sha256, content in sorted(contents.items(),
+                                          key=lambda item:
+                                          item[1]['last_used']):
+                if size <= max_size:
+                    break
+                if content['linked']:
+                    continue
+                if not dry_run and not self._remove_content(
+                        sha256, content['paths']):
+                    continue
+                removed.extend(content['paths'])
+                size -= content['size']
+        return removed, size
+
+    @contextlib.contextmanager
+    def _locked_manifest(self):
+        """
+        A context manager that holds the lock on the manifest, reading in
+        changes made by other processes when it is entered and saving them
+        merged with this store's changes when it exits
+        """
+        manifest_filename = os.path.join(self.database_root,
+                                         MANIFEST_FILENAME)
+        lock_filename = os.path.join(self.database_root,
+                                     f'.{MANIFEST_FILENAME}.lock')
+        os.makedirs(self.database_root, exist_ok=True)
+        with open(lock_filename, 'w') as lock_file:
+            self._set_permissions(lock_filename)
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._merge(_read_manifest(self.database_root))
+                yield
+                with self._lock:
+                    changed = len(self._changed) > 0 or \
+                        len(self._changed_work_dirs) > 0
+                    self._changed = dict()
+                    self._changed_work_dirs = dict()
+                    manifest = dict(version=MANIFEST_VERSION,
+                                    files=self._files,
+                                    work_dirs=self._work_dirs)
+                    if changed:
+                        temp_filename = \
+                            f'{manifest_filename}.{os.getpid()}.tmp'
+                        with open(temp_filename, 'w') as handle:
+                            json.dump(manifest, handle, indent=1,
+                                      sort_keys=True)
+                        self._set_permissions(temp_filename)
+                        os.replace(temp_filename, manifest_filename)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _merge(self, manifest):
+        """
+        Combine the manifest as saved (possibly by other processes) with the
+        changes made by this store
+        """
+        with self._lock:
+            files = manifest['files']
+            for path, entry in self._changed.items():
+                if entry is None:
+                    files.pop(path, None)
+                else:
+                    files[path] = entry
+            work_dirs = manifest['work_dirs']
+            for work_dir, registered in self._changed_work_dirs.items():
+                if registered is None:
+                    work_dirs.pop(work_dir, None)
+                else:
+                    work_dirs[work_dir] = registered
+            self._files = files
+            self._work_dirs = work_dirs
+
+    def _find_linked_files(self, work_dir):
+        """
+        Find the files in the database that symlinks in a work directory
+        point to
+        """
+        linked = set()
+        prefix = f'{self.database_root}{os.sep}'
+        for root, dirs, files in os.walk(work_dir):
+            for name in dirs + files:
+                filename = os.path.join(root, name)
+                if not os.path.islink(filename):
+                    continue
+                target = os.path.realpath(filename)
+                if target.startswith(prefix):
+                    linked.add(target)
+        return linked
+
+    def _remove_content(self, sha256, paths):
+        """
+        Remove the files with the given contents and their stored copy,
+        returning whether they could be removed
+        """
+        filenames = [os.path.join(self.database_root, path) for path in paths]
+        filenames.append(self.get_object_filename(sha256))
+        for filename in filenames:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f'Warning: could not remove {filename}: {e}')
+                return False
+        with self._lock:
+            for path in paths:
+                self._files.pop(path, None)
+                self._changed[path] = None
+        return True
+
+    def _set_permissions(self, path):
+        """
+        Give the group write access to a file or directory, as for the
+        files downloaded to the databases
+        """
+        if self.group is not None:
+            set_group_permissions(path, grp.getgrnam(self.group).gr_gid)
+
+    def get_object_filename(self, sha256):
+        """
+        Get the path where the contents of a file are stored
+
+        Parameters
+        ----------
+        sha256 : str
+            The SHA-256 checksum of the file
+
+        Returns
+        -------
+        object_filename : str
+            The path of the stored copy
+        """
+        return os.path.join(self.database_root, OBJECTS_DIRNAME, sha256[:2],
+                            sha256)
+
+    def _relpath(self, filename):
+        """ The path of a file relative to the database root """
+        return os.path.relpath(os.path.abspath(filename), self.database_root)
+
+    def _store(self, filename, sha256):
+        """
+        Link a file to the stored copy of its contents and record it in the
+        manifest
+        """
+        object_filename = self.get_object_filename(sha256)
+        object_dir = os.path.dirname(object_filename)
+        if not os.path.isdir(object_dir):
+            os.makedirs(object_dir, exist_ok=True)
+            self._set_permissions(os.path.dirname(object_dir))
+            self._set_permissions(object_dir)
+        try:
+            os.link(filename, object_filename)
+        except FileExistsError:
+            # a file with the same contents is already stored
+            if not os.path.samefile(filename, object_filename):
+                _link(object_filename, filename)
+        except OSError:
+            # hard links aren't possible, so keep the file where it is
+            pass
+        file_stat = os.stat(filename)
+        entry = dict(sha256=sha256, size=file_stat.st_size,
+                     mtime_ns=file_stat.st_mtime_ns)
+        path = self._relpath(filename)
+        with self._lock:
+            self._files[path] = entry
+            self._changed[path] = entry
+
+    def _remove_object(self, filename, sha256):
+        """
+        Remove the stored copy of the given contents if it is the same file
+        as a corrupted file
+        """
+        object_filename = self.get_object_filename(sha256)
+        if os.path.exists(object_filename) and \
+                os.path.samefile(filename, object_filename):
+            os.remove(object_filename)
+
+    def _remove(self, filename):
+        """
+        Remove a corrupted file and its entry in the manifest
+        """
+        os.remove(filename)
+        path = self._relpath(filename)
+        with self._lock:
+            self._files.pop(path, None)
+            self._changed[path] = None
+
+
+def fix_new_file_permissions(database_root, filenames, group,
+                             max_workers=8):
+    """
+    Let everyone in a group read and write files that were just added to the
+    databases, along with the directories they are in, in a pool of threads.
+    Only these files and directories are changed, not everything else in
+    the databases.
+
+    Parameters
+    ----------
+    database_root : str
+        The path of the root of the databases
+
+    filenames : list of str
+        The files that were added
+
+    group : str
+        The group that should own the files
+
+    max_workers : int, optional
+        The maximum number of threads changing permissions at once
+    """
+    database_root = os.path.abspath(database_root)
+    prefix = f'{database_root}{os.sep}'
+    paths = set()
+    for filename in filenames:
+        path = os.path.abspath(filename)
+        paths.add(path)
+        directory = os.path.dirname(path)
+        while directory.startswith(prefix) and directory not in paths:
+            paths.add(directory)
+            directory = os.path.dirname(directory)
+    if len(paths) == 0:
+        return
+    gid = grp.getgrnam(group).gr_gid
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(set_group_permissions, sorted(paths),
+                          [gid] * len(paths)))
+
+
+def fix_permissions(database_root, group, max_workers=8):
+    """
+    Let everyone in a group read and write everything in the databases that
+    the current user owns.  Directories are scanned with ``os.scandir()``
+    in a pool of threads, each changing the permissions of the entries of
+    one directory at a time.
+
+    Parameters
+    ----------
+    database_root : str
+        The path of the root of the databases
+
+    group : str
+        The group that should own the files
+
+    max_workers : int, optional
+        The maximum number of threads scanning directories at once
+
+    Returns
+    -------
+    count : int
+        The number of files and directories that were checked
+
+    changed : int
+        The number of files and directories whose permissions were changed
+    """
+    gid = grp.getgrnam(group).gr_gid
+    database_root = os.path.abspath(database_root)
+    count = 1
+    changed = int(set_group_permissions(database_root, gid))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_fix_directory_permissions, database_root,
+                                   gid)}
+        while len(pending) > 0:
+            done, pending = wait_futures(pending,
+                                         return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, dir_count, dir_changed = future.result()
+                count += dir_count
+                changed += dir_changed
+                for subdir in subdirs:
+                    pending.add(executor.submit(_fix_directory_permissions,
+                                                subdir, gid))
+    return count, changed
+
+
+def set_group_permissions(path, gid, path_stat=None):
+    """
+    Make a file or directory owned by the current user belong to a group and
+    let the group write to it (and read and execute it, if it is a directory
+    or executable).  Files and directories owned by other users, or that
+    can't be changed, are left alone.
+
+    Parameters
+    ----------
+    path : str
+        The file or directory
+
+    gid : int
+        The ID of the group
+
+    path_stat : os.stat_result, optional
+        The result of ``os.stat(path)``, if it is already known
+
+    Returns
+    -------
+    changed : bool
+        Whether the permissions were changed
+    """
+    write_perm = (stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP |
+                  stat.S_IWGRP | stat.S_IROTH)
+    exec_perm = (stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR |
+                 stat.S_IRGRP | stat.S_IWGRP | stat.S_IXGRP |
+                 stat.S_IROTH | stat.S_IXOTH)
+
+    mask = stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO
+
+    uid = os.getuid()
+    if path_stat is None:
+        try:
+            path_stat = os.stat(path)
+        except OSError:
+            return False
+
+    if path_stat.st_uid != uid:
+        # current user doesn't own this file or dir so let's move on
+        return False
+
+    perm = path_stat.st_mode & mask
+
+    if stat.S_ISDIR(path_stat.st_mode) or perm & stat.S_IXUSR:
+        # a directory or executable, so make sure others can execute it
+        new_perm = exec_perm
+    else:
+        new_perm = write_perm
+
+    if perm == new_perm and path_stat.st_gid == gid:
+        return False
+
+    try:
+        os.chown(path, uid, gid)
+        os.chmod(path, new_perm)
+    except OSError:
+        return False
+    return True
+
+
+def parse_size(size):
+    """
+    Parse a size like ``500G``, ``1.5 TiB`` or ``1000000`` (bytes)
+
+    Parameters
+    ----------
+    size : str
+        The size, in bytes or with a binary (1024-based) prefix
+
+    Returns
+    -------
+    size : int
+        The size in bytes
+    """
+    match = re.match(r'^\s*([0-9.]+)\s*([KMGTP]?)(?:i?B)?\s*$', size,
+                     re.IGNORECASE)
+    if match is None:
+        raise ValueError(f'Could not parse the size {size}')
+    exponent = ' KMGTP'.index(match.group(2).upper() or ' ')
+    return int(float(match.group(1)) * 1024**exponent)
+
+
+def prune_database(database_root, max_size, work_dirs=None, dry_run=False,
+                   group=None):
+    """
+    Remove the least recently used files from the databases until they fit
+    in a given size, keeping any files that work directories link to
+
+    Parameters
+    ----------
+    database_root : str
+        The path of the root of the databases
+
+    max_size : int
+        The maximum total size of the files in bytes
+
+    work_dirs : list of str, optional
+        Work directories whose links to files should be respected, in
+        addition to those registered during setup
+
+    dry_run : bool, optional
+        Whether to only print the files that would be removed
+
+    group : str, optional
+        The group that the manifest should belong to
+    """
+    store = DatabaseStore(database_root, group=group)
+    removed, size = store.prune(max_size, work_dirs=work_dirs,
+                                dry_run=dry_run)
+    if dry_run:
+        print('Files that would be removed:')
+    elif len(removed) > 0:
+        print('Removed files:')
+    for path in removed:
+        print(f'  {path}')
+    print(f'The databases take up {_format_bytes(size)} (limit: '
+          f'{_format_bytes(max_size)})')
+    if size > max_size:
+        print('Warning: the remaining files are all in use by work '
+              'directories')
+
+
+def get_max_size(config):
+    """
+    Get the maximum size of the databases from the ``max_size`` config
+    option in the ``database`` section
+
+    Parameters
+    ----------
+    config : polaris.config.PolarisConfigParser
+        Config options
+
+    Returns
+    -------
+    max_size : int or None
+        The maximum size in bytes, or ``None`` for no limit
+    """
+    if not config.has_option('database', 'max_size'):
+        return None
+    max_size = config.get('database', 'max_size').strip()
+    if max_size in ['', 'None', 'none']:
+        return None
+    return parse_size(max_size)
+
+
+def get_group(config):
+    """
+    Get the group that the databases should belong to from the ``group``
+    config option in the ``e3sm_unified`` section
+
+    Parameters
+    ----------
+    config : polaris.config.PolarisConfigParser
+        Config options
+
+    Returns
+    -------
+    group : str or None
+        The group, if any
+    """
+    if not config.has_option('e3sm_unified', 'group'):
+        return None
+    return config.get('e3sm_unified', 'group')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Manage the local databases of files downloaded for '
+                    'test cases',
+        prog='polaris database')
+    parser.add_argument('action', choices=['prune', 'fix-permissions'],
+                        help='What to do with the databases: remove the '
+                             'least recently used files or let the group '
+                             'read and write all the files you own')
+    parser.add_argument("-f", "--config_file", dest="config_file",
+                        help="Configuration file with the database_root "
+                             "option and [database] options",
+                        metavar="FILE")
+    parser.add_argument("-m", "--machine", dest="machine",
+                        help="The name of the machine for loading machine-"
+                             "related config options", metavar="MACH")
+    parser.add_argument("--max-size", "--max_size", dest="max_size",
+                        help="The maximum size of the databases (e.g. "
+                             "500G).  The default is the max_size config "
+                             "option in the [database] section.",
+                        metavar="SIZE")
+    parser.add_argument("-w", "--work_dir", dest="work_dirs", nargs='+',
+                        help="More work directories whose links to files in "
+                             "the databases should be respected",
+                        metavar="PATH")
+    parser.add_argument("--dry_run", dest="dry_run", action="store_true",
+                        help="Only list the files that would be removed")
+    parser.add_argument("--parallel", dest="parallel", type=int, nargs='?',
+                        const=8, default=1,
+                        help="The number of threads to fix permissions with "
+                             "(8 if no number is given)",
+                        metavar="N")
+    args = parser.parse_args(sys.argv[2:])
+
+    config = PolarisConfigParser()
+    if args.config_file is not None:
+        config.add_user_config(args.config_file)
+    config.add_from_package('polaris', 'default.cfg')
+    machine = args.machine
+    if machine is not None:
+        config.add_from_package('mache.machines', f'{machine}.cfg')
+    else:
+        machine = 'default'
+    config.add_from_package('polaris.machines', f'{machine}.cfg')
+
+    database_root = config.get('paths', 'database_root')
+
+    if args.action == 'fix-permissions':
+        group = get_group(config)
+        if group is None:
+            raise ValueError('There is no group config option in the '
+                             '[e3sm_unified] section for this machine')
+        count, changed = fix_permissions(database_root, group,
+                                         max_workers=args.parallel)
+        print(f'Changed permissions on {changed} of {count} files and '
+              f'directories in {database_root}')
+        return
+
+    if args.max_size is not None:
+        max_size = parse_size(args.max_size)
+    else:
+        max_size = get_max_size(config)
+    if max_size is None:
+        raise ValueError('No maximum size was given with --max-size or the '
+                         'max_size config option in the [database] section')
+
+    prune_database(database_root, max_size,
+                   work_dirs=args.work_dirs, dry_run=args.dry_run,
+                   group=get_group(config))
+
+
+def _fix_directory_permissions(directory, gid):
+    """
+    Fix the permissions of the entries in a directory, returning its
+    subdirectories and how many entries there were and were changed
+    """
+    subdirs = list()
+    count = 0
+    changed = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_symlink():
+                    # leave the target to whoever owns it
+                    continue
+                try:
+                    entry_stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                count += 1
+                if set_group_permissions(entry.path, gid, entry_stat):
+                    changed += 1
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+    except OSError:
+        pass
+    return subdirs, count, changed
+
+
+def _read_manifest(database_root):
+    """ Read the manifest of a database root, if any """
+    manifest_filename = os.path.join(database_root, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_filename):
+        return dict(files=dict(), work_dirs=dict())
+    with open(manifest_filename) as handle:
+        manifest = json.load(handle)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f'{manifest_filename} has version '
+                         f'{manifest.get("version")} but version '
+                         f'{MANIFEST_VERSION} is required.')
+    if 'work_dirs' not in manifest:
+        manifest['work_dirs'] = dict()
+    return manifest
+
+
+def _format_bytes(nbytes):
+    """ Format a number of bytes with a binary prefix """
+    value = float(nbytes)
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if value < 1024.:
+            return f'{value:.1f} {unit}'
+        value /= 1024.
+    return f'{value:.1f} TiB'
+
+
+def _link(target, filename):
+    """
+    Replace a file with a hard link to another file with the same contents,
+    or a symlink if hard links aren't possible
+    """
+    temp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.link'
+    try:
+        os.link(target, temp_filename)
+    except OSError:
+        symlink(target, filename)
+        return
+    os.replace(temp_filename, filename)
@@ -0,0 +1,148 @@
+import os
+from typing import Dict, List
+
+from polaris.dag import StepGraph
+from polaris.fingerprint import compute_identity
+from polaris.io import symlink
+
+
+def deduplicate_steps(test_cases):
+    """
+    Find steps in different test cases that would produce the same outputs
+    (see :py:func:`polaris.fingerprint.compute_identity()`) and share the
+    outputs of the first such step with the others, so that it is the only
+    one that runs.
+
+    Steps are compared in the order of the dependencies between them, so a
+    step whose inputs come from steps that are shared in this way can be
+    shared as well (e.g. the ``forward`` step that follows identical
+    ``initial_state`` steps).  Only steps that are run by default are
+    shared, and steps in the same test case are never shared with one
+    another, since a test case may run identical steps on purpose to compare
+    them.
+
+    Parameters
+    ----------
+    test_cases : dict of polaris.TestCase
+        The test cases, which must have been set up, with their paths as
+        keys
+
+    Returns
+    -------
+    shared : list of polaris.Step
+        The steps that now share the outputs of another step
+    """
+    steps = dict()
+    for test_case in test_cases.values():
+        for step_name in test_case.steps_to_run:
+            step = test_case.steps[step_name]
+            if not step.cached:
+                steps[step.path] = step
+
+    graph = StepGraph.from_test_cases(test_cases)
+    producers: Dict[str, List] = dict()
+    shared = list()
+    for path in graph.topological_order():
+        if path not in steps:
+            continue
+        step = steps[path]
+        identity = compute_identity(step)
+        if identity is None:
+            continue
+        if identity not in producers:
+            producers[identity] = list()
+        candidates = producers[identity]
+        producer = None
+        for candidate in candidates:
+            if candidate.test_case is not step.test_case:
+                producer = candidate
+                break
+        if producer is None:
+            candidates.append(step)
+        else:
+            share_step(step, producer)
+            shared.append(step)
+    return shared
+
+
+def share_step(step, producer):
+    """
+    Replace the outputs of a step with symlinks to the outputs of an
+    identical step, and make the step depend on that step
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step that will share the other step's outputs
+
+    producer : polaris.Step
+        The step that will produce the outputs
+    """
+    producer_outputs = get_producer_outputs(step, producer.path)
+    for output, target in zip(step.outputs, producer_outputs):
+        symlink(target, output)
+    # depending on the producer's outputs puts this step after the producer
+    step.inputs = list(step.inputs) + producer_outputs
+    step.shared_from = producer.path
+
+
+def unshare_step(step):
+    """
+    Undo :py:func:`polaris.dedup.share_step()` so the step produces its own
+    outputs, e.g. because its test case is being run on its own and the
+    step it shared outputs with hasn't run
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step
+    """
+    producer_outputs = get_producer_outputs(step, step.shared_from)
+    for output in step.outputs:
+        if os.path.islink(output):
+            os.remove(output)
+    step.inputs = [input_file for input_file in step.inputs
+                   if input_file not in producer_outputs]
+    step.shared_from = None
+
+
+def get_producer_outputs(step, producer_path):
+    """
+    Get the outputs of the step that a step shares outputs with
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step
+
+    producer_path : str
+        The path of the step producing the outputs within the base work
+        directory
+
+    Returns
+    -------
+    outputs : list of str
+        The absolute paths of the producer's outputs, in the same order as
+        the step's outputs
+    """
+    producer_dir = os.path.join(step.base_work_dir, producer_path)
+    return [os.path.join(producer_dir, os.path.relpath(output, step.work_dir))
+            for output in step.outputs]
+
+
+def shared_outputs_exist(step):
+    """
+    Whether the step that a step shares outputs with has produced them
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step
+
+    Returns
+    -------
+    exist : bool
+        Whether all of the outputs exist
+    """
+    return all(os.path.exists(output) for output in
+               get_producer_outputs(step, step.shared_from))
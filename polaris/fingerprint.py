@@ -0,0 +1,491 @@
+import configparser
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import stat
+from typing import Dict
+
+from polaris.io import get_executable_sha256
+from polaris.registry import _get_package_files
+from polaris.version import __version__
+
+FINGERPRINT_FILENAME = 'fingerprint.json'
+
+# attributes of a step that depend on where it is in the work directory or
+# that are covered separately by its identity
+_IDENTITY_EXCLUDED = {'test_case', 'component', 'test_group', 'config',
+                      'machine_info', 'logger', 'log_filename', 'subdir',
+                      'path', 'work_dir', 'base_work_dir', 'config_filename',
+                      'input_data', 'inputs', 'outputs', 'cached',
+                      'shared_from', 'memoize'}
+
+# config sections that don't affect the outputs of steps but may differ
+# between work directories on the same machine
+_MEMO_EXCLUDED_SECTIONS = {'paths', 'setup', 'download', 'database',
+                           'memoize', 'run', 'job'}
+
+# hashes of files (by their real paths) computed for memo keys in this process
+_memo_file_cache: Dict[str, Dict] = dict()
+
+
+def compute_fingerprint(step, file_cache=None, hash_files=True):
+    """
+    Compute a fingerprint of everything that determines the results of a
+    step: the contents of its input files (including the model executable
+    for model steps), the config options for the test case, any other files
+    that define the step (see :py:meth:`polaris.Step.get_fingerprint_files()`),
+    the source code of the step's class and the polaris version
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step, which must have been set up
+
+    file_cache : dict, optional
+        Hashes of files from an earlier fingerprint, with absolute paths as
+        keys and dictionaries with ``size``, ``mtime_ns`` and ``sha256`` as
+        values.  A file is only hashed again if its size or modification time
+        has changed.
+
+    hash_files : bool, optional
+        Whether to hash the contents of files.  If not, only their sizes and
+        modification times are included, which is much cheaper for large
+        files but means a file that was rewritten with the same contents
+        counts as changed.
+
+    Returns
+    -------
+    fingerprint : str
+        The SHA-256 hash of all the parts of the fingerprint
+
+    files : dict
+        The size, modification time and (if ``hash_files``) hash of each file
+        that was included, suitable as a ``file_cache`` later on
+    """
+    if file_cache is None:
+        file_cache = dict()
+
+    files: Dict[str, Dict] = dict()
+    parts = [('polaris_version', __version__)]
+
+    step_class = type(step)
+    parts.append(('class', f'{step_class.__module__}.{step_class.__name__}'))
+    if hash_files:
+        def get_part(path):
+            return _hash_file(path, file_cache, files)
+    else:
+        def get_part(path):
+            return _stat_file(path, files)
+
+    source_file = inspect.getsourcefile(step_class)
+    if source_file is not None:
+        parts.append(('source', get_part(source_file)))
+
+    config_filename = os.path.join(step.work_dir, step.config_filename)
+    parts.append(('config', _hash_config(config_filename)))
+
+    filenames = list(step.inputs) + step.get_fingerprint_files()
+    for filename in filenames:
+        for path in _get_files(filename):
+            parts.append((path, get_part(path)))
+
+    sha = hashlib.sha256()
+    for key, value in parts:
+        sha.update(f'{key}={value}\n'.encode('utf-8'))
+    return sha.hexdigest(), files
+
+
+def compute_identity(step):
+    """
+    Compute an identity for a step that has been set up (but not run), such
+    that two steps in different test cases with the same identity would
+    produce the same outputs.  The identity is made up of the class of the
+    step and its source code, the polaris version, the config options of the
+    test case (except ``steps_to_run``), the attributes of the step (e.g. its
+    resolution and resources), the relative paths of its outputs, the files
+    its inputs resolve to (following symlinks) and the contents of the files
+    from :py:meth:`polaris.Step.get_fingerprint_files()`.
+
+    All config options are included because there is no way to know which of
+    them a step will read, so steps from test cases whose config options
+    differ in any way are never identical.
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step, which must have been set up
+
+    Returns
+    -------
+    identity : str or None
+        The SHA-256 hash of all the parts of the identity, or ``None`` if the
+        step's attributes can't be hashed
+    """
+    parts = [('polaris_version', __version__)]
+
+    step_class = type(step)
+    parts.append(('class', f'{step_class.__module__}.{step_class.__name__}'))
+    source_file = inspect.getsourcefile(step_class)
+    if source_file is not None:
+        parts.append(('source', _hash_file(source_file, dict(), dict())))
+
+    config_filename = os.path.join(step.work_dir, step.config_filename)
+    parts.append(('config', _hash_config(config_filename)))
+
+    attributes = _hash_attributes(step)
+    if attributes is None:
+        return None
+    parts.append(('attributes', attributes))
+
+    for output in step.outputs:
+        parts.append(('output', os.path.relpath(output, step.work_dir)))
+
+    for input_file in step.inputs:
+        name = os.path.relpath(input_file, step.work_dir)
+        if os.path.islink(input_file) or not os.path.exists(input_file):
+            # a symlink to a file in another step, a database or the polaris
+            # package, which doesn't have to exist yet
+            parts.append((f'input {name}', os.path.realpath(input_file)))
+        else:
+            for path in _get_files(input_file):
+                parts.append((f'input {path}',
+                              _hash_file(path, dict(), dict())))
+
+    for filename in step.get_fingerprint_files():
+        name = os.path.relpath(filename, step.work_dir)
+        parts.append((f'file {name}', _hash_file(filename, dict(), dict())))
+
+    sha = hashlib.sha256()
+    for key, value in parts:
+        sha.update(f'{key}={value}\n'.encode('utf-8'))
+    return sha.hexdigest()
+
+
+def compute_memo_key(step, store=None):
+    """
+    Compute a key for the outputs of a step that is about to run, such that
+    a step in any work directory with the same key would produce the same
+    outputs.  Unlike :py:func:`polaris.fingerprint.compute_identity()`, the
+    key doesn't depend on where the work directory is: inputs are hashed by
+    their contents (and named relative to the step's work directory), and
+    config options that only differ between work directories (e.g. those in
+    the ``paths`` section) are left out.  The key also includes the class of
+    the step, a hash of the contents of the whole polaris package (so the
+    key changes with any change to polaris, even in a development checkout
+    where the version stays the same), the attributes of the step and the
+    relative paths of its outputs.
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step, whose inputs must all exist
+
+    store : polaris.database.DatabaseStore, optional
+        The local databases, whose manifest holds the checksums of inputs
+        that are (or link to) files in the databases, so they don't have to
+        be hashed again
+
+    Returns
+    -------
+    key : str or None
+        The SHA-256 hash of all the parts of the key, or ``None`` if the
+        step's attributes can't be hashed or an input is missing
+    """
+    parts = [('code', _get_code_version())]
+
+    step_class = type(step)
+    parts.append(('class', f'{step_class.__module__}.{step_class.__name__}'))
+    source_file = inspect.getsourcefile(step_class)
+    if source_file is not None:
+        # in case the step is defined outside the polaris package
+        parts.append(('source', _hash_file(source_file, dict(), dict())))
+
+    config_filename = os.path.join(step.work_dir, step.config_filename)
+    parts.append(('config', _hash_config(config_filename,
+                                         _MEMO_EXCLUDED_SECTIONS)))
+
+    attributes = _hash_attributes(step)
+    if attributes is None:
+        return None
+    parts.append(('attributes', attributes))
+
+    for output in step.outputs:
+        parts.append(('output', os.path.relpath(output, step.work_dir)))
+
+    inputs = [('input', filename) for filename in step.inputs] + \
+        [('file', filename) for filename in step.get_fingerprint_files()]
+    for kind, filename in inputs:
+        if not os.path.exists(filename):
+            return None
+        name = os.path.relpath(filename, step.work_dir)
+        for path in _get_files(filename):
+            if path != os.path.abspath(filename):
+                # a file in an input directory
+                path_name = os.path.join(name,
+                                         os.path.relpath(path, filename))
+            else:
+                path_name = name
+            parts.append((f'{kind} {path_name}', _hash_content(path, store)))
+
+    sha = hashlib.sha256()
+    for key, value in parts:
+        sha.update(f'{key}={value}\n'.encode('utf-8'))
+    return sha.hexdigest()
+
+
+def write_fingerprint(step, hash_files=True):
+    """
+    Record the fingerprint of a step that has run successfully in
+    ``fingerprint.json`` in the step's work directory
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step
+
+    hash_files : bool, optional
+        Whether to hash the contents of the step's input files, so that
+        :py:func:`polaris.fingerprint.is_up_to_date()` can tell if they have
+        changed by their contents, rather than just their sizes and
+        modification times.  Hashing reads every input, so it is only done
+        when the fingerprint will be compared (i.e. with ``--incremental``).
+    """
+    filename = os.path.join(step.work_dir, FINGERPRINT_FILENAME)
+    previous = _read_fingerprint_file(filename)
+    if previous.get('hashed', True):
+        file_cache = previous.get('files', dict())
+    else:
+        # there are no hashes to reuse
+        file_cache = dict()
+    fingerprint, files = compute_fingerprint(step, file_cache, hash_files)
+    data = dict(polaris_version=__version__, fingerprint=fingerprint,
+                hashed=hash_files, files=files)
+    temp_filename = f'{filename}.tmp'
+    with open(temp_filename, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(temp_filename, filename)
+
+
+def remove_fingerprint(step):
+    """
+    Remove the fingerprint of a step, e.g. because it is about to be rerun
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step
+    """
+    filename = os.path.join(step.work_dir, FINGERPRINT_FILENAME)
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def is_up_to_date(step):
+    """
+    Whether a step ran successfully before with the same fingerprint it has
+    now and all of its outputs still exist, so it doesn't need to run again
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step
+
+    Returns
+    -------
+    up_to_date : bool
+        Whether the step is up to date
+    """
+    filename = os.path.join(step.work_dir, FINGERPRINT_FILENAME)
+    previous = _read_fingerprint_file(filename)
+    if 'fingerprint' not in previous:
+        return False
+
+    for output in step.outputs:
+        if not os.path.exists(output):
+            return False
+
+    for filename in list(step.inputs) + step.get_fingerprint_files():
+        if not os.path.exists(filename):
+            # the step can't run, so let it fail with the usual error
+            return False
+
+    # a fingerprint recorded without hashes can only be compared by the
+    # sizes and modification times of files
+    hashed = previous.get('hashed', True)
+    fingerprint, _ = compute_fingerprint(step, previous.get('files'),
+                                         hash_files=hashed)
+    return fingerprint == previous['fingerprint']
+
+
+def _read_fingerprint_file(filename):
+    """ Read a fingerprint file, returning an empty dict if there isn't one """
+    if not os.path.exists(filename):
+        return dict()
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def _get_files(filename):
+    """ The files to hash for an input, which may be a directory """
+    if not os.path.isdir(filename):
+        return [os.path.abspath(filename)]
+    paths = list()
+    for root, dirs, files in os.walk(filename, followlinks=True):
+        dirs.sort()
+        for name in sorted(files):
+            paths.append(os.path.abspath(os.path.join(root, name)))
+    return paths
+
+
+def _hash_file(path, file_cache, files):
+    """
+    Hash the contents of a file (following symlinks), reusing the hash from
+    the cache if the size and modification time haven't changed
+    """
+    if not os.path.exists(path):
+        return 'missing'
+    stat = os.stat(path)
+    cached = file_cache.get(path)
+    if cached is not None and cached['size'] == stat.st_size and \
+            cached['mtime_ns'] == stat.st_mtime_ns:
+        sha256 = cached['sha256']
+    else:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        sha256 = sha.hexdigest()
+    files[path] = dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                       sha256=sha256)
+    return sha256
+
+
+def _hash_content(path, store):
+    """
+    Hash the contents of a file for a memo key, using the checksum from the
+    databases' manifest if the file is (or links to) an unchanged file there
+    """
+    realpath = os.path.realpath(path)
+    if store is not None:
+        sha256 = store.get_current_sha256(realpath)
+        if sha256 is not None:
+            return sha256
+    if os.stat(realpath).st_mode & stat.S_IXUSR:
+        # e.g. the model, which is large and the same for many steps
+        return get_executable_sha256(realpath)
+    return _hash_file(realpath, _memo_file_cache, _memo_file_cache)
+
+
+@functools.lru_cache()
+def _get_code_version():
+    """
+    The polaris version and a hash of the relative paths and contents of all
+    files in the polaris package, computed once per process
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    sha = hashlib.sha256(f'{__version__}\n'.encode('utf-8'))
+    for path in _get_package_files():
+        sha.update(f'{os.path.relpath(path, package_dir)}\n'.encode('utf-8'))
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _stat_file(path, files):
+    """
+    Describe a file (following symlinks) by its size and modification time
+    """
+    if not os.path.exists(path):
+        return 'missing'
+    stat = os.stat(path)
+    files[path] = dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def _hash_attributes(step):
+    """
+    Hash the attributes of a step that aren't tied to its location in the
+    work directory, or return ``None`` if they aren't all of types that
+    :py:func:`polaris.fingerprint._get_canonical()` supports
+    """
+    attributes = {key: value for key, value in step.__dict__.items()
+                  if key not in _IDENTITY_EXCLUDED}
+    references = {id(other): f'step {other.name}' for other in
+                  step.test_case.steps.values()}
+    test_case = step.test_case
+    references[id(test_case)] = 'test_case'
+    references[id(step.component)] = 'component'
+    references[id(step.test_group)] = 'test_group'
+    references[id(step.config)] = 'config'
+    references[id(test_case.config)] = 'config'
+    try:
+        canonical = _get_canonical(attributes, references)
+    except (TypeError, RecursionError):
+        return None
+    data = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _get_canonical(value, references):
+    """
+    Convert an attribute of a step to a form that is serialized to the same
+    JSON in every session and python version.  The step's test case,
+    component, test group, config options, loggers and other steps are
+    replaced with references that are the same for identical steps in
+    different test cases.  Instances of plain classes (e.g. the options for
+    JIGSAW) are converted from their class name and attributes.  Other
+    objects raise a ``TypeError``.
+    """
+    if id(value) in references:
+        return {'<reference>': references[id(value)]}
+    if isinstance(value, logging.Logger):
+        return {'<reference>': 'logger'}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_get_canonical(item, references) for item in value]
+    if isinstance(value, dict):
+        canonical = dict()
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise TypeError(f'Dictionary key {key!r} is not a string')
+            canonical[key] = _get_canonical(item, references)
+        return canonical
+    if isinstance(value, (set, frozenset)):
+        items = [_get_canonical(item, references) for item in value]
+        return sorted(items, key=lambda item: json.dumps(item,
+                                                         sort_keys=True))
+    value_class = type(value)
+    if value_class.__module__ != 'builtins' and not callable(value) and \
+            type(value_class) is type and hasattr(value, '__dict__') and \
+            not hasattr(value_class, '__slots__'):
+        return {'<object>': f'{value_class.__module__}.'
+                            f'{value_class.__qualname__}',
+                'attributes': _get_canonical(vars(value), references)}
+    raise TypeError(f'Step attributes of type {value_class.__name__} '
+                    f'can\'t be hashed')
+
+
+def _hash_config(filename, excluded_sections=None):
+    """
+    Hash the config options for a test case, ignoring comments, the steps
+    to run and any excluded sections, which don't affect the results of a
+    step
+    """
+    config = configparser.RawConfigParser()
+    config.read(filename)
+    if config.has_option('test_case', 'steps_to_run'):
+        config.remove_option('test_case', 'steps_to_run')
+    sha = hashlib.sha256()
+    for section in sorted(config.sections()):
+        if excluded_sections is not None and section in excluded_sections:
+            continue
+        for option, value in sorted(config.items(section)):
+            sha.update(f'[{section}] {option} = {value}\n'.encode('utf-8'))
+    return sha.hexdigest()
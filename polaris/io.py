@@ -1,7 +1,15 @@
+import fcntl
+import hashlib
+import json
 import os
+import shutil
+import stat
 import sys
 import tempfile
-from typing import TYPE_CHECKING  # noqa: F401
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from typing import TYPE_CHECKING, Dict, Optional  # noqa: F401
 from urllib.parse import urlparse
 
 if TYPE_CHECKING or sys.version_info >= (3, 9, 0):
@@ -13,10 +21,262 @@ else:
 import progressbar
 import requests
 
+# the size of the chunks files are downloaded and written in
+_CHUNK_SIZE = 1024 * 1024
 
-def download(url, dest_path, config, exceptions=True):  # noqa: C901
+# the download manager collecting downloads, if any
+_active_manager = None
+
+# each thread keeps its own sessions so connections to the server are reused
+_thread_data = threading.local()
+
+# the ioctl request for cloning a file on Linux (FICLONE from linux/fs.h)
+_FICLONE = 0x40049409
+
+# the checksums of executables that have been staged, with their paths,
+# sizes and modification times as keys
+_executable_checksums: Dict[tuple, str] = dict()
+
+
+class DownloadManager:
+    """
+    A context manager that collects the files passed to
+    :py:func:`polaris.io.download()` while it is active and, when it exits,
+    downloads them all at once in a pool of threads.  Each file is only
+    downloaded once, even if several steps need it, and each thread reuses
+    its connections to the server for all of the files it downloads.  A
+    single progress bar shows how many of the files have been downloaded.
+
+    Attributes
+    ----------
+    max_workers : int
+        The maximum number of files to download at the same time
+
+    defer : bool
+        Whether to leave the downloads to another manager (see
+        :py:meth:`polaris.io.DownloadManager.update()`) rather than
+        downloading them on exit
+    """
+
+    def __init__(self, max_workers=8, defer=False):
+        """
+        Create a download manager
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            The maximum number of files to download at the same time
+
+        defer : bool, optional
+            Whether to leave the downloads to another manager rather than
+            downloading them on exit
+        """
+        self.max_workers = max_workers
+        self.defer = defer
+        # the files to download with their absolute paths as keys
+        self._requests: Dict[str, Dict] = dict()
+        self._previous = None
+
+    def __enter__(self):
+        global _active_manager
+        self._previous = _active_manager
+        _active_manager = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active_manager
+        _active_manager = self._previous
+        self._previous = None
+        if exc_type is None and not self.defer:
+            self.wait()
+
+    def __len__(self):
+        return len(self._requests)
+
+    def add(self, url, dest_path, config, exceptions=True, sha256=None,
+            database_root=None):
+        """
+        Add a file to download
+
+        Parameters
+        ----------
+        url : str
+            The URL (including file name) to download
+
+        dest_path : str
+            The path (including file name) where the downloaded file should
+            be saved
+
+        config : polaris.config.PolarisConfigParser
+            Configuration options for downloading the file
+
+        exceptions : bool, optional
+            Whether to raise an exception if the download fails
+
+        sha256 : str, optional
+            The expected SHA-256 checksum of the file
+
+        database_root : str, optional
+            The root of the database the file belongs to, if any, so the
+            file is verified against and added to the database's manifest
+            (see :py:class:`polaris.database.DatabaseStore`)
+
+        Returns
+        -------
+        dest_path : str
+            The absolute path the file will be downloaded to
+        """
+        # imported here because polaris.database uses this module
+        from polaris.database import get_group
+
+        dest_path = os.path.abspath(dest_path)
+        if dest_path in self._requests:
+            request = self._requests[dest_path]
+            request['exceptions'] = request['exceptions'] or exceptions
+        else:
+            self._requests[dest_path] = dict(
+                url=url, dest_path=dest_path,
+                check_size=config.getboolean('download', 'check_size'),
+                verify=config.getboolean('download', 'verify'),
+                exceptions=exceptions, sha256=sha256,
+                database_root=database_root, group=get_group(config))
+        return dest_path
+
+    def update(self, other):
+        """
+        Take over the downloads collected by another manager, e.g. one that
+        collected the downloads for a test case set up in another process
+
+        Parameters
+        ----------
+        other : polaris.io.DownloadManager
+            The other manager
+        """
+        for dest_path, request in other._requests.items():
+            if dest_path in self._requests:
+                self._requests[dest_path]['exceptions'] = \
+                    self._requests[dest_path]['exceptions'] or \
+                    request['exceptions']
+            else:
+                self._requests[dest_path] = request
+        other._requests = dict()
+
+    def wait(self):
+        """
+        Download the files that have been added, then fix the permissions
+        of the new files in each database (see
+        :py:meth:`polaris.database.DatabaseStore.fix_permissions()`)
+
+        Raises
+        ------
+        requests.exceptions.RequestException
+            If a file could not be downloaded and exceptions were requested
+            for it.  All of the other files are downloaded first.
+        """
+        requests_ = list(self._requests.values())
+        self._requests = dict()
+        if len(requests_) > 0:
+            self._download_all(requests_)
+
+    def _download_all(self, requests_):
+        """
+        Download files in a pool of threads, showing the progress of all of
+        them in one progress bar
+        """
+        # imported here because polaris.database uses this module
+        from polaris.database import DatabaseStore
+
+        stores = dict()
+        for request in requests_:
+            database_root = request['database_root']
+            if database_root is not None and database_root not in stores:
+                stores[database_root] = DatabaseStore(
+                    database_root, group=request['group'])
+
+        count = len(requests_)
+        print(f'Downloading (or verifying) {count} files')
+        lock = threading.Lock()
+        downloaded = [0]
+
+        def progress(size):
+            with lock:
+                downloaded[0] += size
+
+        widgets = [progressbar.Percentage(), ' ', progressbar.Bar(), ' ',
+                   progressbar.SimpleProgress(), ' files ',
+                   progressbar.Variable('size', format='{formatted_value}'),
+                   ' ', progressbar.ETA()]
+        bar = progressbar.ProgressBar(widgets=widgets, max_value=count)
+        bar.start()
+        errors = list()
+        max_workers = max(1, min(self.max_workers, count))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict()
+            for request in requests_:
+                store = None
+                if request['database_root'] is not None:
+                    store = stores[request['database_root']]
+                future = executor.submit(
+                    _download_to_store, request['url'], request['dest_path'],
+                    request['check_size'], request['verify'],
+                    request['exceptions'], progress=progress,
+                    sha256=request['sha256'], store=store)
+                futures[future] = request
+            pending = set(futures)
+            while len(pending) > 0:
+                # update the progress bar every so often, rather than every
+                # time a chunk of a file is written
+                done, pending = wait_futures(pending, timeout=0.5,
+                                             return_when=FIRST_COMPLETED)
+                for future in done:
+                    request = futures[future]
+                    error = future.exception()
+                    if error is not None:
+                        errors.append((request, error))
+                with lock:
+                    size = downloaded[0]
+                bar.update(count - len(pending), size=_sizeof_fmt(size))
+        bar.finish()
+        for store in stores.values():
+            store.fix_permissions(max_workers=self.max_workers)
+            store.write()
+
+        for request, error in errors:
+            print(f'ERROR while downloading {request["url"]}:\n'
+                  f'  {error}')
+        for request, error in errors:
+            if request['exceptions']:
+                raise error
+
+
+def get_download_manager():
+    """
+    Get the download manager collecting downloads, if any
+
+    Returns
+    -------
+    manager : polaris.io.DownloadManager or None
+        The active download manager
+    """
+    return _active_manager
+
+
+def download(url, dest_path, config, exceptions=True, immediate=False,
+             sha256=None, database_root=None):
     """
-    Download a file from a URL to the given path or path name
+    Download a file from a URL to the given path or path name.
+
+    The file is downloaded to ``<dest_path>.part`` and only moved to
+    ``dest_path`` once it is complete, so an interrupted download never
+    leaves a truncated file behind.  The next attempt resumes the download
+    where it left off if the server supports HTTP range requests.  Processes
+    downloading the same file (e.g. in several setups with the same
+    ``database_root``) take turns through a lock file, so the file is only
+    downloaded once.
+
+    If a :py:class:`polaris.io.DownloadManager` is active, the file is added
+    to its downloads and only downloaded when the manager exits, unless it
+    is already there or ``immediate=True``.
 
     Parameters
     ----------
@@ -34,32 +294,184 @@ def download(url, dest_path, config, exceptions=True):  # noqa: C901
     exceptions : bool, optional
         Whether to raise exceptions when the download fails
 
+    immediate : bool, optional
+        Whether to download the file right away even if a download manager
+        is active, e.g. because the file needs to be copied
+
+    sha256 : str, optional
+        The expected SHA-256 checksum of the file.  If given, a downloaded
+        file with a different checksum is removed and an error is raised.
+
+    database_root : str, optional
+        The root of the database the file belongs to, if any.  If given, a
+        file that is already there is verified against the database's
+        manifest (and downloaded again if it doesn't match) and a newly
+        downloaded file is added to it.  See
+        :py:class:`polaris.database.DatabaseStore`.
+
     Returns
     -------
     dest_path : str
-        The resulting file name if the download was successful, or None if not
+        The resulting file name if the download was successful (or will be
+        downloaded by the active download manager), or None if not
     """
-
-    in_file_name = os.path.basename(urlparse(url).path)
-    dest_path = os.path.abspath(dest_path)
-    out_file_name = os.path.basename(dest_path)
-
     do_download = config.getboolean('download', 'download')
     check_size = config.getboolean('download', 'check_size')
     verify = config.getboolean('download', 'verify')
-
     if not do_download:
+        dest_path = os.path.abspath(dest_path)
         if not os.path.exists(dest_path):
             raise OSError(f'File not found and downloading is disabled: '
                           f'{dest_path}')
         return dest_path
 
+    if not check_size and database_root is None and \
+            os.path.exists(dest_path):
+        return os.path.abspath(dest_path)
+
+    if _active_manager is not None and not immediate:
+        return _active_manager.add(url, dest_path, config, exceptions,
+                                   sha256, database_root)
+
+    if database_root is None:
+        return _download_with_lock(url, dest_path, check_size, verify,
+                                   exceptions, sha256=sha256)
+
+    # imported here because polaris.database uses this module
+    from polaris.database import DatabaseStore, get_group
+
+    store = DatabaseStore(database_root, group=get_group(config))
+    try:
+        return _download_to_store(url, dest_path, check_size, verify,
+                                  exceptions, sha256=sha256, store=store)
+    finally:
+        store.fix_permissions()
+        store.write()
+
+
+def _download_to_store(url, dest_path, check_size, verify, exceptions,
+                       progress=None, sha256=None, store=None):
+    """
+    Download a file that belongs to a database (if ``store`` is given),
+    verifying it against the database's manifest if it is already there and
+    adding it to the manifest if it is downloaded
+    """
+    if store is None:
+        return _download_with_lock(url, dest_path, check_size, verify,
+                                   exceptions, progress, sha256)
+    dest_path = os.path.abspath(dest_path)
+    if sha256 is None:
+        sha256 = store.get_sha256(dest_path)
+    if os.path.exists(dest_path) and store.verify(dest_path, sha256):
+        store.touch(dest_path)
+        return dest_path
+    dest_path = _download_with_lock(url, dest_path, check_size, verify,
+                                    exceptions, progress, sha256)
+    if dest_path is not None:
+        # if we had a checksum, the download was checked against it
+        store.add(dest_path, sha256)
+        store.touch(dest_path)
+    return dest_path
+
+
+def _download_with_lock(url, dest_path, check_size, verify, exceptions,
+                        progress=None, sha256=None):
+    """
+    Download a file once no other process is downloading it
+    """
+    dest_path = os.path.abspath(dest_path)
+    directory = os.path.dirname(dest_path)
+    try:
+        os.makedirs(directory)
+    except OSError:
+        pass
+
+    # other processes (e.g. ``polaris setup --jobs``) may need the same file,
+    # so only one of them downloads it at a time and the others find it
+    # already downloaded
+    lock_filename = os.path.join(directory,
+                                 f'.{os.path.basename(dest_path)}.lock')
+    lock_fd = _lock(lock_filename)
+    if lock_fd is None:
+        # we can't lock the file (e.g. the directory is read-only)
+        return _download(url, dest_path, check_size, verify, exceptions,
+                         progress, sha256)
+
+    try:
+        return _download(url, dest_path, check_size, verify, exceptions,
+                         progress, sha256)
+    finally:
+        _unlock(lock_filename, lock_fd)
+
+
+def _lock(lock_filename):
+    """
+    Create (if needed) and lock a lock file, returning its file descriptor
+    or ``None`` if it can't be opened.  The lock file is removed again by
+    :py:func:`polaris.io._unlock()`, so a process that was waiting on it
+    may end up holding a lock on a file that is gone, in which case it
+    tries again with a new one.
+    """
+    while True:
+        try:
+            # only reading is needed to lock the file, so group members can
+            # lock a file that another user created
+            lock_fd = os.open(lock_filename, os.O_RDONLY | os.O_CREAT, 0o664)
+        except OSError:
+            return None
+        try:
+            os.fchmod(lock_fd, 0o664)
+        except OSError:
+            # another user created the lock file
+            pass
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            current = os.path.samestat(os.fstat(lock_fd),
+                                       os.stat(lock_filename))
+        except OSError:
+            current = False
+        if current:
+            return lock_fd
+        os.close(lock_fd)
+
+
+def _unlock(lock_filename, lock_fd):
+    """
+    Remove a lock file from :py:func:`polaris.io._lock()` (while still
+    holding the lock, so no other process can lock it in the meantime) and
+    release the lock
+    """
+    try:
+        os.remove(lock_filename)
+    except OSError:
+        pass
+    fcntl.flock(lock_fd, fcntl.LOCK_UN)
+    os.close(lock_fd)
+
+
+def _download(url, dest_path, check_size, verify, exceptions,  # noqa: C901
+              progress=None, sha256=None, resume=True):
+    """
+    Download a file once the lock on the destination has been acquired.  If
+    ``progress`` is given, it is called with the size of each chunk that is
+    written instead of printing the progress of this file.
+
+    The file is downloaded to ``<dest_path>.part``, continuing from where an
+    earlier, interrupted download left off if the server supports it, and
+    only renamed to ``dest_path`` once it has the expected size and (if
+    ``sha256`` is given) checksum.  With ``resume=False``, the download
+    starts over even if there is a partial file.
+    """
+
+    in_file_name = os.path.basename(urlparse(url).path)
+    dest_path = os.path.abspath(dest_path)
+    out_file_name = os.path.basename(dest_path)
+    part_path = f'{dest_path}.part'
+
     if not check_size and os.path.exists(dest_path):
         return dest_path
 
-    session = requests.Session()
-    if not verify:
-        session.verify = False
+    session = _get_session(verify)
 
     # dest_path contains full path, so we need to make the relevant
     # subdirectories if they do not exist already
@@ -69,9 +481,17 @@ def download(url, dest_path, config, exceptions=True):  # noqa: C901
     except OSError:
         pass
 
+    offset = 0
+    headers = dict()
+    if resume and os.path.exists(part_path) and \
+            not os.path.exists(dest_path):
+        # pick up where an interrupted download left off
+        offset = os.path.getsize(part_path)
+        if offset > 0:
+            headers['Range'] = f'bytes={offset}-'
+
     try:
-        response = session.get(url, stream=True)
-        total_size = response.headers.get('content-length')
+        response = session.get(url, stream=True, headers=headers)
     except requests.exceptions.RequestException:
         if exceptions:
             raise
@@ -79,6 +499,17 @@ def download(url, dest_path, config, exceptions=True):  # noqa: C901
             print(f'  {url} could not be reached!')
             return None
 
+    if response.status_code == 416 and offset > 0:
+        # we asked for the bytes after the end of the file, so either the
+        # partial file is already complete or it isn't the same file
+        response.close()
+        if _get_range_total(response) == offset:
+            return _finish_download(part_path, dest_path, offset, sha256,
+                                    exceptions)
+        # start over once (if the server still refuses, that's an error)
+        return _download(url, dest_path, check_size, verify, exceptions,
+                         progress, sha256, resume=False)
+
     try:
         response.raise_for_status()
     except requests.exceptions.HTTPError as e:
@@ -89,62 +520,285 @@ def download(url, dest_path, config, exceptions=True):  # noqa: C901
             print(e)
             return None
 
-    if total_size is None:
-        # no content length header
-        if not os.path.exists(dest_path):
-            dest_dir = os.path.dirname(dest_path)
-            with open(dest_path, 'wb') as f:
-                print(f'Downloading {in_file_name}\n'
-                      f'  to {dest_dir}...')
-                try:
-                    f.write(response.content)
-                except requests.exceptions.RequestException:
-                    if exceptions:
-                        raise
-                    else:
-                        print(f'  {in_file_name} failed!')
-                        return None
-                else:
-                    print('  {in_file_name} done.')
+    if response.status_code == 206:
+        total_size = _get_range_total(response)
     else:
-        # we can do the download in chunks and use a progress bar, yay!
+        # the server sent the whole file
+        offset = 0
+        total_size = response.headers.get('content-length')
+        if total_size is not None:
+            total_size = int(total_size)
 
-        total_size_int = int(total_size)
-        if os.path.exists(dest_path) and \
-                total_size_int == os.path.getsize(dest_path):
-            # we already have the file, so just return
-            return dest_path
+    if total_size is not None and os.path.exists(dest_path) and \
+            total_size == os.path.getsize(dest_path):
+        # we already have the file, so just return
+        response.close()
+        return dest_path
 
-        if out_file_name == in_file_name:
-            file_names = in_file_name
+    if out_file_name == in_file_name:
+        file_names = in_file_name
+    else:
+        file_names = f'{in_file_name} as {out_file_name}'
+    dest_dir = os.path.dirname(dest_path)
+    bar = None
+    if progress is None:
+        if total_size is None:
+            print(f'Downloading {file_names}\n'
+                  f'  to {dest_dir}...')
         else:
-            file_names = f'{in_file_name} as {out_file_name}'
-        dest_dir = os.path.dirname(dest_path)
-        print(f'Downloading {file_names} ({_sizeof_fmt(total_size_int)})\n'
-              f'  to {dest_dir}')
-        widgets = [progressbar.Percentage(), ' ', progressbar.Bar(),
-                   ' ', progressbar.ETA()]
-        bar = progressbar.ProgressBar(widgets=widgets,
-                                      max_value=total_size_int).start()
-        size = 0
-        with open(dest_path, 'wb') as f:
-            try:
-                for data in response.iter_content(chunk_size=4096):
-                    size += len(data)
-                    f.write(data)
+            print(f'Downloading {file_names} ({_sizeof_fmt(total_size)})\n'
+                  f'  to {dest_dir}')
+            if offset > 0:
+                print(f'  resuming after {_sizeof_fmt(offset)}')
+            # we can use a progress bar, yay!
+            widgets = [progressbar.Percentage(), ' ', progressbar.Bar(),
+                       ' ', progressbar.ETA()]
+            bar = progressbar.ProgressBar(widgets=widgets,
+                                          max_value=total_size).start()
+            bar.update(offset)
+
+    size = offset
+    mode = 'ab' if offset > 0 else 'wb'
+    with open(part_path, mode) as f:
+        try:
+            for data in response.iter_content(chunk_size=_CHUNK_SIZE):
+                size += len(data)
+                f.write(data)
+                if bar is not None:
                     bar.update(size)
+                elif progress is not None:
+                    progress(len(data))
+            if bar is not None:
                 bar.finish()
-            except requests.exceptions.RequestException:
-                if exceptions:
-                    raise
-                else:
-                    print(f'  {in_file_name} failed!')
-                    return None
+        except requests.exceptions.RequestException:
+            # keep the partial file so the next attempt can resume
+            if exceptions:
+                raise
             else:
-                print(f'  {in_file_name} done.')
+                print(f'  {in_file_name} failed!')
+                return None
+
+    if total_size is None:
+        total_size = size
+    dest_path = _finish_download(part_path, dest_path, total_size, sha256,
+                                 exceptions)
+    if dest_path is not None and progress is None:
+        print(f'  {in_file_name} done.')
+    return dest_path
+
+
+def _finish_download(part_path, dest_path, total_size, sha256, exceptions):
+    """
+    Check the size and checksum of a downloaded file and move it into place
+    """
+    size = os.path.getsize(part_path)
+    error: Optional[Exception] = None
+    if size != total_size:
+        # keep the partial file so the next attempt can resume
+        error = OSError(f'Only {size} of {total_size} bytes of '
+                        f'{os.path.basename(dest_path)} were downloaded')
+    elif sha256 is not None:
+        checksum = compute_sha256(part_path)
+        if checksum != sha256:
+            os.remove(part_path)
+            error = ValueError(
+                f'The checksum of the downloaded file '
+                f'{os.path.basename(dest_path)} is {checksum}, not the '
+                f'expected {sha256}')
+    if error is not None:
+        if exceptions:
+            raise error
+        print(f'ERROR while downloading {os.path.basename(dest_path)}:')
+        print(error)
+        return None
+    os.replace(part_path, dest_path)
     return dest_path
 
 
+def _get_range_total(response):
+    """
+    The total size of a file from the ``Content-Range`` header of a response
+    to a request for part of the file, if the server gave it
+    """
+    content_range = response.headers.get('content-range')
+    if content_range is None or '/' not in content_range:
+        return None
+    total = content_range.rsplit('/', 1)[1].strip()
+    if not total.isdigit():
+        return None
+    return int(total)
+
+
+def compute_sha256(filename):
+    """
+    Compute the SHA-256 checksum of a file
+
+    Parameters
+    ----------
+    filename : str
+        The file
+
+    Returns
+    -------
+    checksum : str
+        The checksum as a hexadecimal string
+    """
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for data in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            sha.update(data)
+    return sha.hexdigest()
+
+
+def _get_session(verify):
+    """
+    Get this thread's session for downloading files, so connections to the
+    server are kept alive and reused for the next file
+    """
+    if not hasattr(_thread_data, 'sessions'):
+        _thread_data.sessions = dict()
+    sessions = _thread_data.sessions
+    if verify not in sessions:
+        session = requests.Session()
+        if not verify:
+            session.verify = False
+        sessions[verify] = session
+    return sessions[verify]
+
+
+def stage_file(source, dest_path, hardlink=False):
+    """
+    Put a copy of a file at the given path as cheaply as the file system
+    allows: a reflink (a copy-on-write clone that shares the data with the
+    source until one of them is modified), then, if allowed, a hard link and,
+    failing those, a regular copy.  The permissions of the source are copied
+    and an existing file at ``dest_path`` is replaced.
+
+    Parameters
+    ----------
+    source : str
+        The file to copy
+
+    dest_path : str
+        The path of the copy
+
+    hardlink : bool, optional
+        Whether a hard link may be used.  This is only safe if neither file
+        will be modified in place, since they are the same file.
+
+    Returns
+    -------
+    method : {'reflink', 'hardlink', 'copy'}
+        How the file was staged
+    """
+    directory = os.path.dirname(os.path.abspath(dest_path))
+    temp_path = os.path.join(
+        directory, f'.{os.path.basename(dest_path)}.{os.getpid()}.'
+                   f'{threading.get_ident()}.stage')
+    method = None
+    try:
+        with open(source, 'rb') as src, open(temp_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        method = 'reflink'
+    except OSError:
+        _remove_if_exists(temp_path)
+    if method is None and hardlink:
+        try:
+            os.link(source, temp_path)
+            method = 'hardlink'
+        except OSError:
+            _remove_if_exists(temp_path)
+    if method is None:
+        shutil.copyfile(source, temp_path)
+        method = 'copy'
+    try:
+        if method != 'hardlink':
+            shutil.copymode(source, temp_path)
+        os.replace(temp_path, dest_path)
+    except BaseException:
+        _remove_if_exists(temp_path)
+        raise
+    return method
+
+
+def get_executable_sha256(executable):
+    """
+    Get the SHA-256 checksum of a (typically large) executable, which is
+    computed only once per executable path, size and modification time and
+    cached in ``~/.cache/polaris/executable_checksums.json`` for other
+    processes
+
+    Parameters
+    ----------
+    executable : str
+        The executable
+
+    Returns
+    -------
+    checksum : str
+        The checksum as a hexadecimal string
+    """
+    executable = os.path.abspath(executable)
+    exe_stat = os.stat(executable)
+    key = (executable, exe_stat.st_size, exe_stat.st_mtime_ns)
+    if key in _executable_checksums:
+        return _executable_checksums[key]
+
+    cache_filename = _get_executable_cache_filename()
+    try:
+        with open(cache_filename) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = dict()
+    entry = cache.get(executable)
+    if entry is not None and entry.get('size') == exe_stat.st_size and \
+            entry.get('mtime_ns') == exe_stat.st_mtime_ns:
+        sha256 = entry['sha256']
+    else:
+        sha256 = compute_sha256(executable)
+        cache[executable] = dict(size=exe_stat.st_size,
+                                 mtime_ns=exe_stat.st_mtime_ns,
+                                 sha256=sha256)
+        temp_filename = f'{cache_filename}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+            with open(temp_filename, 'w') as f:
+                json.dump(cache, f)
+            os.replace(temp_filename, cache_filename)
+        except OSError:
+            # we can do without the cache
+            _remove_if_exists(temp_filename)
+    _executable_checksums[key] = sha256
+    return sha256
+
+
+def stage_executable(executable, dest_path):
+    """
+    Put a copy of a model executable at the given path that won't change if
+    the model is rebuilt.  All copies of the same executable share one copy
+    with a name based on its contents,
+    ``<build dir>/.polaris_executables/<sha256>/<name>``, which is read-only
+    so the copies can be hard links to it.
+
+    Parameters
+    ----------
+    executable : str
+        The model executable
+
+    dest_path : str
+        The path of the copy
+    """
+    shared_path = _get_shared_executable(executable)
+    if shared_path is None:
+        # we can't write to the build directory, so make a copy of our own
+        stage_file(executable, dest_path)
+        return
+    if os.path.exists(dest_path) and os.path.samefile(shared_path,
+                                                      dest_path):
+        return
+    stage_file(shared_path, dest_path, hardlink=True)
+
+
 def symlink(target, link_name, overwrite=True):
     """
     From https://stackoverflow.com/a/55742015/7728169
@@ -197,6 +851,48 @@ def symlink(target, link_name, overwrite=True):
         raise
 
 
+def _get_shared_executable(executable):
+    """
+    Get the read-only copy of an executable named after its contents,
+    making it if needed, or ``None`` if it can't be made
+    """
+    executable = os.path.abspath(executable)
+    sha256 = get_executable_sha256(executable)
+    shared_dir = os.path.join(os.path.dirname(executable),
+                              '.polaris_executables', sha256)
+    shared_path = os.path.join(shared_dir, os.path.basename(executable))
+    if os.path.exists(shared_path):
+        return shared_path
+    temp_path = f'{shared_path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(shared_dir, exist_ok=True)
+        # not a hard link, since the build may modify the executable
+        stage_file(executable, temp_path)
+        mode = stat.S_IMODE(os.stat(temp_path).st_mode)
+        os.chmod(temp_path,
+                 mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+        os.replace(temp_path, shared_path)
+    except OSError:
+        _remove_if_exists(temp_path)
+        return None
+    return shared_path
+
+
+def _get_executable_cache_filename():
+    """ The cache file for the checksums of executables """
+    cache_dir = os.environ.get('XDG_CACHE_HOME',
+                               os.path.expanduser('~/.cache'))
+    return os.path.join(cache_dir, 'polaris', 'executable_checksums.json')
+
+
+def _remove_if_exists(filename):
+    """ Remove a file if it exists """
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
 # From https://stackoverflow.com/a/1094933/7728169
 def _sizeof_fmt(num, suffix='B'):
     """
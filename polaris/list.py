@@ -3,8 +3,8 @@ import os
 import re
 import sys
 
-from polaris.components import get_components
 from polaris.io import imp_res
+from polaris.registry import get_test_case_index
 
 
 def list_cases(test_expr=None, number=None, verbose=False):
@@ -23,16 +23,10 @@ def list_cases(test_expr=None, number=None, verbose=False):
         Whether to print details of each test or just the subdirectories.
         When applied to suites, verbose will list the tests in the suite.
     """
-    components = get_components()
-
     if number is None:
         print('Testcases:')
 
-    test_cases = []
-    for component in components:
-        for test_group in component.test_groups.values():
-            for test_case in test_group.test_cases.values():
-                test_cases.append(test_case)
+    test_cases = get_test_case_index()
 
     for test_number, test_case in enumerate(test_cases):
         print_number = False
@@ -40,7 +34,7 @@ def list_cases(test_expr=None, number=None, verbose=False):
         if number is not None:
             if number == test_number:
                 print_test = True
-        elif test_expr is None or re.match(test_expr, test_case.path):
+        elif test_expr is None or re.match(test_expr, test_case['path']):
             print_test = True
             print_number = True
 
@@ -52,26 +46,26 @@ def list_cases(test_expr=None, number=None, verbose=False):
                 prefix = ''
             if verbose:
                 lines = list()
-                to_print = {'path': test_case.path,
-                            'name': test_case.name,
-                            'component': test_case.component.name,
-                            'test group': test_case.test_group.name,
-                            'subdir': test_case.subdir}
+                to_print = {'path': test_case['path'],
+                            'name': test_case['name'],
+                            'component': test_case['component'],
+                            'test group': test_case['test_group'],
+                            'subdir': test_case['subdir']}
                 for key in to_print:
                     key_string = f'{key}: '.ljust(15)
                     lines.append(f'{prefix}{key_string}{to_print[key]}')
                     if print_number:
                         prefix = '      '
                 lines.append(f'{prefix}steps:')
-                for step in test_case.steps.values():
-                    if step.name == step.subdir:
-                        lines.append(f'{prefix} - {step.name}')
+                for step_name, step_subdir in test_case['steps']:
+                    if step_name == step_subdir:
+                        lines.append(f'{prefix} - {step_name}')
                     else:
-                        lines.append(f'{prefix} - {step.name}: {step.subdir}')
+                        lines.append(f'{prefix} - {step_name}: {step_subdir}')
                 lines.append('')
                 print_string = '\n'.join(lines)
             else:
-                print_string = f'{prefix}{test_case.path}'
+                print_string = f'{prefix}{test_case["path"]}'
 
             print(print_string)
 
@@ -90,6 +84,8 @@ def list_machines():
 
 def list_suites(components=None, verbose=False):
     if components is None:
+        # importing the components imports all of their test cases
+        from polaris.components import get_components
         components = [component.name for component in get_components()]
     print('Suites:')
     for component in components:
@@ -0,0 +1,439 @@
+import importlib
+import json
+import os
+import pickle
+from collections.abc import Mapping
+
+from polaris.config import PolarisConfigParser
+from polaris.dag import StepGraph
+from polaris.step import Step
+from polaris.version import __version__
+
+MANIFEST_FILENAME = 'step.json'
+STATE_FILENAME = 'step.pickle'
+TEST_CASE_FILENAME = 'test_case.pickle'
+
+# the version of the format of step manifests.  Increment this whenever the
+# format changes in a way that older versions of polaris can't read, so that
+# work directories from incompatible versions are detected
+MANIFEST_VERSION = 1
+
+# the same for the index of test cases in a suite's pickle file
+SUITE_INDEX_VERSION = 1
+
+
+def write_step_manifest(test_case, step):
+    """
+    Write a manifest for running a step that has been set up to
+    ``step.json`` in its work directory, along with the attributes of the
+    step and its test case that were set in their constructors and during
+    setup to ``step.pickle``
+
+    The manifest contains the import paths of the classes of the step and the
+    test case it belongs to, the resources for the step and its resolved
+    input and output files.  Only the step itself and the attributes of the
+    test case (not its other steps) are pickled.  Other steps, the component,
+    test group and config options are stored as references that
+    :py:func:`polaris.manifest.load_step()` resolves when the step is loaded.
+
+    Parameters
+    ----------
+    test_case : polaris.TestCase
+        The test case the step belongs to
+
+    step : polaris.Step
+        The step, which must have been set up
+    """
+    component = test_case.component
+    test_group = test_case.test_group
+    manifest = dict(
+        version=MANIFEST_VERSION,
+        polaris_version=__version__,
+        component=dict(name=component.name,
+                       cls=_get_class_path(component)),
+        test_group=dict(name=test_group.name,
+                        cls=_get_class_path(test_group)),
+        test_case=dict(name=test_case.name,
+                       subdir=test_case.subdir,
+                       path=test_case.path,
+                       cls=_get_class_path(test_case),
+                       work_dir=test_case.work_dir),
+        step=dict(name=step.name,
+                  subdir=step.subdir,
+                  path=step.path,
+                  cls=_get_class_path(step),
+                  work_dir=step.work_dir,
+                  base_work_dir=step.base_work_dir,
+                  config_filename=step.config_filename),
+        resources=dict(cpus_per_task=step.cpus_per_task,
+                       min_cpus_per_task=step.min_cpus_per_task,
+                       ntasks=step.ntasks,
+                       min_tasks=step.min_tasks,
+                       openmp_threads=step.openmp_threads,
+                       max_memory=step.max_memory),
+        inputs=step.inputs,
+        outputs=step.outputs,
+        cached=step.cached,
+        run_as_subprocess=step.run_as_subprocess,
+        args=step.args)
+
+    state_filename = os.path.join(step.work_dir, STATE_FILENAME)
+    with open(state_filename, 'wb') as handle:
+        pickler = _StepPickler(handle, test_case, step)
+        pickler.dump((test_case, step))
+
+    manifest_filename = os.path.join(step.work_dir, MANIFEST_FILENAME)
+    with open(manifest_filename, 'w') as handle:
+        json.dump(manifest, handle, indent=1)
+
+
+def read_step_manifest(work_dir):
+    """
+    Read the manifest of a step without loading the step itself
+
+    Parameters
+    ----------
+    work_dir : str
+        The work directory of the step
+
+    Returns
+    -------
+    manifest : dict
+        The manifest of the step
+    """
+    filename = os.path.join(work_dir, MANIFEST_FILENAME)
+    if not os.path.exists(filename):
+        raise OSError(
+            f'No {MANIFEST_FILENAME} was found in {work_dir}.  The step may '
+            f'have been set up with an older version of polaris.  Please set '
+            f'it up again.')
+    with open(filename) as handle:
+        manifest = json.load(handle)
+    version = manifest.get('version')
+    if version != MANIFEST_VERSION:
+        raise ValueError(
+            f'The step in {work_dir} was set up with polaris '
+            f'{manifest.get("polaris_version")}, which wrote version '
+            f'{version} of the step manifest, but this version of polaris '
+            f'reads version {MANIFEST_VERSION}.  Please set up the step '
+            f'again.')
+    return manifest
+
+
+def load_step(work_dir='.'):
+    """
+    Load a step that has been set up, and the test case it belongs to, from
+    its manifest
+
+    The test case has the attributes it had after setup but only contains
+    this step, so loading a step doesn't require loading (or importing the
+    modules of) the other steps in the test case.  Other steps that this step
+    refers to are loaded from their own manifests.  The config options are
+    read from the test case's config file.
+
+    Parameters
+    ----------
+    work_dir : str, optional
+        The work directory of the step
+
+    Returns
+    -------
+    test_case : polaris.TestCase
+        The test case the step belongs to
+
+    step : polaris.Step
+        The step
+    """
+    manifest = read_step_manifest(work_dir)
+    step_info = manifest['step']
+    # make sure the classes still exist to give a helpful error message if not
+    for kind in ['component', 'test_group', 'test_case', 'step']:
+        _import_class(manifest[kind]['cls'], work_dir)
+
+    config = PolarisConfigParser()
+    config.add_from_file(os.path.join(work_dir,
+                                      step_info['config_filename']))
+
+    state_filename = os.path.join(work_dir, STATE_FILENAME)
+    with open(state_filename, 'rb') as handle:
+        unpickler = _StepUnpickler(handle, manifest, config)
+        test_case, step = unpickler.load()
+    unpickler.steps[step.name] = step
+
+    step.set_resources(**manifest['resources'])
+    step.inputs = manifest['inputs']
+    step.outputs = manifest['outputs']
+    step.cached = manifest['cached']
+    step.run_as_subprocess = manifest['run_as_subprocess']
+    step.args = manifest['args']
+    return test_case, step
+
+
+def write_test_case(test_case):
+    """
+    Write ``test_case.pickle`` to the work directory of a test case that has
+    been set up.  This file lets the test case be run on its own and is
+    where test suites load the test case from when it is about to run.
+
+    Parameters
+    ----------
+    test_case : polaris.TestCase
+        The test case, whose steps must have been set up
+    """
+    test_cases = {test_case.path: test_case}
+    graph = StepGraph.from_test_cases(test_cases)
+    test_suite = {'name': 'test_case',
+                  'test_cases': test_cases,
+                  'work_dir': test_case.work_dir,
+                  'graph': graph.to_dict()}
+    filename = os.path.join(test_case.work_dir, TEST_CASE_FILENAME)
+    with open(filename, 'wb') as handle:
+        pickle.dump(test_suite, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def write_suite_index(filename, name, test_cases, work_dir, graph):
+    """
+    Write the pickle file for a test suite as an index of its test cases
+    rather than the test cases themselves.  The index only contains plain
+    python data: the work directory and config file of each test case and
+    the graph of dependencies between steps.  The test cases are loaded from
+    their own ``test_case.pickle`` files when they are needed.
+
+    Parameters
+    ----------
+    filename : str
+        The path of the pickle file
+
+    name : str
+        The name of the test suite
+
+    test_cases : dict of polaris.TestCase
+        The test cases in the suite, which must have been set up, with their
+        paths as keys
+
+    work_dir : str
+        The base work directory
+
+    graph : polaris.dag.StepGraph
+        The resolved graph of dependencies between steps
+    """
+    entries = dict()
+    for path, test_case in test_cases.items():
+        entries[path] = dict(work_dir=test_case.work_dir,
+                             config_filename=test_case.config_filename)
+    index = dict(version=SUITE_INDEX_VERSION,
+                 polaris_version=__version__,
+                 name=name,
+                 work_dir=work_dir,
+                 test_cases=entries,
+                 graph=graph.to_dict())
+    with open(filename, 'wb') as handle:
+        pickle.dump(index, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_suite(filename):
+    """
+    Load a test suite (or a test case) from its pickle file
+
+    Parameters
+    ----------
+    filename : str
+        The path of the pickle file for a test suite or ``test_case.pickle``
+
+    Returns
+    -------
+    test_suite : dict
+        The ``name`` and base ``work_dir`` of the suite, its ``test_cases``
+        with their paths as keys and the ``graph`` of dependencies between
+        steps as a :py:class:`polaris.dag.StepGraph`.  For a test suite, the
+        test cases are a :py:class:`polaris.manifest.TestCaseIndex`, which
+        loads each test case when it is accessed.
+    """
+    with open(filename, 'rb') as handle:
+        test_suite = pickle.load(handle)
+
+    if 'version' in test_suite:
+        version = test_suite['version']
+        if version != SUITE_INDEX_VERSION:
+            raise ValueError(
+                f'{filename} was written by polaris '
+                f'{test_suite.get("polaris_version")}, which wrote version '
+                f'{version} of the suite index, but this version of polaris '
+                f'reads version {SUITE_INDEX_VERSION}.  Please set up the '
+                f'suite again.')
+        test_suite['test_cases'] = TestCaseIndex(test_suite['test_cases'])
+
+    graph = test_suite.get('graph')
+    if graph is None:
+        # an older suite without a graph of step dependencies
+        graph = StepGraph.from_test_cases(test_suite['test_cases'])
+    elif isinstance(graph, dict):
+        graph = StepGraph.from_dict(graph)
+    test_suite['graph'] = graph
+    return test_suite
+
+
+class TestCaseIndex(Mapping):
+    """
+    The test cases in a test suite, each of which is loaded from the
+    ``test_case.pickle`` file in its work directory when it is accessed.
+    Test cases are not kept after they are returned, so a suite can run its
+    test cases one at a time without holding all of them in memory.
+
+    Attributes
+    ----------
+    entries : dict
+        The work directory (``work_dir``) and config file name
+        (``config_filename``) of each test case, with the paths of the test
+        cases as keys
+    """
+
+    def __init__(self, entries):
+        """
+        Create an index of test cases
+
+        Parameters
+        ----------
+        entries : dict
+            The work directory (``work_dir``) and config file name
+            (``config_filename``) of each test case, with the paths of the
+            test cases as keys
+        """
+        self.entries = entries
+
+    def __getitem__(self, path):
+        entry = self.entries[path]
+        filename = os.path.join(entry['work_dir'], TEST_CASE_FILENAME)
+        with open(filename, 'rb') as handle:
+            test_suite = pickle.load(handle)
+        return test_suite['test_cases'][path]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_config_filename(self, path):
+        """
+        Get the config file of a test case without loading the test case
+
+        Parameters
+        ----------
+        path : str
+            The path of the test case
+
+        Returns
+        -------
+        filename : str
+            The absolute path of the config file
+        """
+        entry = self.entries[path]
+        return os.path.join(entry['work_dir'], entry['config_filename'])
+
+
+class _StepPickler(pickle.Pickler):
+    """
+    A pickler that stores references to the component, test group, config
+    options and the test case's other steps in place of the objects
+    themselves
+    """
+    def __init__(self, file, test_case, step):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.test_case = test_case
+        self.step = step
+
+    def persistent_id(self, obj):
+        test_case = self.test_case
+        if obj is test_case.component:
+            return 'component'
+        if obj is test_case.test_group:
+            return 'test_group'
+        if obj is test_case.steps:
+            return 'steps'
+        if isinstance(obj, PolarisConfigParser):
+            return 'config'
+        if isinstance(obj, Step) and obj is not self.step:
+            return 'step', obj.path
+        return None
+
+
+class _StepUnpickler(pickle.Unpickler):
+    """
+    An unpickler that resolves the references stored by ``_StepPickler``
+    """
+    def __init__(self, file, manifest, config):
+        super().__init__(file)
+        self.manifest = manifest
+        self.config = config
+        self.steps = dict()
+        self.component = None
+        self.test_group = None
+
+    def persistent_load(self, pid):
+        if pid == 'component':
+            return self._get_component()
+        if pid == 'test_group':
+            return self._get_test_group()
+        if pid == 'steps':
+            return self.steps
+        if pid == 'config':
+            return self.config
+        if isinstance(pid, tuple) and pid[0] == 'step':
+            # another step of the test case is referenced by this step
+            base_work_dir = self.manifest['step']['base_work_dir']
+            _, other_step = load_step(os.path.join(base_work_dir, pid[1]))
+            return other_step
+        raise pickle.UnpicklingError(f'Unexpected reference {pid}')
+
+    def _get_component(self):
+        """
+        The component, without its test groups, which aren't needed to run a
+        step
+        """
+        if self.component is None:
+            info = self.manifest['component']
+            cls = _import_class(info['cls'])
+            component = cls.__new__(cls)
+            component.name = info['name']
+            component.test_groups = dict()
+            component.cached_files = dict()
+            self.component = component
+        return self.component
+
+    def _get_test_group(self):
+        """
+        The test group, without its test cases, which aren't needed to run a
+        step
+        """
+        if self.test_group is None:
+            info = self.manifest['test_group']
+            cls = _import_class(info['cls'])
+            test_group = cls.__new__(cls)
+            test_group.name = info['name']
+            test_group.component = self._get_component()
+            test_group.descriptors = dict()
+            self.test_group = test_group
+        return self.test_group
+
+
+def _get_class_path(obj):
+    """ The import path of the class of an object """
+    cls = type(obj)
+    return f'{cls.__module__}:{cls.__qualname__}'
+
+
+def _import_class(class_path, work_dir=None):
+    """ Import a class from its import path """
+    module_name, qualname = class_path.split(':')
+    try:
+        obj = importlib.import_module(module_name)
+        for name in qualname.split('.'):
+            obj = getattr(obj, name)
+    except (ImportError, AttributeError):
+        location = '' if work_dir is None else f' in {work_dir}'
+        raise ValueError(
+            f'The class {module_name}.{qualname} needed to run the step'
+            f'{location} no longer exists.  Please set up the step '
+            f'again.') from None
+    return obj
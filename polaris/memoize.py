@@ -0,0 +1,258 @@
+import json
+import os
+import shutil
+import time
+
+from polaris.database import DatabaseStore, get_group, parse_size
+from polaris.fingerprint import compute_memo_key
+from polaris.io import compute_sha256, stage_file, symlink
+from polaris.version import __version__
+
+MEMO_DIRNAME = 'step_outputs'
+MEMO_FILENAME = 'memo.json'
+
+
+def get_memo_key(step, config):
+    """
+    Get the key under which the outputs of a step are memoized (see
+    :py:func:`polaris.fingerprint.compute_memo_key()`), if memoization is
+    enabled with the ``enabled`` config option in the ``memoize`` section
+    and the step hasn't opted out of it
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step, whose inputs must all exist
+
+    config : polaris.config.PolarisConfigParser
+        Config options for the test case
+
+    Returns
+    -------
+    key : str or None
+        The key, or ``None`` if the step's outputs aren't memoized
+    """
+    if not step.memoize or not _is_enabled(config):
+        return None
+    database_root = config.get('paths', 'database_root')
+    store = DatabaseStore(database_root)
+    return compute_memo_key(step, store)
+
+
+def restore_outputs(step, config, key):
+    """
+    Link the outputs of a step to the memoized outputs of an earlier run of
+    a step with the same key, if there are any
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step
+
+    config : polaris.config.PolarisConfigParser
+        Config options for the test case
+
+    key : str
+        The key from :py:func:`polaris.memoize.get_memo_key()`
+
+    Returns
+    -------
+    memo_dir : str or None
+        The directory with the memoized outputs that the step's outputs now
+        link to, or ``None`` if there aren't any and the step has to run
+    """
+    database_root = config.get('paths', 'database_root')
+    memo_dir = _get_memo_dir(database_root, key)
+    memo = _read_memo(memo_dir)
+    if memo is None:
+        return None
+
+    store = DatabaseStore(database_root, group=get_group(config))
+    targets = list()
+    for output in step.outputs:
+        name = os.path.relpath(output, step.work_dir)
+        sha256 = memo['outputs'].get(name)
+        target = os.path.join(memo_dir, name)
+        if sha256 is None or not os.path.isfile(target) or \
+                _get_sha256(store, target) != sha256:
+            # part of the memoized outputs has been pruned or corrupted
+            _remove_memo(store, memo_dir)
+            store.write()
+            return None
+        targets.append(target)
+
+    for output, target in zip(step.outputs, targets):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        symlink(target, output)
+        store.touch(target)
+    store.write()
+    return memo_dir
+
+
+def save_outputs(step, config, key):
+    """
+    Save copies of the outputs of a step that just ran successfully under
+    the database root, so identical steps can link to them instead of
+    running, then prune the memoized outputs if they have grown larger than
+    the ``max_size`` config option in the ``memoize`` section
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step
+
+    config : polaris.config.PolarisConfigParser
+        Config options for the test case
+
+    key : str
+        The key from :py:func:`polaris.memoize.get_memo_key()`
+    """
+    database_root = config.get('paths', 'database_root')
+    memo_dir = _get_memo_dir(database_root, key)
+    if os.path.exists(memo_dir):
+        # another process saved the same outputs in the meantime
+        return
+    for output in step.outputs:
+        if not os.path.isfile(output):
+            # only steps that produce files are memoized
+            return
+
+    store = DatabaseStore(database_root, group=get_group(config))
+    temp_dir = f'{memo_dir}.{os.getpid()}.tmp'
+    outputs = dict()
+    try:
+        for output in step.outputs:
+            name = os.path.relpath(output, step.work_dir)
+            temp_filename = os.path.join(temp_dir, name)
+            os.makedirs(os.path.dirname(temp_filename), exist_ok=True)
+            stage_file(output, temp_filename)
+            outputs[name] = compute_sha256(temp_filename)
+        step_class = type(step)
+        memo = dict(polaris_version=__version__,
+                    step_class=f'{step_class.__module__}.'
+                               f'{step_class.__name__}',
+                    step_path=step.path, created=time.time(),
+                    outputs=outputs)
+        with open(os.path.join(temp_dir, MEMO_FILENAME), 'w') as f:
+            json.dump(memo, f, indent=1)
+        os.rename(temp_dir, memo_dir)
+    except OSError:
+        # e.g. another process saved the same outputs in the meantime
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return
+
+    for name, sha256 in outputs.items():
+        store.add(os.path.join(memo_dir, name), sha256)
+    store.fix_permissions()
+    max_size = _get_max_size(config)
+    if max_size is None:
+        store.write()
+    else:
+        _prune(store, max_size)
+
+
+def release_outputs(step, config):
+    """
+    Remove the links from the outputs of a step to memoized outputs before
+    the step runs, so it doesn't write to the memoized outputs
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step
+
+    config : polaris.config.PolarisConfigParser
+        Config options for the test case
+    """
+    if not config.has_option('paths', 'database_root'):
+        return
+    database_root = os.path.realpath(config.get('paths', 'database_root'))
+    prefix = f'{os.path.join(database_root, MEMO_DIRNAME)}{os.sep}'
+    for output in step.outputs:
+        if os.path.islink(output) and \
+                os.path.realpath(output).startswith(prefix):
+            os.remove(output)
+
+
+def _prune(store, max_size):
+    """
+    Remove the least recently used memoized outputs until they fit in the
+    given size, along with the rest of the outputs of the same steps
+    """
+    removed, _ = store.prune(max_size, subdir=MEMO_DIRNAME)
+    memo_dirs = set()
+    for path in removed:
+        # step_outputs/<first 2 characters of the key>/<key>/...
+        memo_dirs.add(os.path.join(store.database_root,
+                                   *path.split(os.sep)[0:3]))
+    for memo_dir in sorted(memo_dirs):
+        _remove_memo(store, memo_dir)
+    store.write()
+
+
+def _remove_memo(store, memo_dir):
+    """ Remove memoized outputs from the store """
+    for root, _, files in os.walk(memo_dir):
+        for name in files:
+            if name != MEMO_FILENAME:
+                store.remove(os.path.join(root, name))
+    shutil.rmtree(memo_dir, ignore_errors=True)
+    try:
+        os.rmdir(os.path.dirname(memo_dir))
+    except OSError:
+        # there are other memoized outputs with the same key prefix
+        pass
+
+
+def _get_sha256(store, filename):
+    """
+    The checksum of a memoized output, from the manifest if the file hasn't
+    changed since it was saved
+    """
+    sha256 = store.get_current_sha256(filename)
+    if sha256 is None:
+        sha256 = compute_sha256(filename)
+    return sha256
+
+
+def _get_memo_dir(database_root, key):
+    """ The directory for the memoized outputs with a given key """
+    return os.path.join(os.path.abspath(database_root), MEMO_DIRNAME,
+                        key[0:2], key)
+
+
+def _read_memo(memo_dir):
+    """ Read the description of memoized outputs, if there are any """
+    filename = os.path.join(memo_dir, MEMO_FILENAME)
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_enabled(config):
+    """
+    Whether outputs of steps are memoized from the ``enabled`` config option
+    in the ``memoize`` section, which is off for work directories set up
+    before it was added
+    """
+    if not config.has_option('memoize', 'enabled') or \
+            not config.has_option('paths', 'database_root'):
+        return False
+    return config.getboolean('memoize', 'enabled')
+
+
+def _get_max_size(config):
+    """
+    The maximum size of the memoized outputs from the ``max_size`` config
+    option in the ``memoize`` section, or ``None`` for no limit
+    """
+    if not config.has_option('memoize', 'max_size'):
+        return None
+    max_size = config.get('memoize', 'max_size').strip()
+    if max_size in ['', 'None', 'none']:
+        return None
+    return parse_size(max_size)
@@ -1,7 +1,4 @@
-import cartopy
-import cartopy.crs as ccrs
 import jigsawpy
-import matplotlib.pyplot as plt
 import numpy as np
 import xarray
 import xarray.plot
@@ -12,8 +9,6 @@ from mpas_tools.logging import check_call
 from mpas_tools.mesh.conversion import convert
 from mpas_tools.mesh.creation.jigsaw_to_netcdf import jigsaw_to_netcdf
 from mpas_tools.ocean.inject_meshDensity import inject_spherical_meshDensity
-from mpas_tools.viz.colormaps import register_sci_viz_colormaps
-from mpas_tools.viz.paraview_extractor import extract_vtk
 
 from polaris.model_step import make_graph_file
 from polaris.step import Step
@@ -43,7 +38,7 @@ class SphericalBaseStep(Step):
         subdir : {str, None}
             the subdirectory for the step.  The default is ``name``
         """
-        super().__init__(test_case, name=name, subdir=subdir)
+        super().__init__(test_case, name=name, subdir=subdir, memoize=True)
 
         # setup files for JIGSAW
         self.opts = jigsawpy.jigsaw_jig_t()
@@ -115,6 +110,8 @@ class SphericalBaseStep(Step):
                 mesh_filename=mpas_mesh_filename)
 
         if section.getboolean('convert_to_vtk'):
+            from mpas_tools.viz.paraview_extractor import extract_vtk
+
             vtk_dir = section.get('vtk_dir')
             # only use progress bars if we're not writing to a log file
             use_progress_bar = self.log_filename is None
@@ -139,6 +136,13 @@ class SphericalBaseStep(Step):
         cell_width : numpy.ndarray
             m x n array of cell width in km
         """
+        # cartopy and matplotlib are slow to import, so only import them if
+        # a plot is needed
+        import cartopy
+        import cartopy.crs as ccrs
+        import matplotlib.pyplot as plt
+        from mpas_tools.viz.colormaps import register_sci_viz_colormaps
+
         config = self.config
         cmap = config.get('spherical_mesh', 'cell_width_colormap')
         image_filename = config.get('spherical_mesh',
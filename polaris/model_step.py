@@ -1,5 +1,4 @@
 import os
-import shutil
 from collections import OrderedDict
 
 import numpy as np
@@ -9,6 +8,7 @@ from mpas_tools.logging import check_call
 
 import polaris.namelist
 import polaris.streams
+from polaris.io import stage_executable
 from polaris.step import Step
 from polaris.yaml import PolarisYaml, yaml_to_mpas_streams
 
@@ -95,8 +95,9 @@ class ModelStep(Step):
 
         max_memory : int, optional
             the amount of memory that the step is allowed to use in MB.
-            This is currently just a placeholder for later use with task
-            parallelism
+            When steps are run in task parallel, a step is only started
+            once this much memory, divided evenly between its tasks, is free
+            on the nodes its tasks run on
 
         cached : bool, optional
             Whether to get all of the outputs for the step from the database of
@@ -203,8 +204,9 @@ class ModelStep(Step):
 
         max_memory : int, optional
             the amount of memory that the step is allowed to use in MB.
-            This is currently just a placeholder for later use with task
-            parallelism
+            When steps are run in task parallel, a step is only started
+            once this much memory, divided evenly between its tasks, is free
+            on the nodes its tasks run on
         """
         self.set_resources(cpus_per_task=openmp_threads,
                            min_cpus_per_task=openmp_threads, ntasks=ntasks,
@@ -378,6 +380,23 @@ class ModelStep(Step):
         if self.partition_graph:
             self.partition(graph_file=self.graph_filename)
 
+    def get_fingerprint_files(self):
+        """
+        The yaml or namelist and streams files for the model are part of the
+        step's fingerprint
+
+        Returns
+        -------
+        filenames : list of str
+            The absolute paths of the files
+        """
+        if self.make_yaml:
+            filenames = [self.yaml]
+        else:
+            filenames = [self.namelist, self.streams]
+        return [os.path.join(self.work_dir, filename) for filename in
+                filenames]
+
     def process_inputs_and_outputs(self):
         """
         Process the model as an input, then call the parent class' version
@@ -461,7 +480,9 @@ class ModelStep(Step):
         filename = os.path.basename(model)
         copy_executable = config.getboolean('setup', 'copy_executable')
         if copy_executable:
-            # make a copy of the model executable, then link to that
+            # make a copy of the model executable (sharing storage with
+            # other copies of the same executable if possible), then link to
+            # that
             mpas_subdir = os.path.basename(
                 config.get('paths', 'mpas_model'))
             mpas_workdir = os.path.join(base_work_dir, mpas_subdir)
@@ -471,10 +492,7 @@ class ModelStep(Step):
             except FileExistsError:
                 pass
 
-            try:
-                shutil.copy(model, target)
-            except FileExistsError:
-                pass
+            stage_executable(model, target)
         else:
             target = os.path.abspath(model)
         return filename, target
@@ -47,8 +47,9 @@ class OceanModelStep(ModelStep):
 
         max_memory : int, optional
             the amount of memory that the step is allowed to use in MB.
-            This is currently just a placeholder for later use with task
-            parallelism
+            When steps are run in task parallel, a step is only started
+            once this much memory, divided evenly between its tasks, is free
+            on the nodes its tasks run on
 
         cached : bool, optional
             Whether to get all of the outputs for the step from the database of
@@ -22,18 +22,18 @@ class BaroclinicChannel(TestGroup):
                          name='baroclinic_channel')
 
         for resolution in [10.]:
-            self.add_test_case(
-                Default(test_group=self, resolution=resolution))
-
-            self.add_test_case(
-                DecompTest(test_group=self, resolution=resolution))
-
-            self.add_test_case(
-                RestartTest(test_group=self, resolution=resolution))
-
-            self.add_test_case(
-                ThreadsTest(test_group=self, resolution=resolution))
+            self._add_test_case(Default, 'default', resolution)
+            self._add_test_case(DecompTest, 'decomp_test', resolution)
+            self._add_test_case(RestartTest, 'restart_test', resolution)
+            self._add_test_case(ThreadsTest, 'threads_test', resolution)
 
         for resolution in [1., 4., 10.]:
-            self.add_test_case(
-                RpeTest(test_group=self, resolution=resolution))
+            self._add_test_case(RpeTest, 'rpe_test', resolution)
+
+    def _add_test_case(self, test_case_class, name, resolution):
+        """
+        Add a test case that is only constructed when it is needed
+        """
+        subdir = BaroclinicChannelTestCase.get_subdir(resolution, name)
+        self.add_lazy_test_case(test_case_class, name=name, subdir=subdir,
+                                resolution=resolution)
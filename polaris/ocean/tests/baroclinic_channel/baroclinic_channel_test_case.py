@@ -32,17 +32,37 @@ class BaroclinicChannelTestCase(TestCase):
             The name of the test case
         """
         self.resolution = resolution
-        if resolution >= 1.:
-            res_str = f'{resolution:g}km'
-        else:
-            res_str = f'{resolution:g}m'
-        subdir = os.path.join(res_str, name)
+        subdir = self.get_subdir(resolution, name)
         super().__init__(test_group=test_group, name=name,
                          subdir=subdir)
 
         self.add_step(
             InitialState(test_case=self, resolution=resolution))
 
+    @staticmethod
+    def get_subdir(resolution, name):
+        """
+        Get the subdirectory of a test case within the test group
+
+        Parameters
+        ----------
+        resolution : float
+            The resolution of the test case in km
+
+        name : str
+            The name of the test case
+
+        Returns
+        -------
+        subdir : str
+            The subdirectory of the test case
+        """
+        if resolution >= 1.:
+            res_str = f'{resolution:g}km'
+        else:
+            res_str = f'{resolution:g}m'
+        return os.path.join(res_str, name)
+
     def configure(self):
         """
         Modify the configuration options for this test case.
@@ -30,7 +30,8 @@ class InitialState(Step):
         resolution : float
             The resolution of the test case in km
         """
-        super().__init__(test_case=test_case, name='initial_state')
+        super().__init__(test_case=test_case, name='initial_state',
+                         memoize=True)
         self.resolution = resolution
 
         for file in ['base_mesh.nc', 'culled_mesh.nc', 'culled_graph.info',
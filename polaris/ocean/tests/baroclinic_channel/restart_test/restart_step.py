@@ -27,6 +27,24 @@ class RestartStep(Forward):
                          min_tasks=4, openmp_threads=1,
                          resolution=resolution)
 
+    def setup(self):
+        """
+        Add the restart file that is written by ``full_run`` and read by
+        ``restart_run`` as an output or input, respectively, so that the
+        dependency between the two steps is known to the framework
+        """
+        super().setup()
+        dt_per_km = self.config.getfloat('baroclinic_channel', 'dt_per_km')
+        dt = dt_per_km * self.resolution
+        restart_time_str = time.strftime('0001-01-01_%H.%M.%S',
+                                         time.gmtime(dt))
+        restart_filename = f'../restarts/rst.{restart_time_str}.nc'
+        if self.name == 'full_run':
+            self.add_output_file(filename=restart_filename)
+        else:
+            self.add_input_file(filename='restart.nc',
+                                target=restart_filename)
+
     def dynamic_model_config(self, at_setup):
         """
         Add model config options, namelist, streams and yaml files using config
@@ -1,5 +1,3 @@
-import cmocean  # noqa: F401
-import matplotlib.pyplot as plt
 import numpy as np
 import xarray
 
@@ -82,6 +80,8 @@ def _plot(nx, ny, filename, nus, rpe):
     rpe : numpy.ndarray
         The reference potential energy with size len(nu) x len(time)
     """
+    import cmocean  # noqa: F401
+    import matplotlib.pyplot as plt
 
     plt.switch_backend('Agg')
     num_files = len(nus)
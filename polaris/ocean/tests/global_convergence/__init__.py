@@ -15,5 +15,7 @@ class GlobalConvergence(TestGroup):
         super().__init__(component=component, name='global_convergence')
 
         for icosahedral in [False, True]:
-            self.add_test_case(CosineBell(test_group=self,
-                                          icosahedral=icosahedral))
+            self.add_lazy_test_case(
+                CosineBell, name='cosine_bell',
+                subdir=CosineBell.get_subdir(icosahedral),
+                icosahedral=icosahedral)
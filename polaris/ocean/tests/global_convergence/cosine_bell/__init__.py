@@ -37,12 +37,8 @@ class CosineBell(TestCase):
             Whether to use icosahedral, as opposed to less regular, JIGSAW
             meshes
         """
-        if icosahedral:
-            subdir = 'icos/cosine_bell'
-        else:
-            subdir = 'qu/cosine_bell'
         super().__init__(test_group=test_group, name='cosine_bell',
-                         subdir=subdir)
+                         subdir=self.get_subdir(icosahedral))
         self.resolutions = list()
         self.icosahedral = icosahedral
 
@@ -51,6 +47,27 @@ class CosineBell(TestCase):
         config.add_from_package(self.__module__, f'{self.name}.cfg')
         self._setup_steps(config)
 
+    @staticmethod
+    def get_subdir(icosahedral):
+        """
+        Get the subdirectory of the test case within the test group
+
+        Parameters
+        ----------
+        icosahedral : bool
+            Whether to use icosahedral, as opposed to less regular, JIGSAW
+            meshes
+
+        Returns
+        -------
+        subdir : str
+            The subdirectory of the test case
+        """
+        if icosahedral:
+            return 'icos/cosine_bell'
+        else:
+            return 'qu/cosine_bell'
+
     def configure(self):
         """
         Set config options for the test case
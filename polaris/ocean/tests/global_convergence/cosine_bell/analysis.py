@@ -1,6 +1,5 @@
 import warnings
 
-import matplotlib.pyplot as plt
 import numpy as np
 import xarray as xr
 
@@ -58,6 +57,8 @@ class Analysis(Step):
         """
         Run this step of the test case
         """
+        import matplotlib.pyplot as plt
+
         plt.switch_backend('Agg')
         resolutions = self.resolutions
         xdata = list()
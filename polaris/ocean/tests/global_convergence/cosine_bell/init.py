@@ -25,7 +25,7 @@ class Init(Step):
 
         super().__init__(test_case=test_case,
                          name=f'{mesh_name}_init',
-                         subdir=f'{mesh_name}/init')
+                         subdir=f'{mesh_name}/init', memoize=True)
 
         self.add_input_file(filename='mesh.nc', target='../mesh/mesh.nc')
 
@@ -1,10 +1,12 @@
+import functools
 import multiprocessing
 import os
+import re
+import signal
+import socket
 import subprocess
 import warnings
 
-from mpas_tools.logging import check_call
-
 
 def get_available_cores_and_nodes(config):
     """
@@ -55,6 +57,90 @@ def get_available_cores_and_nodes(config):
     return cores, nodes, cores_per_node
 
 
+def get_available_memory(config):
+    """
+    Get the amount of memory on each node available for running steps
+
+    Parameters
+    ----------
+    config : polaris.config.PolarisConfigParser
+        Configuration options for the test case
+
+    Returns
+    -------
+    memory_per_node : int or None
+        The memory on each node in MB, or ``None`` if it could not be
+        determined
+    """
+    if config.has_option('parallel', 'memory_per_node'):
+        return config.getint('parallel', 'memory_per_node')
+
+    parallel_system = config.get('parallel', 'system')
+    if parallel_system == 'slurm':
+        if 'SLURM_MEM_PER_NODE' in os.environ:
+            return int(os.environ['SLURM_MEM_PER_NODE'])
+        node = os.environ['SLURMD_NODENAME']
+        args = ['sinfo', '--noheader', '--node', node, '-o', '%m']
+        try:
+            return _get_subprocess_int(args)
+        except (subprocess.CalledProcessError, ValueError):
+            return None
+    elif parallel_system == 'single_node':
+        try:
+            page_size = os.sysconf('SC_PAGE_SIZE')
+            pages = os.sysconf('SC_PHYS_PAGES')
+        except (ValueError, OSError):
+            return None
+        return page_size * pages // 1024**2
+    else:
+        raise ValueError(f'Unexpected parallel system: {parallel_system}')
+
+
+def get_node_list(config):
+    """
+    Get the host names of the nodes available for running steps, in the
+    order Slurm uses for relative node offsets
+
+    Parameters
+    ----------
+    config : polaris.config.PolarisConfigParser
+        Configuration options for the test case
+
+    Returns
+    -------
+    node_list : list of str
+        The host names of the nodes in the job
+    """
+    parallel_system = config.get('parallel', 'system')
+    if parallel_system == 'slurm':
+        return expand_hostlist(os.environ['SLURM_JOB_NODELIST'])
+    elif parallel_system == 'single_node':
+        return [socket.gethostname()]
+    else:
+        raise ValueError(f'Unexpected parallel system: {parallel_system}')
+
+
+def expand_hostlist(hostlist):
+    """
+    Expand a Slurm host list like ``nid[001-003,007],login1`` into a list of
+    host names
+
+    Parameters
+    ----------
+    hostlist : str
+        The compressed host list, e.g. from ``$SLURM_JOB_NODELIST``
+
+    Returns
+    -------
+    hosts : list of str
+        The host names
+    """
+    hosts = list()
+    for entry in _split_hostlist(hostlist):
+        hosts.extend(_expand_host_entry(entry))
+    return hosts
+
+
 def check_parallel_system(config):
     """
     Check whether we are in an appropriate state for the given queuing system.
@@ -107,9 +193,14 @@ def set_cores_per_node(config):
             config.set('parallel', 'cores_per_node', f'{cores_per_node}')
 
 
-def run_command(args, cpus_per_task, ntasks, openmp_threads, config, logger):
+def run_command(args, cpus_per_task, ntasks, openmp_threads, config, logger,
+                placement=None):
     """
-    Run a subprocess with the given command-line arguments and resources
+    Run a subprocess with the given command-line arguments and resources.
+    The subprocess runs in its own session, so that if this process is
+    interrupted (e.g. because the step timed out, see
+    :py:class:`polaris.run.watchdog.StepWatchdog`), the parallel executable
+    and all the processes it started are killed.
 
     Parameters
     ----------
@@ -136,6 +227,12 @@ def run_command(args, cpus_per_task, ntasks, openmp_threads, config, logger):
 
     logger : logging.Logger
         A logger for output from the step
+
+    placement : dict, optional
+        The number of tasks (values) to run on each node (keys), given as
+        offsets into the list of nodes from
+        :py:func:`polaris.parallel.get_node_list()`.  By default, the
+        parallel executable decides where to run the tasks.
     """
     env = dict(os.environ)
 
@@ -149,7 +246,21 @@ def run_command(args, cpus_per_task, ntasks, openmp_threads, config, logger):
     command_line_args = parallel_executable.split(' ')
     parallel_system = config.get('parallel', 'system')
     if parallel_system == 'slurm':
-        command_line_args.extend(['-c', f'{cpus_per_task}', '-n', f'{ntasks}'])
+        launcher = os.path.basename(command_line_args[0])
+        if launcher in ['mpirun', 'mpiexec']:
+            command_line_args.extend(['-n', f'{ntasks}'])
+            if placement is not None:
+                command_line_args.extend(_write_hostfile(
+                    placement, command_line_args[0], config))
+        else:
+            command_line_args.extend(['-c', f'{cpus_per_task}',
+                                      '-n', f'{ntasks}'])
+            if placement is not None:
+                placement_args, hostfile = _get_srun_placement_args(
+                    placement, config)
+                command_line_args.extend(placement_args)
+                if hostfile is not None:
+                    env['SLURM_HOSTFILE'] = hostfile
     elif parallel_system == 'single_node':
         command_line_args.extend(['-n', f'{ntasks}'])
     else:
@@ -157,7 +268,176 @@ def run_command(args, cpus_per_task, ntasks, openmp_threads, config, logger):
 
     command_line_args.extend(args)
 
-    check_call(command_line_args, logger, env=env)
+    _check_call_in_session(command_line_args, logger, env)
+
+
+def _check_call_in_session(args, logger, env):
+    """
+    Run a command in a new session, logging its output as it runs, and kill
+    the whole process group if anything goes wrong while waiting for it
+    """
+    logger.info(f'Running: {" ".join(args)}')
+    process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, env=env,
+                               start_new_session=True)
+    output = process.stdout
+    assert output is not None
+    try:
+        for line in output:
+            logger.info(line.decode('utf-8', errors='replace').rstrip('\n'))
+        process.wait()
+    except BaseException:
+        _kill_process_group(process)
+        raise
+    finally:
+        output.close()
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args)
+
+
+def _kill_process_group(process, grace_period=10.):
+    """
+    Terminate a process and all the processes in its session, killing any
+    that are left after a grace period
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        process.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def _get_srun_placement_args(placement, config):
+    """
+    Get the ``srun`` flags that run a job step with the given number of
+    tasks on each node, and the path of a hostfile for ``SLURM_HOSTFILE`` if
+    one is needed.  If every node gets the same number of tasks, nodes that
+    are contiguous in the node list are selected with ``--nodes`` and
+    ``--relative``, and others by name with ``--nodelist``, along with
+    ``--ntasks-per-node``.  Otherwise, ``--distribution=arbitrary`` places
+    the tasks as listed in a hostfile written to the current directory, with
+    one line per task.  The ``--exclusive`` flag keeps job steps that share a
+    node from using the same cores.
+    """
+    offsets = sorted(placement)
+    node_count = len(offsets)
+    first = offsets[0]
+    tasks = [placement[offset] for offset in offsets]
+    hostfile = None
+    if len(set(tasks)) > 1:
+        node_list = get_node_list(config)
+        hosts = [node_list[offset] for offset in offsets]
+        hostfile = os.path.abspath('slurm_hostfile')
+        with open(hostfile, 'w') as f:
+            for host, host_tasks in zip(hosts, tasks):
+                for _ in range(host_tasks):
+                    f.write(f'{host}\n')
+        flags = [f'--nodes={node_count}', f'--nodelist={",".join(hosts)}',
+                 '--distribution=arbitrary']
+    elif offsets == list(range(first, first + node_count)):
+        flags = [f'--nodes={node_count}', f'--relative={first}',
+                 f'--ntasks-per-node={tasks[0]}']
+    else:
+        node_list = get_node_list(config)
+        host_list = ','.join([node_list[offset] for offset in offsets])
+        flags = [f'--nodes={node_count}', f'--nodelist={host_list}',
+                 f'--ntasks-per-node={tasks[0]}']
+    flags.append('--exclusive')
+    return flags, hostfile
+
+
+def _write_hostfile(placement, launcher, config):
+    """
+    Write a hostfile for ``mpirun`` or ``mpiexec`` in the current directory
+    with the number of tasks to run on each node, in the format for the MPI
+    library the launcher comes from, and get the flags that pass it to the
+    launcher
+    """
+    flavor = _get_mpi_flavor(launcher)
+    node_list = get_node_list(config)
+    hostfile = os.path.abspath('hostfile')
+    with open(hostfile, 'w') as f:
+        for offset in sorted(placement):
+            host = node_list[offset]
+            if flavor == 'openmpi':
+                f.write(f'{host} slots={placement[offset]}\n')
+            else:
+                f.write(f'{host}:{placement[offset]}\n')
+    if flavor == 'openmpi':
+        return ['--hostfile', hostfile]
+    else:
+        return ['-f', hostfile]
+
+
+@functools.lru_cache()
+def _get_mpi_flavor(launcher):
+    """
+    Find out if ``mpirun`` or ``mpiexec`` comes from Open MPI (``openmpi``)
+    or uses the Hydra process manager, as MPICH and Intel MPI do
+    (``hydra``), from its version information
+    """
+    try:
+        output = subprocess.run([launcher, '--version'],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                check=False).stdout.decode('utf-8',
+                                                           errors='replace')
+    except OSError:
+        output = ''
+    if 'Open MPI' in output or 'OpenRTE' in output:
+        return 'openmpi'
+    if 'HYDRA' in output or 'MPICH' in output or 'Intel' in output:
+        return 'hydra'
+    raise ValueError(
+        f'Running steps on specific nodes with {launcher} is only supported '
+        f'for Open MPI and for MPICH or Intel MPI (Hydra), but the MPI '
+        f'library could not be determined from "{launcher} --version".  Use '
+        f'srun as the parallel_executable instead.')
+
+
+def _split_hostlist(hostlist):
+    """ Split a host list at commas that are not inside brackets """
+    entries = list()
+    depth = 0
+    start = 0
+    for index, char in enumerate(hostlist):
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            entries.append(hostlist[start:index])
+            start = index + 1
+    entries.append(hostlist[start:])
+    return [entry.strip() for entry in entries if entry.strip() != '']
+
+
+def _expand_host_entry(entry):
+    """ Expand the first bracketed range in a host entry, recursively """
+    match = re.match(r'^([^\[]*)\[([^\]]*)\](.*)$', entry)
+    if match is None:
+        return [entry]
+    prefix, ranges, suffix = match.groups()
+    hosts = list()
+    for item in ranges.split(','):
+        if '-' in item:
+            first, last = item.split('-')
+            width = len(first)
+            for index in range(int(first), int(last) + 1):
+                hosts.extend(_expand_host_entry(
+                    f'{prefix}{index:0{width}d}{suffix}'))
+        else:
+            hosts.extend(_expand_host_entry(f'{prefix}{item}{suffix}'))
+    return hosts
 
 
 def _get_subprocess_int(args):
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+
+from polaris.version import __version__
+
+
+class TestCaseDescriptor:
+    """
+    A lightweight description of a test case that knows how to construct the
+    test case when it is needed
+
+    Attributes
+    ----------
+    test_group : polaris.TestGroup
+        The test group the test case belongs to
+
+    name : str
+        The name of the test case
+
+    subdir : str
+        The subdirectory of the test case within the test group
+
+    path : str
+        The path of the test case within the base work directory
+
+    test_case_class : type
+        The class of the test case
+
+    kwargs : dict
+        Keyword arguments (other than ``test_group``) to the constructor of
+        the test case
+
+    test_case : polaris.TestCase or None
+        The test case, if it has been constructed
+    """
+
+    def __init__(self, test_group, name, subdir, test_case_class,
+                 kwargs=None):
+        """
+        Describe a test case
+
+        Parameters
+        ----------
+        test_group : polaris.TestGroup
+            The test group the test case belongs to
+
+        name : str
+            The name of the test case
+
+        subdir : str
+            The subdirectory of the test case within the test group
+
+        test_case_class : type
+            The class of the test case
+
+        kwargs : dict, optional
+            Keyword arguments (other than ``test_group``) to the constructor
+            of the test case
+        """
+        if kwargs is None:
+            kwargs = dict()
+        self.test_group = test_group
+        self.name = name
+        self.subdir = subdir
+        self.path = os.path.join(test_group.component.name, test_group.name,
+                                 subdir)
+        self.test_case_class = test_case_class
+        self.kwargs = kwargs
+        self.test_case = None
+
+    def get_test_case(self):
+        """
+        Get the test case, constructing it the first time
+
+        Returns
+        -------
+        test_case : polaris.TestCase
+            The test case
+        """
+        if self.test_case is None:
+            test_case = self.test_case_class(test_group=self.test_group,
+                                             **self.kwargs)
+            if test_case.path != self.path:
+                raise ValueError(
+                    f'Test case {test_case.path} was registered with the '
+                    f'path {self.path}')
+            self.test_case = test_case
+        return self.test_case
+
+
+def get_test_case_descriptors(components=None):
+    """
+    Get descriptions of all test cases without constructing them
+
+    Parameters
+    ----------
+    components : list of polaris.Component, optional
+        The components with the test cases.  By default, the components from
+        :py:func:`polaris.components.get_components()`
+
+    Returns
+    -------
+    descriptors : dict of polaris.registry.TestCaseDescriptor
+        Descriptions of all test cases with their paths as keys, in the order
+        they are listed by ``polaris list``
+    """
+    if components is None:
+        from polaris.components import get_components
+        components = get_components()
+    descriptors = dict()
+    for component in components:
+        for test_group in component.test_groups.values():
+            for descriptor in test_group.descriptors.values():
+                descriptors[descriptor.path] = descriptor
+    return descriptors
+
+
+def get_test_case_index():
+    """
+    Get an index of all test cases and their steps, as listed by
+    ``polaris list``.  Building the index requires constructing every test
+    case, so it is cached and only rebuilt when the polaris version or any
+    of the python or config files in the polaris package change.
+
+    Returns
+    -------
+    index : list of dict
+        A dictionary with the ``path``, ``name``, ``component``,
+        ``test_group`` and ``subdir`` of each test case, and its ``steps``
+        (a list of step names and subdirectories)
+    """
+    signature = _get_package_signature()
+    filename = _get_index_filename()
+    try:
+        with open(filename) as f:
+            cached = json.load(f)
+        if cached['signature'] == signature:
+            return cached['test_cases']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = _build_index()
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        temp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(temp_filename, 'w') as f:
+            json.dump(dict(signature=signature, test_cases=index), f)
+        os.replace(temp_filename, filename)
+    except OSError:
+        # we can do without the cache
+        pass
+    return index
+
+
+def _build_index():
+    """ Build the index by constructing all test cases """
+    index = list()
+    for descriptor in get_test_case_descriptors().values():
+        test_case = descriptor.get_test_case()
+        steps = [[step.name, step.subdir] for step in
+                 test_case.steps.values()]
+        index.append(dict(path=test_case.path,
+                          name=test_case.name,
+                          component=test_case.component.name,
+                          test_group=test_case.test_group.name,
+                          subdir=test_case.subdir,
+                          steps=steps))
+    return index
+
+
+def _get_index_filename():
+    """ The cache file for the index of test cases """
+    cache_dir = os.environ.get('XDG_CACHE_HOME',
+                               os.path.expanduser('~/.cache'))
+    return os.path.join(cache_dir, 'polaris', 'test_case_index.json')
+
+
+def _get_package_signature():
+    """
+    A hash of the polaris version and the path, size and modification time
+    of each python and config file in the polaris package
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    sha = hashlib.sha256(f'{__version__}\n{package_dir}\n'.encode('utf-8'))
+    for path in _get_package_files(('.py', '.cfg', '.txt')):
+        stat = os.stat(path)
+        sha.update(f'{path} {stat.st_size} {stat.st_mtime_ns}\n'.encode(
+            'utf-8'))
+    return sha.hexdigest()
+
+
+def _get_package_files(extensions=None):
+    """
+    The paths of the files in the polaris package (except compiled python
+    files) in a fixed order, optionally only those with the given extensions
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    paths = list()
+    for root, dirs, files in os.walk(package_dir):
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+        for name in sorted(files):
+            if name.endswith('.pyc') or \
+                    (extensions is not None and not name.endswith(extensions)):
+                continue
+            paths.append(os.path.join(root, name))
+    return paths
@@ -0,0 +1,567 @@
+import argparse
+import array
+import json
+import os
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import traceback
+
+import polaris
+from polaris.registry import _get_package_signature
+from polaris.version import __version__
+
+# how long (in seconds) the daemon waits for a client to send its request
+_REQUEST_TIMEOUT = 10.
+
+
+def get_socket_path():
+    """
+    Get the path of the Unix socket of the polaris daemon for this user,
+    which can be set with the ``$POLARIS_DAEMON_SOCKET`` environment variable
+
+    Returns
+    -------
+    socket_path : str
+        The path of the socket
+    """
+    if 'POLARIS_DAEMON_SOCKET' in os.environ:
+        return os.environ['POLARIS_DAEMON_SOCKET']
+    return os.path.join(tempfile.gettempdir(),
+                        f'polaris-daemon-{os.getuid()}.sock')
+
+
+def start_daemon(socket_path=None, detach=True, preload=True):
+    """
+    Start a polaris daemon in a child process.  The daemon keeps polaris and
+    the modules it depends on imported and forks a new process for each step
+    it is asked to run, so steps don't pay for starting python and importing
+    modules.
+
+    Parameters
+    ----------
+    socket_path : str, optional
+        The path of the Unix socket the daemon listens on.  By default, the
+        path from :py:func:`polaris.run.daemon.get_socket_path()` is used.
+
+    detach : bool, optional
+        Whether the daemon should run in its own session so it keeps running
+        after the calling process exits
+
+    preload : bool, optional
+        Whether to import all components, test groups and steps before
+        waiting for steps to run
+
+    Returns
+    -------
+    pid : int
+        The process ID of the daemon
+    """
+    if socket_path is None:
+        socket_path = get_socket_path()
+
+    # the polaris code the daemon runs steps with
+    identity = _get_identity()
+
+    # bind the socket before forking so clients can connect right away
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    # only this user may connect
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid != 0:
+        server.close()
+        return pid
+
+    # this is the daemon
+    if detach:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in [0, 1, 2]:
+            os.dup2(devnull, fd)
+    exit_code = 0
+    try:
+        if preload:
+            from polaris.components import get_components
+            get_components()
+        _serve(server, socket_path, identity)
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        os._exit(exit_code)
+
+
+class DaemonContext:
+    """
+    A context manager that starts a private polaris daemon, forked from the
+    current process so it has the same modules imported, and stops it at the
+    end
+
+    Attributes
+    ----------
+    socket_path : str or None
+        The path of the Unix socket the daemon listens on, or ``None`` if
+        no daemon was started
+    """
+
+    def __init__(self, enabled=True):
+        """
+        Create a new context manager
+
+        Parameters
+        ----------
+        enabled : bool, optional
+            Whether to start a daemon
+        """
+        self.enabled = enabled
+        self.socket_path = None
+        self._pid = None
+        self._socket_dir = None
+
+    def __enter__(self):
+        if self.enabled:
+            # a short path because Unix socket paths are limited in length
+            self._socket_dir = tempfile.mkdtemp(prefix='polaris-')
+            self.socket_path = os.path.join(self._socket_dir, 'daemon.sock')
+            self._pid = start_daemon(self.socket_path, detach=False,
+                                     preload=False)
+        return self.socket_path
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._pid is not None:
+            stop_daemon(self.socket_path)
+            os.waitpid(self._pid, 0)
+            self._pid = None
+        if self._socket_dir is not None:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+            self._socket_dir = None
+
+
+def stop_daemon(socket_path=None):
+    """
+    Ask the polaris daemon to shut down
+
+    Parameters
+    ----------
+    socket_path : str, optional
+        The path of the Unix socket the daemon listens on
+
+    Returns
+    -------
+    stopped : bool
+        Whether a daemon was running and has been asked to stop
+    """
+    reply = _request({'command': 'stop'}, socket_path)
+    return reply is not None
+
+
+def get_daemon_status(socket_path=None):
+    """
+    Find out if a compatible polaris daemon is running
+
+    Parameters
+    ----------
+    socket_path : str, optional
+        The path of the Unix socket the daemon listens on
+
+    Returns
+    -------
+    status : dict or None
+        The process ID (``pid``), polaris version (``version``), python
+        executable (``python``), polaris package directory (``package``)
+        and signature of the polaris source code when it started
+        (``signature``) of the daemon, or ``None`` if no compatible daemon
+        is running
+    """
+    reply = _request({'command': 'status'}, socket_path)
+    if reply is None or not _is_compatible(reply, _get_identity()):
+        return None
+    return reply
+
+
+def launch_step(args, cwd, stdout, stderr=None, socket_path=None):
+    """
+    Ask the polaris daemon to run ``polaris serial`` with the given arguments
+    in a forked process
+
+    Parameters
+    ----------
+    args : list of str
+        The arguments to ``polaris serial``
+
+    cwd : str
+        The directory to run in, typically the step's work directory
+
+    stdout : int
+        A file descriptor the output of the step is written to
+
+    stderr : int, optional
+        A file descriptor errors from the step are written to.  By default,
+        errors are written to ``stdout``.
+
+    socket_path : str, optional
+        The path of the Unix socket the daemon listens on
+
+    Returns
+    -------
+    process : polaris.run.daemon.DaemonProcess or None
+        A handle for the forked process, similar to
+        :py:class:`subprocess.Popen`, or ``None`` if no compatible daemon is
+        running
+    """
+    if stderr is None:
+        stderr = stdout
+    request = {'command': 'run', 'args': list(args), 'cwd': cwd,
+               'env': dict(os.environ)}
+    request.update(_get_identity())
+    connection = _connect(socket_path)
+    if connection is None:
+        return None
+    try:
+        _send_fds(connection, [stdout, stderr])
+        connection.sendall(f'{json.dumps(request)}\n'.encode('utf-8'))
+        reply = _read_line(connection)
+    except OSError:
+        connection.close()
+        return None
+    if reply == '':
+        # the daemon refused to run the step, e.g. a different version or
+        # polaris code that has changed since it started
+        connection.close()
+        return None
+    reply = json.loads(reply)
+    if 'pid' not in reply:
+        # the daemon couldn't make sense of the request
+        connection.close()
+        return None
+    return DaemonProcess(connection, reply['pid'])
+
+
+class DaemonProcess:
+    """
+    A handle for a step running in a process forked by the polaris daemon,
+    with methods similar to :py:class:`subprocess.Popen`
+
+    Attributes
+    ----------
+    pid : int
+        The process ID of the forked process
+
+    returncode : int or None
+        The exit code of the process, or ``None`` if it is still running
+    """
+
+    def __init__(self, connection, pid):
+        self.pid = pid
+        self.returncode = None
+        self._connection = connection
+
+    def poll(self):
+        """
+        Check if the process has finished
+
+        Returns
+        -------
+        returncode : int or None
+            The exit code of the process, or ``None`` if it is still running
+        """
+        if self.returncode is None:
+            readable, _, _ = select.select([self._connection], [], [], 0.)
+            if len(readable) > 0:
+                self._read_returncode()
+        return self.returncode
+
+    def wait(self):
+        """
+        Wait for the process to finish
+
+        Returns
+        -------
+        returncode : int
+            The exit code of the process
+        """
+        if self.returncode is None:
+            self._read_returncode()
+        return self.returncode
+
+    def send_signal(self, signum):
+        """
+        Send a signal to the process
+
+        Parameters
+        ----------
+        signum : int
+            The signal to send
+        """
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _read_returncode(self):
+        """ Read the exit code, which the daemon sends when the step ends """
+        reply = _read_line(self._connection)
+        if reply == '':
+            # the process died without reporting back (e.g. a segfault)
+            self.returncode = -1
+        else:
+            self.returncode = json.loads(reply)['returncode']
+        self._connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Start, stop or check on a daemon that keeps polaris '
+                    'imported so steps can be run without starting python',
+        prog='polaris daemon')
+    parser.add_argument('action', choices=['start', 'stop', 'status'],
+                        help='What to do with the daemon')
+    parser.add_argument('--socket', dest='socket_path',
+                        help='The path of the Unix socket the daemon listens '
+                             'on')
+    args = parser.parse_args(sys.argv[2:])
+    socket_path = args.socket_path
+    if socket_path is None:
+        socket_path = get_socket_path()
+
+    status = get_daemon_status(socket_path)
+    if args.action == 'start':
+        if status is not None:
+            print(f'A polaris daemon is already running with PID '
+                  f'{status["pid"]}')
+            return
+        # in case a daemon for a different version of polaris is running
+        stop_daemon(socket_path)
+        pid = start_daemon(socket_path)
+        print(f'Started a polaris daemon with PID {pid} listening on\n'
+              f'  {socket_path}')
+    elif args.action == 'stop':
+        if stop_daemon(socket_path):
+            print('Stopped the polaris daemon')
+        else:
+            print('No polaris daemon is running')
+    else:
+        if status is None:
+            print('No polaris daemon is running')
+        else:
+            print(f'A polaris daemon is running with PID {status["pid"]} '
+                  f'listening on\n  {socket_path}')
+
+
+def _serve(server, socket_path, identity):
+    """
+    Accept requests until asked to stop, only running steps for clients with
+    the same identity (see :py:func:`polaris.run.daemon._get_identity()`)
+    """
+    # forked processes are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        connection, _ = server.accept()
+        # a client that connects but never sends a request can't hold up
+        # the daemon
+        connection.settimeout(_REQUEST_TIMEOUT)
+        try:
+            fds = _recv_fds(connection, 2)
+        except OSError:
+            connection.close()
+            continue
+        reader = connection.makefile('r')
+        try:
+            line = reader.readline()
+        except OSError:
+            _close_all(connection, reader, fds)
+            continue
+        if line == '':
+            _close_all(connection, reader, fds)
+            continue
+        try:
+            request = json.loads(line)
+            command = request['command']
+        except (ValueError, KeyError, TypeError) as e:
+            _try_reply(connection, dict(error=f'Bad request: {e}'))
+            _close_all(connection, reader, fds)
+            continue
+        if command == 'status':
+            _try_reply(connection, dict(pid=os.getpid(), **identity))
+            _close_all(connection, reader, fds)
+        elif command == 'stop':
+            _reply(connection, dict(pid=os.getpid()))
+            _close_all(connection, reader, fds)
+            return
+        elif command == 'run' and _is_compatible(request, identity) and \
+                len(fds) == 2:
+            # the step may run for as long as it needs to
+            connection.settimeout(None)
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                _run_in_child(connection, request, fds)
+            _close_all(connection, reader, fds)
+        else:
+            _close_all(connection, reader, fds)
+
+
+def _run_in_child(connection, request, fds):
+    """ Run ``polaris serial`` in a forked process and report the result """
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    _reply(connection, dict(pid=os.getpid()))
+    stdout, stderr = fds
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(stdout, 1)
+    os.dup2(stderr, 2)
+    os.close(stdout)
+    os.close(stderr)
+    os.environ.clear()
+    os.environ.update(request['env'])
+    returncode = 0
+    try:
+        os.chdir(request['cwd'])
+        import polaris.run.serial as run_serial
+
+        # make sure the step isn't just sent back to the daemon
+        sys.argv = ['polaris', 'serial'] + request['args'] + ['--no-daemon']
+        run_serial.main()
+    except SystemExit as e:
+        if e.code is None:
+            returncode = 0
+        elif isinstance(e.code, int):
+            returncode = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            returncode = 1
+    except BaseException:
+        traceback.print_exc()
+        returncode = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        _reply(connection, dict(returncode=returncode))
+    finally:
+        os._exit(returncode)
+
+
+def _request(request, socket_path):
+    """ Send a request to the daemon and read a one-line reply """
+    connection = _connect(socket_path)
+    if connection is None:
+        return None
+    try:
+        # no file descriptors are needed for this request
+        _send_fds(connection, [])
+        connection.sendall(f'{json.dumps(request)}\n'.encode('utf-8'))
+        reply = _read_line(connection)
+    except OSError:
+        return None
+    finally:
+        connection.close()
+    if reply == '':
+        return None
+    return json.loads(reply)
+
+
+def _read_line(connection):
+    """
+    Read a line from a socket one byte at a time, so nothing after the line
+    is consumed
+    """
+    data = bytearray()
+    while True:
+        char = connection.recv(1)
+        if char == b'':
+            return ''
+        data.extend(char)
+        if char == b'\n':
+            return data.decode('utf-8')
+
+
+def _send_fds(connection, fds):
+    """ Send file descriptors (possibly none) over a Unix socket """
+    ancillary = list()
+    if len(fds) > 0:
+        ancillary.append((socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                          array.array('i', fds)))
+    connection.sendmsg([b'F'], ancillary)
+
+
+def _recv_fds(connection, max_fds):
+    """ Receive file descriptors (possibly none) over a Unix socket """
+    fds = array.array('i')
+    _, ancillary, _, _ = connection.recvmsg(
+        1, socket.CMSG_SPACE(max_fds * fds.itemsize))
+    for level, kind, data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    return list(fds)
+
+
+def _connect(socket_path):
+    """ Connect to the daemon, returning ``None`` if it isn't running """
+    if socket_path is None:
+        socket_path = get_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+def _reply(connection, reply):
+    """ Send a one-line reply to a client """
+    connection.sendall(f'{json.dumps(reply)}\n'.encode('utf-8'))
+
+
+def _try_reply(connection, reply):
+    """ Send a reply to a client that may have gone away """
+    try:
+        _reply(connection, reply)
+    except OSError:
+        pass
+
+
+def _close_all(connection, reader, fds):
+    """ Close a connection and any file descriptors received with it """
+    reader.close()
+    connection.close()
+    for fd in fds:
+        os.close(fd)
+
+
+def _get_identity():
+    """
+    The polaris version, python executable, polaris package directory and a
+    signature of the polaris source code, which a daemon and client must
+    share, since the daemon keeps the modules it imported when it started
+    """
+    return dict(version=__version__, python=sys.executable,
+                package=os.path.dirname(os.path.abspath(polaris.__file__)),
+                signature=_get_package_signature())
+
+
+def _is_compatible(message, identity):
+    """
+    Whether a daemon and client are running the same polaris code with the
+    same python
+    """
+    return all(message.get(key) == value for key, value in identity.items())
@@ -0,0 +1,227 @@
+import os
+import socket
+import sqlite3
+from datetime import datetime
+
+from mache import discover_machine
+
+
+class RuntimeHistory:
+    """
+    A local SQLite database of how long steps and test cases took to run,
+    used to run the longest work first, to estimate how long a suite has left
+    to run and to flag runs that were much slower than usual
+
+    Runtimes are recorded for the machine polaris is running on, the
+    relative path of the step or test case and the resources it ran with.
+
+    Attributes
+    ----------
+    filename : str
+        The path of the database
+
+    machine : str
+        The name of the machine runtimes are recorded and looked up for
+    """
+
+    # the number of recent runs to take the median of
+    recent_runs = 5
+
+    def __init__(self, filename, machine=None):
+        """
+        Open (or create) the database
+
+        Parameters
+        ----------
+        filename : str
+            The path of the database
+
+        machine : str, optional
+            The name of the machine.  By default, ``$POLARIS_MACHINE``, the
+            machine found by ``mache`` or the host name, in that order.
+        """
+        if machine is None:
+            machine = get_machine()
+        self.filename = os.path.abspath(os.path.expanduser(filename))
+        self.machine = machine
+        directory = os.path.dirname(self.filename)
+        os.makedirs(directory, exist_ok=True)
+        # several suites may be running at once, so wait for locks
+        self._connection = sqlite3.connect(self.filename, timeout=60.)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS runtimes ('
+                'machine TEXT NOT NULL, '
+                'kind TEXT NOT NULL, '
+                'path TEXT NOT NULL, '
+                'ntasks INTEGER NOT NULL, '
+                'cpus_per_task INTEGER NOT NULL, '
+                'runtime REAL NOT NULL, '
+                'finished TEXT NOT NULL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS runtimes_path '
+                'ON runtimes (machine, kind, path)')
+
+    def add(self, kind, path, ntasks, cpus_per_task, runtime):
+        """
+        Record the runtime of a step or test case that ran successfully
+
+        Parameters
+        ----------
+        kind : {'step', 'test_case'}
+            Whether this is a step or a test case
+
+        path : str
+            The relative path of the step or test case
+
+        ntasks : int
+            The number of tasks it ran with (for a test case, the number of
+            cores available to the suite)
+
+        cpus_per_task : int
+            The number of cores per task it ran with (1 for a test case)
+
+        runtime : float
+            The wall-clock time in seconds
+        """
+        finished = datetime.now().isoformat(timespec='seconds')
+        with self._connection:
+            self._connection.execute(
+                'INSERT INTO runtimes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self.machine, kind, path, ntasks, cpus_per_task, runtime,
+                 finished))
+
+    def estimate(self, kind, path, ntasks, cpus_per_task):
+        """
+        Estimate the runtime of a step or test case from recent successful
+        runs on this machine.  Runs with the same resources are used if
+        there are any.  Otherwise, runtimes with other resources are scaled
+        assuming perfect scaling with the number of cores.
+
+        Parameters
+        ----------
+        kind : {'step', 'test_case'}
+            Whether this is a step or a test case
+
+        path : str
+            The relative path of the step or test case
+
+        ntasks : int
+            The number of tasks it will run with
+
+        cpus_per_task : int
+            The number of cores per task it will run with
+
+        Returns
+        -------
+        runtime : float or None
+            The median of recent runtimes in seconds, or ``None`` if it
+            hasn't run successfully on this machine before
+        """
+        rows = self._connection.execute(
+            'SELECT ntasks, cpus_per_task, runtime FROM runtimes '
+            'WHERE machine = ? AND kind = ? AND path = ? '
+            'ORDER BY rowid DESC', (self.machine, kind, path)).fetchall()
+        if len(rows) == 0:
+            return None
+        same = [runtime for row_ntasks, row_cpus, runtime in rows
+                if row_ntasks == ntasks and row_cpus == cpus_per_task]
+        if len(same) > 0:
+            runtimes = same
+        else:
+            cores = ntasks * cpus_per_task
+            runtimes = [runtime * row_ntasks * row_cpus / cores
+                        for row_ntasks, row_cpus, runtime in rows]
+        return _median(runtimes[:self.recent_runs])
+
+    def close(self):
+        """
+        Close the database
+        """
+        self._connection.close()
+
+
+def get_runtime_history(config):
+    """
+    Open the runtime history database given by the ``runtime_history``
+    config option in the ``run`` section
+
+    Parameters
+    ----------
+    config : polaris.config.PolarisConfigParser
+        Config options for a test case
+
+    Returns
+    -------
+    history : polaris.run.history.RuntimeHistory or None
+        The runtime history, or ``None`` if the option is empty (or was not
+        set because the suite was set up with an older version of polaris)
+        or the database could not be opened
+    """
+    if not config.has_option('run', 'runtime_history'):
+        return None
+    filename = config.get('run', 'runtime_history').strip()
+    if filename == '':
+        return None
+    try:
+        return RuntimeHistory(filename)
+    except (OSError, sqlite3.Error):
+        return None
+
+
+def is_slow(config, runtime, expected):
+    """
+    Whether a runtime is much slower than expected, as determined by the
+    ``slow_factor`` config option in the ``run`` section
+
+    Parameters
+    ----------
+    config : polaris.config.PolarisConfigParser
+        Config options for a test case
+
+    runtime : float
+        The runtime in seconds
+
+    expected : float or None
+        The expected runtime in seconds, if known
+
+    Returns
+    -------
+    slow : bool
+        Whether the runtime is slow
+    """
+    if expected is None:
+        return False
+    slow_factor = 2.
+    if config.has_option('run', 'slow_factor'):
+        slow_factor = config.getfloat('run', 'slow_factor')
+    # ignore differences of a few seconds in runtimes that are very short
+    return runtime > slow_factor * expected and runtime - expected > 10.
+
+
+def get_machine():
+    """
+    Get the name of the machine to record runtimes for
+
+    Returns
+    -------
+    machine : str
+        ``$POLARIS_MACHINE`` if it is set, otherwise the machine found by
+        ``mache`` or, failing that, the host name
+    """
+    if 'POLARIS_MACHINE' in os.environ:
+        return os.environ['POLARIS_MACHINE']
+    machine = discover_machine()
+    if machine is None:
+        machine = socket.gethostname()
+    return machine
+
+
+def _median(values):
+    """ The median of a list of values """
+    values = sorted(values)
+    count = len(values)
+    middle = count // 2
+    if count % 2 == 1:
+        return values[middle]
+    return 0.5 * (values[middle - 1] + values[middle])
@@ -0,0 +1,629 @@
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import time
+from typing import Dict
+
+import mpas_tools.io
+from mpas_tools.logging import LoggingContext
+
+from polaris.config import PolarisConfigParser
+from polaris.dedup import shared_outputs_exist
+from polaris.fingerprint import is_up_to_date
+from polaris.parallel import (
+    check_parallel_system,
+    get_available_cores_and_nodes,
+    get_available_memory,
+    set_cores_per_node,
+)
+from polaris.run.daemon import DaemonContext, launch_step
+from polaris.run.history import get_runtime_history, is_slow
+from polaris.run.scheduler import ResourcePool, StepScheduler
+from polaris.run.serial import (
+    _format_time,
+    _load_suite_state,
+    _load_test_suite,
+    _run_single_step_in_daemon,
+    _update_steps_to_run,
+    _validate_test,
+    run_single_step,
+)
+
+
+def run_tests(suite_name, quiet=False, is_test_case=False, steps_to_run=None,
+              steps_not_to_run=None, use_daemon=True, incremental=False,
+              resume=False):
+    """
+    Run the given test suite or test case in task parallel.  Steps that do
+    not depend on one another (as determined from their inputs and outputs)
+    are run at the same time as long as there are enough cores and memory
+    available for them.  If runtimes from earlier runs are available (see
+    :py:class:`polaris.run.history.RuntimeHistory`), steps on the longest
+    chains of dependent steps are started first.
+
+    Parameters
+    ----------
+    suite_name : str
+        The name of the test suite
+
+    quiet : bool, optional
+        Whether step names are not included in the output as the test suite
+        progresses
+
+    is_test_case : bool
+        Whether this is a test case instead of a full test suite
+
+    steps_to_run : list of str, optional
+        A list of the steps to run if this is a test case, not a full suite.
+        The default behavior is to run the default steps unless they are in
+        ``steps_not_to_run``
+
+    steps_not_to_run : list of str, optional
+        A list of steps not to run if this is a test case, not a full suite.
+        Typically, these are steps to remove from the defaults
+
+    use_daemon : bool, optional
+        Whether to run steps in processes forked from a polaris daemon that
+        already has polaris and the test cases imported, rather than starting
+        a new python process for each step
+
+    incremental : bool, optional
+        Whether to skip steps that ran successfully before and whose
+        fingerprint (see :py:func:`polaris.fingerprint.compute_fingerprint()`)
+        hasn't changed since
+
+    resume : bool, optional
+        Whether to only run the steps that failed or didn't run the last time
+        the test suite or test case was run, reusing the outputs of steps that
+        succeeded
+    """
+    suite_name, test_suite, config = _load_test_suite(suite_name)
+    check_parallel_system(config)
+    state = _load_suite_state(suite_name, test_suite, resume)
+    history = get_runtime_history(config)
+    available_cores, nodes, _ = get_available_cores_and_nodes(config)
+    pool = ResourcePool(nodes=nodes, cores_per_node=available_cores // nodes,
+                        memory_per_node=get_available_memory(config))
+
+    # all test cases are needed up front to schedule their steps.  They are
+    # loaded before the daemon is forked so it has their modules imported
+    test_cases = dict(test_suite['test_cases'])
+    for test_case in test_cases.values():
+        _prepare_test_case(test_case, steps_to_run, steps_not_to_run)
+        test_case.incremental = incremental
+        test_case.hash_fingerprint = incremental
+
+    # start the daemon and logging to stdout/stderr
+    with DaemonContext(enabled=use_daemon) as socket_path, \
+            LoggingContext(suite_name) as logger:
+
+        os.environ['PYTHONUNBUFFERED'] = '1'
+
+        cwd = os.getcwd()
+        if not is_test_case:
+            try:
+                os.makedirs('case_outputs')
+            except OSError:
+                pass
+
+        if nodes == 1:
+            logger.info(f'Running in task parallel on {available_cores} '
+                        f'cores')
+        else:
+            logger.info(f'Running in task parallel on {available_cores} '
+                        f'cores on {nodes} nodes')
+
+        suite_start = time.time()
+        graph = test_suite['graph']
+        runner = _TaskParallelRunner(test_cases, graph, pool, logger, quiet,
+                                     is_test_case, cwd, socket_path, state,
+                                     history, config)
+        runner.run()
+        suite_time = time.time() - suite_start
+
+        os.chdir(cwd)
+
+        logger.info('Test Runtimes:')
+        for test_name in test_cases:
+            test_time = runner.test_times[test_name]
+            logger.info(f'{_format_time(test_time)} '
+                        f'{runner.success_strs[test_name]} {test_name}')
+        logger.info(f'Total runtime {_format_time(suite_time)}')
+
+        if runner.failures == 0:
+            logger.info('PASS: All passed successfully!')
+        else:
+            if runner.failures == 1:
+                message = '1 test'
+            else:
+                message = f'{runner.failures} tests'
+            logger.error(f'FAIL: {message} failed, see above.')
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run a test suite, test case or step in task parallel',
+        prog='polaris run')
+    parser.add_argument("suite", nargs='?',
+                        help="The name of a test suite to run. Can exclude "
+                        "or include the .pickle filename suffix.")
+    parser.add_argument("--steps", dest="steps", nargs='+',
+                        help="The steps of a test case to run")
+    parser.add_argument("--no-steps", dest="no_steps", nargs='+',
+                        help="The steps of a test case not to run, see "
+                             "steps_to_run in the config file for defaults.")
+    parser.add_argument("-q", "--quiet", dest="quiet", action="store_true",
+                        help="If set, step names are not included in the "
+                             "output as the test suite progresses.  Has no "
+                             "effect when running steps on their own.")
+    parser.add_argument("--incremental", dest="incremental",
+                        action="store_true",
+                        help="If set, steps that ran successfully before are "
+                             "skipped if their inputs, config options, "
+                             "namelist, streams and yaml files, and the "
+                             "polaris version haven't changed and their "
+                             "outputs still exist.")
+    parser.add_argument("--resume", dest="resume", action="store_true",
+                        help="If set, only steps that failed or did not run "
+                             "the last time the suite or test case was run "
+                             "are run.")
+    parser.add_argument("--no-daemon", dest="no_daemon", action="store_true",
+                        help="If set, each step is run in a new python "
+                             "process rather than one forked from a polaris "
+                             "daemon.")
+    args = parser.parse_args(sys.argv[2:])
+    use_daemon = not args.no_daemon
+    if args.suite is not None:
+        run_tests(args.suite, quiet=args.quiet, use_daemon=use_daemon,
+                  incremental=args.incremental, resume=args.resume)
+    elif os.path.exists('test_case.pickle'):
+        run_tests(suite_name='test_case', quiet=args.quiet, is_test_case=True,
+                  steps_to_run=args.steps, steps_not_to_run=args.no_steps,
+                  use_daemon=use_daemon, incremental=args.incremental,
+                  resume=args.resume)
+    elif os.path.exists('step.pickle'):
+        # there is nothing to run in parallel with a single step
+        if use_daemon:
+            daemon_args = list()
+            if args.incremental:
+                daemon_args.append('--incremental')
+            _run_single_step_in_daemon(daemon_args)
+        run_single_step(incremental=args.incremental)
+    else:
+        pickles = glob.glob('*.pickle')
+        if len(pickles) == 1:
+            suite = os.path.splitext(os.path.basename(pickles[0]))[0]
+            run_tests(suite, quiet=args.quiet, use_daemon=use_daemon,
+                      incremental=args.incremental, resume=args.resume)
+        elif len(pickles) == 0:
+            raise OSError('No pickle files were found. Are you sure this is '
+                          'a polaris suite, test-case or step work directory?')
+        else:
+            raise ValueError('More than one suite was found. Please specify '
+                             'which to run: polaris run <suite>')
+
+
+class _TaskParallelRunner:
+    """
+    A class for launching the steps of one or more test cases as
+    subprocesses, running steps concurrently once the steps they depend on
+    have finished and the scheduler finds resources for them
+
+    Attributes
+    ----------
+    test_cases : dict of polaris.TestCase
+        The test cases to run with their paths as keys
+
+    scheduler : polaris.run.scheduler.StepScheduler
+        The scheduler that decides when to launch steps and on how many cores
+
+    steps : dict
+        A dictionary with step paths as keys and tuples of test-case path
+        and step as values for all steps that need to be run
+
+    graph : polaris.dag.StepGraph
+        The graph of dependencies between the steps that need to be run
+
+    dependencies : dict
+        A dictionary with step paths as keys and sets of the paths of steps
+        they depend on as values
+
+    history : polaris.run.history.RuntimeHistory or None
+        The runtimes of steps and test cases from earlier runs
+
+    durations : dict
+        The expected runtime in seconds of each step with runtime history on
+        its target number of cores
+
+    status : dict
+        The status (``'success'``, ``'failed'`` or ``'skipped'``) of each
+        step that has finished or will not be run
+
+    success_strs : dict
+        The string describing the outcome of each test case
+
+    test_times : dict
+        The runtime of each test case in seconds
+
+    failures : int
+        The number of test cases that have failed
+    """
+
+    def __init__(self, test_cases, graph, pool, logger, quiet, is_test_case,
+                 cwd, socket_path, state, history, config):
+        self.test_cases = test_cases
+        self.socket_path = socket_path
+        self.state = state
+        self.history = history
+        self.config = config
+        self.logger = logger
+        self.quiet = quiet
+        self.is_test_case = is_test_case
+        self.cwd = cwd
+
+        self.steps = dict()
+        for test_name, test_case in test_cases.items():
+            for step_name in test_case.steps_to_run:
+                step = test_case.steps[step_name]
+                if step.cached:
+                    continue
+                if state.has_succeeded(step):
+                    # resuming and this step's outputs can be reused
+                    if not quiet:
+                        logger.info(f'  * already succeeded: {test_name} '
+                                    f'{step.name}')
+                    continue
+                self.steps[step.path] = (test_name, step)
+
+        self.graph = graph.subgraph(self.steps)
+        self.dependencies = self.graph.dependencies
+        steps = {path: step for path, (_, step) in self.steps.items()}
+        self.durations = self._estimate_durations(steps)
+        if len(self.durations) > 0:
+            self.scheduler = StepScheduler(steps, graph, pool, self.durations)
+        else:
+            self.scheduler = StepScheduler(steps, graph, pool)
+
+        self.status = dict()
+        self.success_strs = dict()
+        self.test_times = dict()
+        self.failures = 0
+
+        self._pending = list(self.steps)
+        self._running = dict()
+        self._test_start = dict()
+        self._test_failed = dict()
+        self._remaining = dict()
+        for test_name in test_cases:
+            self._test_failed[test_name] = False
+            self._remaining[test_name] = 0
+        for test_name, _ in self.steps.values():
+            self._remaining[test_name] += 1
+
+    def run(self):
+        """
+        Run all steps, validating each test case when its steps are done
+        """
+        for test_name, count in self._remaining.items():
+            if count == 0:
+                # all steps were cached or there are no steps to run
+                self._test_start[test_name] = time.time()
+                self._finish_test(test_name)
+
+        while len(self._pending) > 0 or len(self._running) > 0:
+            launched = self._launch_ready_steps()
+            finished = self._poll_running_steps()
+            if not launched and not finished:
+                time.sleep(0.1)
+
+    def _launch_ready_steps(self):
+        """
+        Launch any steps whose dependencies have finished if the scheduler
+        finds resources for them
+        """
+        ready = list()
+        for path in list(self._pending):
+            if path not in self._pending:
+                # skipped because another step in the test case failed
+                continue
+            dependencies = self.dependencies[path]
+
+            if any(self.status.get(dependency) in ['failed', 'skipped']
+                   for dependency in dependencies):
+                self._pending.remove(path)
+                self._skip_step(path, reason='a step it depends on failed')
+                continue
+
+            if not all(self.status.get(dependency) == 'success'
+                       for dependency in dependencies):
+                continue
+
+            test_name, step = self.steps[path]
+            if self.test_cases[test_name].incremental and \
+                    is_up_to_date(step):
+                self._pending.remove(path)
+                self._up_to_date_step(path, 'up to date')
+                continue
+
+            if step.shared_from is not None and shared_outputs_exist(step):
+                # no need to launch a process that does nothing
+                self._pending.remove(path)
+                self._up_to_date_step(path, 'shared')
+                continue
+
+            ready.append(path)
+
+        if len(ready) == 0:
+            return False
+
+        launches = self.scheduler.schedule(ready, time.time())
+        for path, cpus_per_task, ntasks, placement in launches:
+            self._pending.remove(path)
+            if self.scheduler.pool.nodes == 1:
+                # no need to tell the step which node to run on
+                placement = None
+            self._launch_step(path, cpus_per_task * ntasks, placement)
+
+        return len(launches) > 0
+
+    def _launch_step(self, path, cores, placement):
+        """
+        Launch a step as a subprocess on the given number of cores and,
+        if there is more than one node, the given placement on nodes
+        """
+        test_name, step = self.steps[path]
+        test_case = self.test_cases[test_name]
+
+        if test_name not in self._test_start:
+            self._test_start[test_name] = time.time()
+
+        if self.is_test_case:
+            log_filename = f'{test_case.work_dir}/{step.name}.log'
+        else:
+            step_prefix = step.path.replace('/', '_')
+            log_filename = f'{self.cwd}/case_outputs/{step_prefix}.log'
+
+        if not self.quiet:
+            if placement is None:
+                nodes_str = ''
+            else:
+                nodes_str = f' on node(s) {sorted(placement)}'
+            self.logger.info(f'  * start: {test_name} {step.name} '
+                             f'({cores} cores{nodes_str})')
+
+        args = ['polaris', 'serial', '--step_is_subprocess',
+                '--available_cores', f'{cores}']
+        if test_case.hash_fingerprint:
+            # the fingerprint will be compared the next time with
+            # --incremental, so it needs the hashes of the inputs
+            args.append('--hash_fingerprint')
+        if placement is not None:
+            placement_str = ','.join([f'{node}:{tasks}' for node, tasks in
+                                      sorted(placement.items())])
+            args.extend(['--placement', placement_str])
+        log_file = open(log_filename, 'w')
+        process = None
+        if self.socket_path is not None:
+            process = launch_step(args[2:], step.work_dir, log_file.fileno(),
+                                  socket_path=self.socket_path)
+        if process is None:
+            process = subprocess.Popen(args, cwd=step.work_dir,
+                                       stdout=log_file,
+                                       stderr=subprocess.STDOUT)
+        self._running[path] = (process, log_file, log_filename,
+                               time.time())
+        self.state.set(path, 'running')
+
+    def _poll_running_steps(self):
+        """ Check for steps that have finished and free their cores """
+        finished = False
+        for path in list(self._running):
+            process, log_file, log_filename, start = self._running[path]
+            if process.poll() is None:
+                continue
+
+            finished = True
+            log_file.close()
+            self._running.pop(path)
+            cpus_per_task, ntasks = self.scheduler.get_allotment(path)
+            self.scheduler.finish(path)
+            test_name, step = self.steps[path]
+            if process.returncode == 0:
+                self.status[path] = 'success'
+                self.state.set(path, 'succeeded')
+                if not self.quiet:
+                    self.logger.info(f'  * done:  {test_name} {step.name}')
+                self._record_step_time(path, ntasks, cpus_per_task,
+                                       time.time() - start)
+            else:
+                self.status[path] = 'failed'
+                self.state.set(path, 'failed')
+                self.logger.error(f'  * failed: {test_name} {step.name}\n'
+                                  f'      see: {log_filename}')
+                self._fail_test(test_name)
+
+            self._step_finished(test_name)
+
+        return finished
+
+    def _up_to_date_step(self, path, reason):
+        """
+        Treat a step that is up to date or whose outputs come from an
+        identical step as if it ran successfully
+        """
+        test_name, step = self.steps[path]
+        if test_name not in self._test_start:
+            self._test_start[test_name] = time.time()
+        self.status[path] = 'success'
+        self.state.set(path, 'succeeded')
+        if not self.quiet:
+            self.logger.info(f'  * {reason}: {test_name} {step.name}')
+        self._step_finished(test_name)
+
+    def _skip_step(self, path, reason):
+        """ Skip a step that will not be run """
+        test_name, step = self.steps[path]
+        self.status[path] = 'skipped'
+        if not self.quiet:
+            self.logger.info(f'  * skip:  {test_name} {step.name} '
+                             f'because {reason}')
+        self._fail_test(test_name)
+        self._step_finished(test_name)
+
+    def _fail_test(self, test_name):
+        """
+        Mark a test case as failed and skip the steps that have not yet
+        started, since a test case stops at its first failed step
+        """
+        if self._test_failed[test_name]:
+            return
+        self._test_failed[test_name] = True
+        for path in list(self._pending):
+            if self.steps[path][0] == test_name:
+                self._pending.remove(path)
+                self._skip_step(path, reason='the test case failed')
+
+    def _step_finished(self, test_name):
+        """ Keep track of finished steps and finish the test case if done """
+        self._remaining[test_name] -= 1
+        if self._remaining[test_name] == 0:
+            self._finish_test(test_name)
+
+    def _finish_test(self, test_name):
+        """
+        Validate a test case once all its steps have run and log the results
+        """
+        test_case = self.test_cases[test_name]
+        logger = self.logger
+        if self.is_test_case:
+            log_filename = None
+            test_logger = logger
+        else:
+            test_prefix = test_case.path.replace('/', '_')
+            log_filename = f'{self.cwd}/case_outputs/{test_prefix}.log'
+            test_logger = None
+
+        logger.info(f'{test_name}')
+        test_pass = not self._test_failed[test_name]
+        with LoggingContext(test_name, logger=test_logger,
+                            log_filename=log_filename) as test_logger:
+            test_case.logger = test_logger
+            test_case.stdout_logger = test_logger
+            test_case.log_filename = log_filename
+            os.chdir(test_case.work_dir)
+            success_str, success = _validate_test(
+                test_case, logger, test_logger, test_pass, self.is_test_case)
+            os.chdir(self.cwd)
+
+        if test_name in self._test_start:
+            test_time = time.time() - self._test_start[test_name]
+        else:
+            # none of the steps were run
+            test_time = 0.
+        logger.info(f'  test runtime:        '
+                    f'\033[94m{_format_time(test_time)}\033[0m')
+
+        self.success_strs[test_name] = success_str
+        self.test_times[test_name] = test_time
+        if not success:
+            self.failures += 1
+
+        if self.history is not None and success and test_name in \
+                self._test_start:
+            cores = self.scheduler.pool.total_cores
+            expected = self.history.estimate('test_case', test_case.path,
+                                             cores, 1)
+            if is_slow(self.config, test_time, expected):
+                logger.warning(f'  slower than usual (typically '
+                               f'{_format_time(expected)})')
+            self.history.add('test_case', test_case.path, cores, 1,
+                             test_time)
+        self._log_time_remaining()
+
+    def _estimate_durations(self, steps):
+        """
+        Estimate the runtime of each step on its target number of cores from
+        the runtime history
+        """
+        durations: Dict[str, float] = dict()
+        if self.history is None:
+            return durations
+        for path, step in steps.items():
+            if step.ntasks is None or step.cpus_per_task is None:
+                continue
+            duration = self.history.estimate('step', path, step.ntasks,
+                                             step.cpus_per_task)
+            if duration is not None:
+                durations[path] = duration
+        return durations
+
+    def _record_step_time(self, path, ntasks, cpus_per_task, step_time):
+        """
+        Add the runtime of a step that succeeded to the runtime history and
+        flag it if it was much slower than usual
+        """
+        if self.history is None:
+            return
+        test_name, step = self.steps[path]
+        expected = self.history.estimate('step', path, ntasks, cpus_per_task)
+        if is_slow(self.config, step_time, expected):
+            self.logger.warning(f'  * slow:  {test_name} {step.name} took '
+                                f'{_format_time(step_time)} (typically '
+                                f'{_format_time(expected)})')
+        self.history.add('step', path, ntasks, cpus_per_task, step_time)
+
+    def _log_time_remaining(self):
+        """
+        Log an estimate of how long the remaining steps will take, which is
+        at least the longest chain of dependent steps that remain and at
+        least the remaining work spread over all the cores
+        """
+        if len(self.durations) == 0:
+            return
+        remaining = [path for path in self.steps
+                     if path in self._pending or path in self._running]
+        if len(remaining) == 0:
+            return
+        now = time.time()
+        durations = dict()
+        for path in remaining:
+            duration = self.durations.get(path)
+            if duration is None:
+                continue
+            if path in self._running:
+                start = self._running[path][3]
+                duration = max(0., duration - (now - start))
+            durations[path] = duration
+        unknown = len(remaining) - len(durations)
+        graph = self.graph.subgraph(remaining)
+        for path in remaining:
+            if path not in durations:
+                # steps without history don't add to the estimate
+                durations[path] = 0.
+        estimate = graph.makespan_lower_bound(
+            self.scheduler.pool.total_cores, durations)
+        message = f'  estimated time remaining: {_format_time(estimate)}'
+        if unknown > 0:
+            message = f'{message} (plus {unknown} step(s) without history)'
+        self.logger.info(message)
+
+
+def _prepare_test_case(test_case, steps_to_run, steps_not_to_run):
+    """
+    Read the config options for a test case and determine which steps to run
+    """
+    config = PolarisConfigParser()
+    config.add_from_file(os.path.join(test_case.work_dir,
+                                      test_case.config_filename))
+    test_case.config = config
+    set_cores_per_node(test_case.config)
+
+    mpas_tools.io.default_format = config.get('io', 'format')
+    mpas_tools.io.default_engine = config.get('io', 'engine')
+
+    test_case.steps_to_run = _update_steps_to_run(
+        steps_to_run, steps_not_to_run, config, test_case.steps)
+    test_case.new_step_log_file = False
@@ -0,0 +1,463 @@
+from typing import Dict, List, Optional, Tuple
+
+
+class ResourcePool:
+    """
+    The cores and memory on each node that are available for running steps
+
+    Attributes
+    ----------
+    nodes : int
+        The number of nodes
+
+    cores_per_node : int
+        The number of cores on each node available for running steps
+
+    memory_per_node : float or None
+        The memory on each node in MB, or ``None`` if memory is not being
+        tracked
+
+    free_cores : list of int
+        The number of free cores on each node
+
+    free_memory : list of float or None
+        The amount of free memory on each node in MB, or ``None`` if memory
+        is not being tracked
+    """
+
+    def __init__(self, nodes, cores_per_node, memory_per_node=None):
+        """
+        Create a new pool of resources with nothing allocated
+
+        Parameters
+        ----------
+        nodes : int
+            The number of nodes
+
+        cores_per_node : int
+            The number of cores on each node available for running steps
+
+        memory_per_node : float, optional
+            The memory on each node in MB
+        """
+        self.nodes = nodes
+        self.cores_per_node = cores_per_node
+        self.memory_per_node = memory_per_node
+        self.free_cores = [cores_per_node] * nodes
+        self.free_memory: Optional[List[float]] = None
+        if memory_per_node is not None:
+            self.free_memory = [float(memory_per_node)] * nodes
+
+    @property
+    def total_cores(self):
+        """ The total number of cores in the pool """
+        return self.nodes * self.cores_per_node
+
+    @property
+    def total_free_cores(self):
+        """ The total number of cores that are free """
+        return sum(self.free_cores)
+
+    def copy(self):
+        """
+        Make a copy of the pool, used to try out allocations
+
+        Returns
+        -------
+        pool : polaris.run.scheduler.ResourcePool
+            A copy of this pool
+        """
+        pool = ResourcePool(self.nodes, self.cores_per_node,
+                            self.memory_per_node)
+        pool.free_cores = list(self.free_cores)
+        if self.free_memory is not None:
+            pool.free_memory = list(self.free_memory)
+        return pool
+
+    def place(self, cpus_per_task, ntasks, memory=None):
+        """
+        Find nodes with enough free cores and memory for the given tasks.
+        If all tasks fit on one node, the node with the fewest free cores
+        that fits them is chosen (best fit), leaving larger holes for other
+        steps.  Otherwise, tasks are spread over the nodes with the most room.
+
+        Parameters
+        ----------
+        cpus_per_task : int
+            The number of cores for each task
+
+        ntasks : int
+            The number of tasks
+
+        memory : float, optional
+            The total memory in MB used by all tasks, assumed to be divided
+            evenly between them
+
+        Returns
+        -------
+        placement : dict or None
+            The number of tasks (values) to run on each node (keys), or
+            ``None`` if the tasks don't fit
+        """
+        if memory is None or self.free_memory is None:
+            memory_per_task = 0.
+        else:
+            memory_per_task = memory / ntasks
+
+        capacities = [self._get_capacity(node, cpus_per_task, memory_per_task)
+                      for node in range(self.nodes)]
+
+        candidates = [node for node in range(self.nodes)
+                      if capacities[node] >= ntasks]
+        if len(candidates) > 0:
+            node = min(candidates, key=lambda node: self.free_cores[node])
+            return {node: ntasks}
+
+        if cpus_per_task > 1 and ntasks == 1:
+            # a single multithreaded task must be on one node
+            return None
+
+        placement: Dict[int, int] = dict()
+        remaining = ntasks
+        by_capacity = sorted(range(self.nodes),
+                             key=lambda node: -capacities[node])
+        for node in by_capacity:
+            tasks = min(capacities[node], remaining)
+            if tasks > 0:
+                placement[node] = tasks
+                remaining -= tasks
+            if remaining == 0:
+                return placement
+        return None
+
+    def allocate(self, placement, cpus_per_task, memory=None):
+        """
+        Take the cores and memory for the given placement out of the pool
+
+        Parameters
+        ----------
+        placement : dict
+            The number of tasks (values) to run on each node (keys)
+
+        cpus_per_task : int
+            The number of cores for each task
+
+        memory : float, optional
+            The total memory in MB used by all tasks
+        """
+        self._update(placement, cpus_per_task, memory, sign=-1)
+
+    def release(self, placement, cpus_per_task, memory=None):
+        """
+        Return the cores and memory for the given placement to the pool
+
+        Parameters
+        ----------
+        placement : dict
+            The number of tasks (values) running on each node (keys)
+
+        cpus_per_task : int
+            The number of cores for each task
+
+        memory : float, optional
+            The total memory in MB used by all tasks
+        """
+        self._update(placement, cpus_per_task, memory, sign=1)
+
+    def _get_capacity(self, node, cpus_per_task, memory_per_task):
+        """ The number of tasks that fit on a node """
+        capacity = self.free_cores[node] // cpus_per_task
+        if memory_per_task > 0. and self.free_memory is not None:
+            capacity = min(capacity,
+                           int(self.free_memory[node] // memory_per_task))
+        return capacity
+
+    def _update(self, placement, cpus_per_task, memory, sign):
+        """ Add or remove resources for a placement """
+        ntasks = sum(placement.values())
+        for node, tasks in placement.items():
+            self.free_cores[node] += sign * tasks * cpus_per_task
+            if memory is not None and self.free_memory is not None:
+                self.free_memory[node] += sign * memory * tasks / ntasks
+
+
+class StepScheduler:
+    """
+    A scheduler that decides which ready steps to launch and how many cores
+    to give each of them, treating cores, nodes and memory as resources to
+    pack as tightly as possible.
+
+    Steps are considered in order of their bottom level in the step graph
+    (the length of the longest chain of steps that can't start until they
+    are done), so steps on the critical path go first.  A step may be given
+    fewer tasks (or, for a single task, fewer cores per task) than its target,
+    down to its minimum.  It is started now with fewer cores only if it is
+    expected to finish no later than it would by waiting for enough cores for
+    its target to free up.  Otherwise, cores are reserved for it and only
+    steps that are expected to finish before the reserved cores free up are
+    started in the meantime (backfilling).
+
+    Runtimes are assumed to scale inversely with the number of cores.
+    Without runtimes from earlier runs, all steps are assumed to take the
+    same amount of time on their target number of cores.
+
+    Attributes
+    ----------
+    pool : polaris.run.scheduler.ResourcePool
+        The resources available for running steps
+
+    steps : dict
+        The steps that can be scheduled, with their paths as keys
+
+    durations : dict or None
+        The expected runtime in seconds of each step on its target number of
+        cores, with step paths as keys
+
+    priorities : dict
+        The bottom level of each step in the step graph
+    """
+
+    def __init__(self, steps, graph, pool, durations=None):
+        """
+        Create a new scheduler
+
+        Parameters
+        ----------
+        steps : dict of polaris.Step
+            The steps that can be scheduled, with their paths as keys
+
+        graph : polaris.dag.StepGraph
+            The graph of dependencies between steps
+
+        pool : polaris.run.scheduler.ResourcePool
+            The resources available for running steps
+
+        durations : dict, optional
+            The expected runtime in seconds of each step on its target number
+            of cores, with step paths as keys
+        """
+        self.pool = pool
+        self.steps = steps
+        self.durations = durations
+        self.priorities = graph.subgraph(steps).bottom_levels(durations)
+
+        self._default_duration = 1.
+        if durations is not None and len(durations) > 0:
+            self._default_duration = \
+                sum(durations.values()) / len(durations)
+
+        # the allotment, placement and start time of each running step
+        self._running: Dict[str, Dict] = dict()
+
+    @property
+    def running(self):
+        """ The paths of the steps that are running """
+        return list(self._running)
+
+    def schedule(self, ready, now):
+        """
+        Decide which of the ready steps to launch now and with what resources
+
+        Parameters
+        ----------
+        ready : list of str
+            The paths of steps whose dependencies have all succeeded
+
+        now : float
+            The current time in seconds
+
+        Returns
+        -------
+        launches : list of tuple
+            The path, cores per task, number of tasks and placement (a
+            dictionary with the number of tasks on each node) for each step
+            to launch
+        """
+        ready = sorted(ready, key=self._sort_key)
+        launches: List[Tuple[str, int, int, Dict[int, int]]] = list()
+        # the time at which cores reserved for a blocked step will be free
+        reserved_time = None
+        for path in ready:
+            target = self._get_target(path)
+            allotment = self._find_allotment(path)
+            if allotment is None:
+                if len(self._running) == 0 and len(launches) == 0:
+                    # nothing will free up resources so run on what we have
+                    # (the step will fail if this is below its minimum)
+                    allotment, placement = self._get_fallback(path)
+                    memory = self.steps[path].max_memory
+                    self._start(path, allotment, placement, now, memory)
+                    cpus_per_task, ntasks = allotment
+                    launches.append((path, cpus_per_task, ntasks, placement))
+                    continue
+                if reserved_time is None:
+                    smallest = self._get_allotments(path)[-1]
+                    reserved_time = self._time_until_fits(path, smallest, now)
+                continue
+
+            start_now = True
+            if reserved_time is not None:
+                # backfill only if this step won't delay the reserved one
+                finish = now + self._get_expected(path, allotment)
+                start_now = finish <= reserved_time
+            elif allotment != target:
+                wait = self._time_until_fits(path, target, now)
+                finish_now = now + self._get_expected(path, allotment)
+                finish_wait = wait + self._get_expected(path, target)
+                start_now = finish_now <= finish_wait
+                if not start_now:
+                    reserved_time = wait
+
+            if not start_now:
+                continue
+
+            cpus_per_task, ntasks = allotment
+            memory = self.steps[path].max_memory
+            placement = self.pool.place(cpus_per_task, ntasks, memory)
+            self._start(path, allotment, placement, now, memory)
+            launches.append((path, cpus_per_task, ntasks, placement))
+
+        return launches
+
+    def get_allotment(self, path):
+        """
+        Get the resources a running step was launched with
+
+        Parameters
+        ----------
+        path : str
+            The path of the step
+
+        Returns
+        -------
+        cpus_per_task : int
+            The number of cores per task
+
+        ntasks : int
+            The number of tasks
+        """
+        return self._running[path]['allotment']
+
+    def finish(self, path):
+        """
+        Return the resources of a step that has finished to the pool
+
+        Parameters
+        ----------
+        path : str
+            The path of the step
+        """
+        running = self._running.pop(path)
+        self.pool.release(running['placement'], running['cpus_per_task'],
+                          running['memory'])
+
+    def _sort_key(self, path):
+        """ Sort by decreasing priority, then by decreasing size """
+        cpus_per_task, ntasks = self._get_target(path)
+        return -self.priorities.get(path, 0.), -cpus_per_task * ntasks, path
+
+    def _start(self, path, allotment, placement, now, memory):
+        """ Take resources for a step from the pool """
+        cpus_per_task, _ = allotment
+        self.pool.allocate(placement, cpus_per_task, memory)
+        self._running[path] = dict(allotment=allotment, placement=placement,
+                                   cpus_per_task=cpus_per_task, memory=memory,
+                                   start=now)
+
+    def _get_target(self, path):
+        """ The target cores per task and number of tasks of a step """
+        step = self.steps[path]
+        return step.cpus_per_task, step.ntasks
+
+    def _get_allotments(self, path):
+        """
+        The allotments (cores per task and number of tasks) a step could run
+        with in the order of preference, following the rules in
+        :py:meth:`polaris.Step.constrain_resources()`
+        """
+        step = self.steps[path]
+        cpus_per_task, ntasks = step.cpus_per_task, step.ntasks
+        min_cpus_per_task = step.min_cpus_per_task
+        if min_cpus_per_task is None:
+            min_cpus_per_task = cpus_per_task
+        min_tasks = step.min_tasks
+        if min_tasks is None:
+            min_tasks = ntasks
+        if ntasks == 1:
+            return [(cpus, 1) for cpus in
+                    range(cpus_per_task, min_cpus_per_task - 1, -1)]
+        elif cpus_per_task == min_cpus_per_task:
+            return [(cpus_per_task, tasks) for tasks in
+                    range(ntasks, min_tasks - 1, -1)]
+        else:
+            return [(cpus_per_task, ntasks)]
+
+    def _get_fallback(self, path):
+        """
+        The smallest allotment of a step that doesn't fit in the pool even
+        with nothing else running, clipped to the pool, and its placement.
+        If the step's memory doesn't fit either, the tasks are placed by
+        cores alone.
+        """
+        pool = self.pool
+        cpus_per_task, ntasks = self._get_allotments(path)[-1]
+        # a task must be on one node
+        cpus_per_task = min(cpus_per_task, max(pool.free_cores))
+        capacity = sum(cores // cpus_per_task for cores in pool.free_cores)
+        ntasks = max(1, min(ntasks, capacity))
+        memory = self.steps[path].max_memory
+        placement = pool.place(cpus_per_task, ntasks, memory)
+        if placement is None:
+            placement = pool.place(cpus_per_task, ntasks)
+        return (cpus_per_task, ntasks), placement
+
+    def _find_allotment(self, path):
+        """ The largest allotment for a step that fits in the pool """
+        pool = self.pool
+        memory = self.steps[path].max_memory
+        for cpus_per_task, ntasks in self._get_allotments(path):
+            if pool.place(cpus_per_task, ntasks, memory) is not None:
+                return cpus_per_task, ntasks
+        return None
+
+    def _get_expected(self, path, allotment):
+        """
+        The expected runtime of a step with the given allotment, assuming
+        perfect scaling from the target number of cores
+        """
+        duration = self._default_duration
+        if self.durations is not None and path in self.durations:
+            duration = self.durations[path]
+        target_cpus, target_tasks = self._get_target(path)
+        cpus_per_task, ntasks = allotment
+        return duration * target_cpus * target_tasks / (cpus_per_task * ntasks)
+
+    def _get_remaining(self, path, now):
+        """ The expected remaining runtime of a running step """
+        running = self._running[path]
+        expected = self._get_expected(path, running['allotment'])
+        if self.durations is None:
+            # without measured runtimes, elapsed time can't be compared
+            return expected
+        return max(0., expected - (now - running['start']))
+
+    def _time_until_fits(self, path, allotment, now):
+        """
+        The time at which enough resources are expected to be free to run a
+        step with the given allotment, assuming running steps finish as
+        expected and nothing else is started
+        """
+        memory = self.steps[path].max_memory
+        cpus_per_task, ntasks = allotment
+        pool = self.pool.copy()
+        if pool.place(cpus_per_task, ntasks, memory) is not None:
+            return now
+        finishing = sorted(self._running,
+                           key=lambda other: self._get_remaining(other, now))
+        for other in finishing:
+            running = self._running[other]
+            pool.release(running['placement'], running['cpus_per_task'],
+                         running['memory'])
+            if pool.place(cpus_per_task, ntasks, memory) is not None:
+                return now + self._get_remaining(other, now)
+        return float('inf')
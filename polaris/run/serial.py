@@ -2,26 +2,40 @@ import argparse
 import glob
 import os
 import pickle
+import signal
+import subprocess
 import sys
 import time
+from typing import Dict, List, Optional, Set
 
 import mpas_tools.io
 from mpas_tools.logging import LoggingContext, check_call
 
 from polaris.config import PolarisConfigParser
+from polaris.dedup import shared_outputs_exist, unshare_step
+from polaris.fingerprint import (
+    is_up_to_date,
+    remove_fingerprint,
+    write_fingerprint,
+)
 from polaris.logging import log_function_call, log_method_call
+from polaris.manifest import TestCaseIndex, load_step, load_suite
 from polaris.parallel import (
     check_parallel_system,
     get_available_cores_and_nodes,
     run_command,
     set_cores_per_node,
 )
+from polaris.run.state import SuiteState
+from polaris.run.watchdog import StepWatchdog, get_step_limits
 
 
 def run_tests(suite_name, quiet=False, is_test_case=False, steps_to_run=None,
-              steps_not_to_run=None):
+              steps_not_to_run=None, incremental=False, resume=False):
     """
-    Run the given test suite or test case
+    Run the given test suite or test case.  If runtimes from earlier runs are
+    available (see :py:class:`polaris.run.history.RuntimeHistory`), the
+    longest test cases are run first.
 
     Parameters
     ----------
@@ -43,26 +57,26 @@ def run_tests(suite_name, quiet=False, is_test_case=False, steps_to_run=None,
     steps_not_to_run : list of str, optional
         A list of steps not to run if this is a test case, not a full suite.
         Typically, these are steps to remove from the defaults
+
+    incremental : bool, optional
+        Whether to skip steps that ran successfully before and whose
+        fingerprint (see :py:func:`polaris.fingerprint.compute_fingerprint()`)
+        hasn't changed since
+
+    resume : bool, optional
+        Whether to only run the steps that failed or didn't run the last time
+        the test suite or test case was run, reusing the outputs of steps that
+        succeeded
     """
 
-    # Allow a suite name to either include or not the .pickle suffix
-    if suite_name.endswith('.pickle'):
-        # code below assumes no suffix, so remove it
-        suite_name = suite_name[:-len('.pickle')]
-    # Now open the the suite's pickle file
-    if not os.path.exists(f'{suite_name}.pickle'):
-        raise ValueError(f'The suite "{suite_name}" does not appear to have '
-                         f'been set up here.')
-    with open(f'{suite_name}.pickle', 'rb') as handle:
-        test_suite = pickle.load(handle)
+    # imported here because steps run on their own don't need the history
+    from polaris.run.history import get_runtime_history, is_slow
 
-    # get the config file for the first test case in the suite
-    test_case = next(iter(test_suite['test_cases'].values()))
-    config_filename = os.path.join(test_case.work_dir,
-                                   test_case.config_filename)
-    config = PolarisConfigParser()
-    config.add_from_file(config_filename)
+    suite_name, test_suite, config = _load_test_suite(suite_name)
     check_parallel_system(config)
+    state = _load_suite_state(suite_name, test_suite, resume)
+    history = get_runtime_history(config)
+    available_cores, _, _ = get_available_cores_and_nodes(config)
 
     # start logging to stdout/stderr
     with LoggingContext(suite_name) as logger:
@@ -80,10 +94,19 @@ def run_tests(suite_name, quiet=False, is_test_case=False, steps_to_run=None,
         suite_start = time.time()
         test_times = dict()
         success_strs = dict()
-        for test_name in test_suite['test_cases']:
+        estimates = _estimate_test_times(test_suite, history, available_cores)
+        test_names = _order_test_cases(test_suite, estimates)
+        for index, test_name in enumerate(test_names):
+            if index > 0:
+                _log_time_remaining(logger, test_names[index:], estimates)
             logger.info(f'{test_name}')
 
+            # load the test case only now that it's about to run
             test_case = test_suite['test_cases'][test_name]
+            test_case.incremental = incremental
+            test_case.hash_fingerprint = incremental
+            test_case.suite_state = state
+            test_case.history = history
 
             if is_test_case:
                 log_filename = None
@@ -100,6 +123,13 @@ def run_tests(suite_name, quiet=False, is_test_case=False, steps_to_run=None,
             if not success:
                 failures += 1
             test_times[test_name] = test_time
+            if history is not None and success:
+                expected = estimates[test_name]
+                if is_slow(config, test_time, expected):
+                    logger.warning(f'  slower than usual (typically '
+                                   f'{_format_time(expected)})')
+                history.add('test_case', test_case.path, available_cores, 1,
+                            test_time)
 
         suite_time = time.time() - suite_start
 
@@ -107,15 +137,9 @@ def run_tests(suite_name, quiet=False, is_test_case=False, steps_to_run=None,
 
         logger.info('Test Runtimes:')
         for test_name, test_time in test_times.items():
-            secs = round(test_time)
-            mins = secs // 60
-            secs -= 60 * mins
-            logger.info(f'{mins:02d}:{secs:02d} {success_strs[test_name]} '
-                        f'{test_name}')
-        secs = round(suite_time)
-        mins = secs // 60
-        secs -= 60 * mins
-        logger.info(f'Total runtime {mins:02d}:{secs:02d}')
+            logger.info(f'{_format_time(test_time)} '
+                        f'{success_strs[test_name]} {test_name}')
+        logger.info(f'Total runtime {_format_time(suite_time)}')
 
         if failures == 0:
             logger.info('PASS: All passed successfully!')
@@ -128,7 +152,8 @@ def run_tests(suite_name, quiet=False, is_test_case=False, steps_to_run=None,
             sys.exit(1)
 
 
-def run_single_step(step_is_subprocess=False):
+def run_single_step(step_is_subprocess=False, available_cores=None,
+                    placement=None, incremental=False, hash_fingerprint=None):
     """
     Used by the framework to run a step when ``polaris serial`` gets called in
     the step's work directory
@@ -137,22 +162,42 @@ def run_single_step(step_is_subprocess=False):
     ----------
     step_is_subprocess : bool, optional
         Whether the step is being run as a subprocess of a test case or suite
+
+    available_cores : int, optional
+        The number of cores the step has been allotted (e.g. by the
+        task-parallel runner).  By default, all cores available to the job
+        are used.
+
+    placement : dict, optional
+        The number of tasks (values) the step has been allotted on each node
+        (keys, offsets into the nodes of the job).  By default, the parallel
+        executable decides where to run the tasks.
+
+    incremental : bool, optional
+        Whether to skip the step if it ran successfully before and its
+        fingerprint hasn't changed since
+
+    hash_fingerprint : bool, optional
+        Whether to hash the contents of the step's inputs in the fingerprint
+        it records (see :py:func:`polaris.fingerprint.write_fingerprint()`).
+        By default, only if ``incremental`` is ``True``.
     """
-    with open('step.pickle', 'rb') as handle:
-        test_case, step = pickle.load(handle)
+    test_case, step = load_step()
     test_case.steps_to_run = [step.name]
     test_case.new_step_log_file = False
+    test_case.incremental = incremental
+    if hash_fingerprint is None:
+        hash_fingerprint = incremental
+    test_case.hash_fingerprint = hash_fingerprint
+    test_case.suite_state = None
+    test_case.history = None
 
     if step_is_subprocess:
         step.run_as_subprocess = False
 
-    config = PolarisConfigParser()
-    config.add_from_file(step.config_filename)
-
+    config = test_case.config
     check_parallel_system(config)
-
-    test_case.config = config
-    set_cores_per_node(test_case.config)
+    set_cores_per_node(config)
 
     mpas_tools.io.default_format = config.get('io', 'format')
     mpas_tools.io.default_engine = config.get('io', 'engine')
@@ -164,11 +209,16 @@ def run_single_step(step_is_subprocess=False):
         test_case.stdout_logger = None
         log_function_call(function=_run_test, logger=logger)
         logger.info('')
-        _run_test(test_case)
+        _run_test(test_case, available_cores, placement)
 
         if not step_is_subprocess:
             # only perform validation if the step is being run by a user on its
-            # own
+            # own.  Validation may compare the outputs of several steps so it
+            # needs the full test case
+            test_case = _load_full_test_case(test_case)
+            test_case.logger = logger
+            test_case.stdout_logger = None
+            test_case.config = config
             logger.info('')
             log_method_call(method=test_case.validate, logger=logger)
             logger.info('')
@@ -196,19 +246,56 @@ def main():
                         action="store_true",
                         help="Used internally by polaris to indicate that"
                              "a step is being run as a subprocess.")
+    parser.add_argument("--available_cores", dest="available_cores",
+                        type=int,
+                        help="Used internally by polaris to indicate the "
+                             "number of cores a step has been allotted.")
+    parser.add_argument("--placement", dest="placement",
+                        help="Used internally by polaris to indicate the "
+                             "number of tasks a step has been allotted on "
+                             "each node, e.g. 0:64,1:32.")
+    parser.add_argument("--incremental", dest="incremental",
+                        action="store_true",
+                        help="If set, steps that ran successfully before are "
+                             "skipped if their inputs, config options, "
+                             "namelist, streams and yaml files, and the "
+                             "polaris version haven't changed and their "
+                             "outputs still exist.")
+    parser.add_argument("--resume", dest="resume", action="store_true",
+                        help="If set, only steps that failed or did not run "
+                             "the last time the suite or test case was run "
+                             "are run.")
+    parser.add_argument("--hash_fingerprint", dest="hash_fingerprint",
+                        action="store_true",
+                        help="Used internally by polaris to indicate that "
+                             "a step run as a subprocess should hash its "
+                             "inputs in its fingerprint.")
+    parser.add_argument("--no-daemon", dest="no_daemon", action="store_true",
+                        help="If set, a step is run in this process even if "
+                             "a polaris daemon is running.")
     args = parser.parse_args(sys.argv[2:])
     if args.suite is not None:
-        run_tests(args.suite, quiet=args.quiet)
+        run_tests(args.suite, quiet=args.quiet, incremental=args.incremental,
+                  resume=args.resume)
     elif os.path.exists('test_case.pickle'):
         run_tests(suite_name='test_case', quiet=args.quiet, is_test_case=True,
-                  steps_to_run=args.steps, steps_not_to_run=args.no_steps)
+                  steps_to_run=args.steps, steps_not_to_run=args.no_steps,
+                  incremental=args.incremental, resume=args.resume)
     elif os.path.exists('step.pickle'):
-        run_single_step(args.step_is_subprocess)
+        if not args.step_is_subprocess and not args.no_daemon:
+            _run_single_step_in_daemon(sys.argv[2:])
+        placement = None
+        if args.placement is not None:
+            placement = _parse_placement(args.placement)
+        run_single_step(args.step_is_subprocess, args.available_cores,
+                        placement, args.incremental,
+                        args.incremental or args.hash_fingerprint)
     else:
         pickles = glob.glob('*.pickle')
         if len(pickles) == 1:
             suite = os.path.splitext(os.path.basename(pickles[0]))[0]
-            run_tests(suite, quiet=args.quiet)
+            run_tests(suite, quiet=args.quiet, incremental=args.incremental,
+                      resume=args.resume)
         elif len(pickles) == 0:
             raise OSError('No pickle files were found. Are you sure this is '
                           'a polaris suite, test-case or step work directory?')
@@ -217,6 +304,61 @@ def main():
                              'which to run: polaris serial <suite>')
 
 
+def _load_full_test_case(test_case):
+    """
+    Load a test case with all of its steps from ``test_case.pickle`` in its
+    work directory
+    """
+    pickle_filename = os.path.join(test_case.work_dir, 'test_case.pickle')
+    with open(pickle_filename, 'rb') as handle:
+        test_suite = pickle.load(handle)
+    return test_suite['test_cases'][test_case.path]
+
+
+def _load_test_suite(suite_name):
+    """
+    Load a test suite (or test case) from its pickle file, along with the
+    config options for its first test case.  The test cases of a suite are
+    only loaded when they are accessed.
+    """
+    # Allow a suite name to either include or not the .pickle suffix
+    if suite_name.endswith('.pickle'):
+        # code below assumes no suffix, so remove it
+        suite_name = suite_name[:-len('.pickle')]
+    # Now open the the suite's pickle file
+    if not os.path.exists(f'{suite_name}.pickle'):
+        raise ValueError(f'The suite "{suite_name}" does not appear to have '
+                         f'been set up here.')
+    test_suite = load_suite(f'{suite_name}.pickle')
+
+    # get the config file for the first test case in the suite without
+    # loading the test case if possible
+    test_cases = test_suite['test_cases']
+    first = next(iter(test_cases))
+    if isinstance(test_cases, TestCaseIndex):
+        config_filename = test_cases.get_config_filename(first)
+    else:
+        test_case = test_cases[first]
+        config_filename = os.path.join(test_case.work_dir,
+                                       test_case.config_filename)
+    config = PolarisConfigParser()
+    config.add_from_file(config_filename)
+
+    return suite_name, test_suite, config
+
+
+def _load_suite_state(suite_name, test_suite, resume):
+    """
+    Load the state of the steps from the last run if resuming, or start with
+    all steps pending
+    """
+    state = SuiteState(f'{suite_name}_state.json')
+    if not resume:
+        # the graph has all the steps of all test cases
+        state.reset(list(test_suite['graph'].nodes))
+    return state
+
+
 def _update_steps_to_run(steps_to_run, steps_not_to_run, config, steps):
     """
     Update the steps to run
@@ -259,15 +401,8 @@ def _print_to_stdout(test_case, message):
 
 def _log_and_run_test(test_case, logger, test_logger, quiet, log_filename,
                       is_test_case, steps_to_run, steps_not_to_run):
-    # ANSI fail text: https://stackoverflow.com/a/287944/7728169
-    start_fail = '\033[91m'
-    start_pass = '\033[92m'
     start_time_color = '\033[94m'
     end = '\033[0m'
-    pass_str = f'{start_pass}PASS{end}'
-    success_str = f'{start_pass}SUCCESS{end}'
-    fail_str = f'{start_fail}FAIL{end}'
-    error_str = f'{start_fail}ERROR{end}'
 
     test_name = test_case.path.replace('/', '_')
     with LoggingContext(test_name, logger=test_logger,
@@ -304,81 +439,103 @@ def _log_and_run_test(test_case, logger, test_logger, quiet, log_filename,
         test_logger.info(f'Running steps: {test_list}')
         try:
             _run_test(test_case)
-            run_status = success_str
             test_pass = True
         except BaseException:
-            run_status = error_str
             test_pass = False
             test_logger.exception('Exception raised while running '
                                   'the steps of the test case')
 
-        if test_pass:
-            test_logger.info('')
-            log_method_call(method=test_case.validate,
-                            logger=test_logger)
-            test_logger.info('')
-            try:
-                test_case.validate()
-            except BaseException:
-                run_status = error_str
-                test_pass = False
-                test_logger.exception('Exception raised in the test '
-                                      'case\'s validate() method')
-
-        baseline_status = None
-        internal_status = None
-        if test_case.validation is not None:
-            internal_pass = test_case.validation['internal_pass']
-            baseline_pass = test_case.validation['baseline_pass']
-
-            if internal_pass is not None:
-                if internal_pass:
-                    internal_status = pass_str
-                else:
-                    internal_status = fail_str
-                    test_logger.error(
-                        'Internal test case validation failed')
-                    test_pass = False
-
-            if baseline_pass is not None:
-                if baseline_pass:
-                    baseline_status = pass_str
-                else:
-                    baseline_status = fail_str
-                    test_logger.error('Baseline validation failed')
-                    test_pass = False
-
-        status = f'  test execution:      {run_status}'
-        if internal_status is not None:
-            status = f'{status}\n' \
-                     f'  test validation:     {internal_status}'
-        if baseline_status is not None:
-            status = f'{status}\n' \
-                     f'  baseline comparison: {baseline_status}'
-
-        if test_pass:
-            logger.info(status)
-            success_str = pass_str
-            success = True
-        else:
-            logger.error(status)
-            if not is_test_case:
-                logger.error(f'  see: case_outputs/{test_name}.log')
-            success_str = fail_str
-            success = False
+        success_str, success = _validate_test(test_case, logger, test_logger,
+                                              test_pass, is_test_case)
 
         test_time = time.time() - test_start
 
-        secs = round(test_time)
-        mins = secs // 60
-        secs -= 60 * mins
         logger.info(f'  test runtime:        '
-                    f'{start_time_color}{mins:02d}:{secs:02d}{end}')
+                    f'{start_time_color}{_format_time(test_time)}{end}')
 
         return success_str, success, test_time
 
 
-def _run_test(test_case):
+def _validate_test(test_case, logger, test_logger, test_pass, is_test_case):
+    """
+    Validate a test case whose steps have run (if they ran successfully) and
+    log the status of the test execution, validation and baseline comparison
+    """
+    # ANSI fail text: https://stackoverflow.com/a/287944/7728169
+    start_fail = '\033[91m'
+    start_pass = '\033[92m'
+    end = '\033[0m'
+    pass_str = f'{start_pass}PASS{end}'
+    success_str = f'{start_pass}SUCCESS{end}'
+    fail_str = f'{start_fail}FAIL{end}'
+    error_str = f'{start_fail}ERROR{end}'
+
+    test_name = test_case.path.replace('/', '_')
+
+    if test_pass:
+        run_status = success_str
+    else:
+        run_status = error_str
+
+    if test_pass:
+        test_logger.info('')
+        log_method_call(method=test_case.validate,
+                        logger=test_logger)
+        test_logger.info('')
+        try:
+            test_case.validate()
+        except BaseException:
+            run_status = error_str
+            test_pass = False
+            test_logger.exception('Exception raised in the test '
+                                  'case\'s validate() method')
+
+    baseline_status = None
+    internal_status = None
+    if test_case.validation is not None:
+        internal_pass = test_case.validation['internal_pass']
+        baseline_pass = test_case.validation['baseline_pass']
+
+        if internal_pass is not None:
+            if internal_pass:
+                internal_status = pass_str
+            else:
+                internal_status = fail_str
+                test_logger.error(
+                    'Internal test case validation failed')
+                test_pass = False
+
+        if baseline_pass is not None:
+            if baseline_pass:
+                baseline_status = pass_str
+            else:
+                baseline_status = fail_str
+                test_logger.error('Baseline validation failed')
+                test_pass = False
+
+    status = f'  test execution:      {run_status}'
+    if internal_status is not None:
+        status = f'{status}\n' \
+                 f'  test validation:     {internal_status}'
+    if baseline_status is not None:
+        status = f'{status}\n' \
+                 f'  baseline comparison: {baseline_status}'
+
+    if test_pass:
+        logger.info(status)
+        success_str = pass_str
+        success = True
+    else:
+        logger.error(status)
+        if not is_test_case:
+            logger.error(f'  see: case_outputs/{test_name}.log')
+        success_str = fail_str
+        success = False
+
+    return success_str, success
+
+
+def _run_test(test_case, available_cores=None, placement=None):
     """
     Run each step of the test case
     """
@@ -389,32 +546,67 @@ def _run_test(test_case):
         if step.cached:
             logger.info(f'  * Cached step: {step_name}')
             continue
+        state = test_case.suite_state
+        if state is not None and state.has_succeeded(step):
+            _print_to_stdout(test_case,
+                             f'  * Already succeeded step: {step_name}')
+            continue
+        if test_case.incremental and is_up_to_date(step):
+            _print_to_stdout(test_case, f'  * Up-to-date step: {step_name}')
+            if state is not None:
+                state.set(step.path, 'succeeded')
+            continue
+        if step.shared_from is not None:
+            if shared_outputs_exist(step):
+                _print_to_stdout(test_case,
+                                 f'  * Shared step: {step_name} (outputs '
+                                 f'from {step.shared_from})')
+                if state is not None:
+                    state.set(step.path, 'succeeded')
+                continue
+            # the identical step hasn't run (e.g. because this test case is
+            # being run on its own), so this step has to produce its outputs
+            unshare_step(step)
         step.config = test_case.config
         if test_case.log_filename is not None:
             step.log_filename = test_case.log_filename
 
         _print_to_stdout(test_case, f'  * step: {step_name}')
 
+        if state is not None:
+            state.set(step.path, 'running')
+        step_start = time.time()
         try:
             if step.run_as_subprocess:
                 _run_step_as_subprocess(
                     test_case, step, test_case.new_step_log_file)
             else:
-                _run_step(test_case, step, test_case.new_step_log_file)
+                _run_step(test_case, step, test_case.new_step_log_file,
+                          available_cores, placement)
         except BaseException:
+            if state is not None:
+                state.set(step.path, 'failed')
             _print_to_stdout(test_case, '      Failed')
             raise
+        if state is not None:
+            state.set(step.path, 'succeeded')
+        _record_step_time(test_case, step, time.time() - step_start)
         os.chdir(cwd)
 
 
-def _run_step(test_case, step, new_log_file):
+def _run_step(test_case, step, new_log_file, available_cores=None,
+              placement=None):
     """
     Run the requested step
     """
     logger = test_case.logger
     config = test_case.config
     cwd = os.getcwd()
-    available_cores, _, _ = get_available_cores_and_nodes(config)
+    if available_cores is None:
+        available_cores, _, _ = get_available_cores_and_nodes(config)
+
+    # the old fingerprint no longer describes the outputs
+    remove_fingerprint(step)
 
     missing_files = list()
     for input_file in step.inputs:
@@ -427,6 +619,25 @@ def _run_step(test_case, step, new_log_file):
             f'{step.component.name}/{step.test_group.name}/'
             f'{step.test_case.subdir}: {missing_files}')
 
+    memo_key = None
+    if step.memoize or any(os.path.islink(output) for output in
+                           step.outputs):
+        # imported here because most steps aren't memoized
+        from polaris.memoize import (
+            get_memo_key,
+            release_outputs,
+            restore_outputs,
+        )
+        memo_key = get_memo_key(step, config)
+        if memo_key is not None:
+            memo_dir = restore_outputs(step, config, memo_key)
+            if memo_dir is not None:
+                logger.info(f'  Linked outputs of an identical run: '
+                            f'{memo_dir}')
+                write_fingerprint(step, test_case.hash_fingerprint)
+                return
+        release_outputs(step, config)
+
     test_name = step.path.replace('/', '_')
     if new_log_file:
         log_filename = f'{cwd}/{step.name}.log'
@@ -435,48 +646,186 @@ def _run_step(test_case, step, new_log_file):
     else:
         step_logger = logger
         log_filename = None
-    with LoggingContext(name=test_name, logger=step_logger,
-                        log_filename=log_filename) as step_logger:
-        step.logger = step_logger
-        os.chdir(step.work_dir)
+    # imported here because only running a step needs it
+    from polaris.run.timings import ResourceMonitor
+
+    timeout, stall_timeout = get_step_limits(step, config)
+    with ResourceMonitor(step), \
+            StepWatchdog(step, timeout, stall_timeout):
+        with LoggingContext(name=test_name, logger=step_logger,
+                            log_filename=log_filename) as step_logger:
+            step.logger = step_logger
+            os.chdir(step.work_dir)
 
-        step_logger.info('')
-        log_method_call(method=step.constrain_resources, logger=step_logger)
-        step_logger.info('')
-        step.constrain_resources(available_cores)
-
-        # runtime_setup() will perform small tasks that require knowing the
-        # resources of the task before the step runs (such as creating
-        # graph partitions)
-        step_logger.info('')
-        log_method_call(method=step.runtime_setup, logger=step_logger)
-        step_logger.info('')
-        step.runtime_setup()
-
-        if step.args is not None:
-            run_command(step.args, step.cpus_per_task, step.ntasks,
-                        step.openmp_threads, step.config, step.logger)
-        else:
             step_logger.info('')
-            log_method_call(method=step.run, logger=step_logger)
+            log_method_call(method=step.constrain_resources,
+                            logger=step_logger)
             step_logger.info('')
-            step.run()
+            step.constrain_resources(available_cores)
 
-    missing_files = list()
-    for output_file in step.outputs:
-        if not os.path.exists(output_file):
-            missing_files.append(output_file)
+            # runtime_setup() will perform small tasks that require knowing
+            # the resources of the task before the step runs (such as
+            # creating graph partitions)
+            step_logger.info('')
+            log_method_call(method=step.runtime_setup, logger=step_logger)
+            step_logger.info('')
+            step.runtime_setup()
 
-    if len(missing_files) > 0:
-        raise OSError(
-            f'output file(s) missing in step {step.name} of '
-            f'{step.component.name}/{step.test_group.name}/'
-            f'{step.test_case.subdir}: {missing_files}')
+            if step.args is not None:
+                run_command(step.args, step.cpus_per_task, step.ntasks,
+                            step.openmp_threads, step.config, step.logger,
+                            placement)
+            else:
+                step_logger.info('')
+                log_method_call(method=step.run, logger=step_logger)
+                step_logger.info('')
+                step.run()
+
+        missing_files = list()
+        for output_file in step.outputs:
+            if not os.path.exists(output_file):
+                missing_files.append(output_file)
+
+        if len(missing_files) > 0:
+            raise OSError(
+                f'output file(s) missing in step {step.name} of '
+                f'{step.component.name}/{step.test_group.name}/'
+                f'{step.test_case.subdir}: {missing_files}')
+    if memo_key is not None:
+        from polaris.memoize import save_outputs
+        save_outputs(step, config, memo_key)
+    write_fingerprint(step, test_case.hash_fingerprint)
+
+
+def _record_step_time(test_case, step, step_time):
+    """
+    Add the runtime of a step that succeeded to the runtime history and
+    flag it if it was much slower than usual
+    """
+    history = test_case.history
+    if history is None or step.ntasks is None or step.cpus_per_task is None:
+        return
+    from polaris.run.history import is_slow
+    expected = history.estimate('step', step.path, step.ntasks,
+                                step.cpus_per_task)
+    if is_slow(test_case.config, step_time, expected):
+        _print_to_stdout(test_case,
+                         f'      slower than usual: '
+                         f'{_format_time(step_time)} (typically '
+                         f'{_format_time(expected)})')
+    history.add('step', step.path, step.ntasks, step.cpus_per_task,
+                step_time)
+
+
+def _estimate_test_times(test_suite, history, available_cores):
+    """
+    Estimate the runtime of each test case from the runtime history, with
+    ``None`` for test cases that haven't run on this machine before
+    """
+    estimates: Dict[str, Optional[float]] = dict()
+    # test cases are stored with their paths as keys
+    for test_name in test_suite['test_cases']:
+        if history is None:
+            estimates[test_name] = None
+        else:
+            estimates[test_name] = history.estimate(
+                'test_case', test_name, available_cores, 1)
+    return estimates
+
+
+def _order_test_cases(test_suite, estimates):
+    """
+    Order test cases from longest to shortest expected runtime, but always
+    after any other test cases whose steps' outputs they use.  A test case
+    that others depend on counts as long as the whole chain of test cases
+    that starts with it.  Test cases without a runtime estimate go first, so
+    a test case that hasn't been run before won't be the one still running
+    at the end.  Ties keep the order from the suite.
+    """
+    test_names = list(test_suite['test_cases'])
+    graph = test_suite['graph']
+
+    # which test cases each test case depends on
+    test_dependencies: Dict[str, Set[str]] = {
+        test_name: set() for test_name in test_names}
+    for path, dependencies in graph.dependencies.items():
+        test_name = graph.nodes[path]['test_case']
+        for dependency in dependencies:
+            other = graph.nodes[dependency]['test_case']
+            if other != test_name and other in test_dependencies and \
+                    test_name in test_dependencies:
+                test_dependencies[test_name].add(other)
+
+    # the expected runtime of each test case plus the longest chain of test
+    # cases that depend on it
+    levels: Dict[str, float] = dict()
+
+    def get_level(name):
+        if name not in levels:
+            estimate = estimates[name]
+            if estimate is None:
+                estimate = float('inf')
+            dependents = [other for other in test_names
+                          if name in test_dependencies[other]]
+            levels[name] = estimate + max(
+                [get_level(other) for other in dependents], default=0.)
+        return levels[name]
+
+    def sort_key(name):
+        return -get_level(name), test_names.index(name)
+
+    ordered: List[str] = list()
+    remaining = list(test_names)
+    while len(remaining) > 0:
+        ready = [name for name in remaining
+                 if test_dependencies[name].issubset(ordered)]
+        if len(ready) == 0:
+            # a cycle, which setup should have caught
+            ready = remaining
+        next_name = min(ready, key=sort_key)
+        ordered.append(next_name)
+        remaining.remove(next_name)
+    return ordered
+
+
+def _log_time_remaining(logger, test_names, estimates):
+    """
+    Log the estimated time for the remaining test cases to run
+    """
+    known = [estimates[name] for name in test_names
+             if estimates[name] is not None]
+    if len(known) == 0:
+        return
+    message = f'  estimated time remaining: {_format_time(sum(known))}'
+    unknown = len(test_names) - len(known)
+    if unknown > 0:
+        message = f'{message} (plus {unknown} test case(s) without history)'
+    logger.info(message)
+
+
+def _format_time(seconds):
+    """ Format a time in seconds as minutes and seconds """
+    secs = round(seconds)
+    mins = secs // 60
+    secs -= 60 * mins
+    return f'{mins:02d}:{secs:02d}'
+
+
+def _parse_placement(placement_str):
+    """
+    Parse the number of tasks on each node from a string like ``0:64,1:32``
+    """
+    placement = dict()
+    for item in placement_str.split(','):
+        node, tasks = item.split(':')
+        placement[int(node)] = int(tasks)
+    return placement
 
 
 def _run_step_as_subprocess(test_case, step, new_log_file):
     """
-    Run the requested step as a subprocess
+    Run the requested step as a subprocess, forked from the polaris daemon if
+    one is running
     """
     logger = test_case.logger
     cwd = os.getcwd()
@@ -491,6 +840,45 @@ def _run_step_as_subprocess(test_case, step, new_log_file):
     with LoggingContext(name=test_name, logger=step_logger,
                         log_filename=log_filename) as step_logger:
 
+        # imported here because only steps run as subprocesses need it
+        from polaris.run.daemon import launch_step
+
         os.chdir(step.work_dir)
         step_args = ['polaris', 'serial', '--step_is_subprocess']
-        check_call(step_args, step_logger)
+        if test_case.hash_fingerprint:
+            step_args.append('--hash_fingerprint')
+        read_fd, write_fd = os.pipe()
+        process = launch_step(step_args[2:], step.work_dir, write_fd)
+        os.close(write_fd)
+        if process is None:
+            os.close(read_fd)
+            check_call(step_args, step_logger)
+            return
+
+        # log the output of the step just as check_call() would
+        with os.fdopen(read_fd) as output:
+            for line in output:
+                step_logger.info(line.rstrip('\n'))
+        returncode = process.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, step_args)
+
+
+def _run_single_step_in_daemon(args):
+    """
+    Run a step in a process forked from the polaris daemon, if one is
+    running, and exit with the step's exit code
+    """
+    from polaris.run.daemon import launch_step
+
+    process = launch_step(args, os.getcwd(), sys.stdout.fileno(),
+                          sys.stderr.fileno())
+    if process is None:
+        return
+
+    def _forward(signum, frame):
+        process.send_signal(signum)
+
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, _forward)
+    sys.exit(process.wait())
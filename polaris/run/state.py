@@ -0,0 +1,122 @@
+import json
+import os
+import tempfile
+
+
+class SuiteState:
+    """
+    The status of each step in a test suite (or test case), saved to a file
+    in the base work directory each time it changes so that a run that was
+    interrupted or had failures can be resumed
+
+    A step's status is one of ``'pending'`` (not yet run), ``'running'``,
+    ``'succeeded'`` or ``'failed'``.  A step that was ``'running'`` when the
+    file was last written was interrupted (e.g. by a node failure or the job
+    running out of time).
+
+    Attributes
+    ----------
+    filename : str
+        The path of the state file
+
+    steps : dict
+        The status of each step with step paths as keys
+    """
+
+    def __init__(self, filename):
+        """
+        Read the state of the steps from the given file if it exists
+
+        Parameters
+        ----------
+        filename : str
+            The path of the state file
+        """
+        self.filename = os.path.abspath(filename)
+        self.steps = dict()
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                self.steps = json.load(f)['steps']
+
+    def reset(self, paths):
+        """
+        Mark the given steps as not yet run, forgetting any other steps
+
+        Parameters
+        ----------
+        paths : list of str
+            The paths of the steps
+        """
+        self.steps = {path: 'pending' for path in paths}
+        self._write()
+
+    def get(self, path):
+        """
+        Get the status of a step
+
+        Parameters
+        ----------
+        path : str
+            The path of the step
+
+        Returns
+        -------
+        status : str
+            The status of the step, ``'pending'`` if it isn't known
+        """
+        return self.steps.get(path, 'pending')
+
+    def set(self, path, status):
+        """
+        Update the status of a step and save the state
+
+        Parameters
+        ----------
+        path : str
+            The path of the step
+
+        status : {'pending', 'running', 'succeeded', 'failed'}
+            The new status of the step
+        """
+        if status not in ['pending', 'running', 'succeeded', 'failed']:
+            raise ValueError(f'Unexpected step status: {status}')
+        self.steps[path] = status
+        self._write()
+
+    def has_succeeded(self, step):
+        """
+        Whether a step succeeded in an earlier run and its outputs still
+        exist, so its outputs can be reused
+
+        Parameters
+        ----------
+        step : polaris.Step
+            The step
+
+        Returns
+        -------
+        succeeded : bool
+            Whether the step succeeded
+        """
+        if self.get(step.path) != 'succeeded':
+            return False
+        return all(os.path.exists(output) for output in step.outputs)
+
+    def _write(self):
+        """
+        Write the state to a temporary file and then move it into place, so
+        the state file is never partially written
+        """
+        directory = os.path.dirname(self.filename)
+        handle, temp_filename = tempfile.mkstemp(
+            dir=directory, prefix=f'.{os.path.basename(self.filename)}.')
+        try:
+            with os.fdopen(handle, 'w') as f:
+                json.dump(dict(steps=self.steps), f, indent=1)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filename, self.filename)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
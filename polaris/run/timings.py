@@ -0,0 +1,321 @@
+import argparse
+import fcntl
+import json
+import os
+import resource
+import socket
+import sys
+import time
+from datetime import datetime
+
+TIMINGS_FILENAME = 'timings.json'
+
+
+class ResourceMonitor:
+    """
+    A context manager for measuring the resources used by a step while it
+    runs: wall-clock time, user and system CPU time, peak resident memory and
+    bytes read from and written to storage.
+
+    CPU time and I/O include child processes that have finished (e.g. the
+    ``srun`` or ``mpirun`` launched by
+    :py:func:`polaris.parallel.run_command()` and the MPI tasks it starts on
+    this node).  MPI tasks on other nodes are
+    not included.
+
+    If a step is given, the resources it used are added to ``timings.json``
+    in the base work directory (see
+    :py:func:`polaris.run.timings.record_step_timing()`) when the context
+    exits, whether or not the step succeeded.
+
+    Attributes
+    ----------
+    step : polaris.Step or None
+        The step whose resource usage is recorded, if any
+
+    usage : dict
+        The resources used, with keys ``wall_time``, ``user_time`` and
+        ``system_time`` (in seconds), ``max_rss``, ``read_bytes`` and
+        ``write_bytes`` (in bytes).  Available once the context has exited.
+    """
+
+    def __init__(self, step=None):
+        """
+        Create a monitor
+
+        Parameters
+        ----------
+        step : polaris.Step, optional
+            A step whose resource usage should be recorded
+        """
+        self.step = step
+        self.usage = dict()
+        self._start = dict()
+
+    def __enter__(self):
+        _reset_peak_rss()
+        self._start = _get_counters()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = _get_counters()
+        start = self._start
+        usage = dict()
+        for key in ['wall_time', 'user_time', 'system_time', 'read_bytes',
+                    'write_bytes']:
+            usage[key] = max(end[key] - start[key], 0)
+        max_rss = end['self_max_rss']
+        if end['children_max_rss'] > start['children_max_rss']:
+            # a child process used more memory than any child before it
+            max_rss = max(max_rss, end['children_max_rss'])
+        usage['max_rss'] = max_rss
+        self.usage = usage
+        if self.step is not None:
+            record_step_timing(self.step, usage, success=exc_type is None)
+
+
+def record_step_timing(step, usage, success):
+    """
+    Add the resources used by a step to ``timings.json`` in the base work
+    directory, replacing any earlier record for the same step.  The file is
+    locked while it is updated because steps may finish at the same time
+    when they run in task parallel.
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step
+
+    usage : dict
+        The resources used by the step from
+        :py:attr:`polaris.run.timings.ResourceMonitor.usage`
+
+    success : bool
+        Whether the step ran successfully
+    """
+    filename = os.path.join(step.base_work_dir, TIMINGS_FILENAME)
+    record = dict(usage)
+    record['success'] = success
+    record['ntasks'] = step.ntasks
+    record['cpus_per_task'] = step.cpus_per_task
+    record['host'] = socket.gethostname()
+    record['finished'] = datetime.now().isoformat(timespec='seconds')
+    with open(filename, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            timings = _parse_timings(f.read())
+            timings[step.path] = record
+            f.seek(0)
+            f.truncate()
+            json.dump(timings, f, indent=1)
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_timings(work_dir):
+    """
+    Read the resources used by each step from ``timings.json``
+
+    Parameters
+    ----------
+    work_dir : str
+        The base work directory
+
+    Returns
+    -------
+    timings : dict
+        The resources used by each step, with the relative paths of the steps
+        as keys
+    """
+    filename = os.path.join(work_dir, TIMINGS_FILENAME)
+    if not os.path.exists(filename):
+        raise OSError(f'No {TIMINGS_FILENAME} found in {work_dir}.  Has a '
+                      f'test suite or test case been run there?')
+    with open(filename) as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        try:
+            return _parse_timings(f.read())
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def report_timings(work_dir, count=20, sort_by='core_time'):
+    """
+    Print the steps that used the most resources
+
+    Parameters
+    ----------
+    work_dir : str
+        The base work directory
+
+    count : int, optional
+        The number of steps to list
+
+    sort_by : {'core_time', 'wall_time', 'cpu_time', 'max_rss', 'io'}, optional
+        How to rank the steps.  ``core_time`` is the wall-clock time
+        multiplied by the number of cores the step had, i.e. what it cost
+        in an allocation
+    """
+    timings = read_timings(work_dir)
+    if len(timings) == 0:
+        print('No steps have been run yet.')
+        return
+
+    for record in timings.values():
+        cores = record['ntasks'] * record['cpus_per_task']
+        record['core_time'] = record['wall_time'] * cores
+        record['cpu_time'] = record['user_time'] + record['system_time']
+        record['io'] = record['read_bytes'] + record['write_bytes']
+
+    paths = sorted(timings, key=lambda path: timings[path][sort_by],
+                   reverse=True)
+
+    total_core_time = sum(record['core_time'] for record in timings.values())
+    total_wall_time = sum(record['wall_time'] for record in timings.values())
+
+    width = max(len(path) for path in paths[:count])
+    width = max(width, len('step'))
+    print(f'{"step":<{width}}  {"wall":>9}  {"cores":>5}  {"core-hrs":>8}  '
+          f'{"cpu":>9}  {"peak RSS":>8}  {"read":>8}  {"written":>8}')
+    for path in paths[:count]:
+        record = timings[path]
+        cores = record['ntasks'] * record['cpus_per_task']
+        failed = '' if record['success'] else '  (failed)'
+        print(f'{path:<{width}}  '
+              f'{_format_time(record["wall_time"]):>9}  '
+              f'{cores:>5}  '
+              f'{record["core_time"] / 3600.:>8.3f}  '
+              f'{_format_time(record["cpu_time"]):>9}  '
+              f'{_format_bytes(record["max_rss"]):>8}  '
+              f'{_format_bytes(record["read_bytes"]):>8}  '
+              f'{_format_bytes(record["write_bytes"]):>8}{failed}')
+    print()
+    print(f'{len(timings)} steps, total wall time '
+          f'{_format_time(total_wall_time)}, total '
+          f'{total_core_time / 3600.:.3f} core-hours')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='List the steps of a test suite or test case that used '
+                    'the most resources the last time they ran',
+        prog='polaris timings')
+    parser.add_argument("-w", "--work_dir", dest="work_dir", default='.',
+                        help="The base work directory of the test suite or "
+                             "test case.  The default is the current "
+                             "directory.",
+                        metavar="PATH")
+    parser.add_argument("-n", "--number", dest="count", type=int, default=20,
+                        help="The number of steps to list (default 20)",
+                        metavar="NUM")
+    parser.add_argument("-s", "--sort", dest="sort_by", default='core_time',
+                        choices=['core_time', 'wall_time', 'cpu_time',
+                                 'max_rss', 'io'],
+                        help="How to rank the steps.  The default, "
+                             "core_time, is the wall time multiplied by the "
+                             "number of cores")
+    args = parser.parse_args(sys.argv[2:])
+    report_timings(args.work_dir, count=args.count, sort_by=args.sort_by)
+
+
+def _get_counters():
+    """
+    Get the current wall-clock time, CPU time, peak memory and I/O of this
+    process and its finished children
+    """
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    counters = dict(
+        wall_time=time.monotonic(),
+        user_time=usage_self.ru_utime + usage_children.ru_utime,
+        system_time=usage_self.ru_stime + usage_children.ru_stime,
+        # ru_maxrss is in kilobytes on Linux
+        self_max_rss=1024 * usage_self.ru_maxrss,
+        children_max_rss=1024 * usage_children.ru_maxrss)
+
+    peak_rss = _read_peak_rss()
+    if peak_rss is not None:
+        counters['self_max_rss'] = peak_rss
+
+    io = _read_proc_io()
+    if io is not None:
+        # the kernel adds the I/O of children to their parent when they are
+        # reaped
+        counters['read_bytes'] = io['read_bytes']
+        counters['write_bytes'] = io['write_bytes']
+    else:
+        counters['read_bytes'] = 512 * (usage_self.ru_inblock +
+                                        usage_children.ru_inblock)
+        counters['write_bytes'] = 512 * (usage_self.ru_oublock +
+                                         usage_children.ru_oublock)
+    return counters
+
+
+def _reset_peak_rss():
+    """
+    Reset the peak resident memory of this process (Linux only) so it only
+    reflects the step that is about to run, not earlier steps in the same
+    process
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _read_peak_rss():
+    """ Read the peak resident memory in bytes from /proc if possible """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return 1024 * int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _read_proc_io():
+    """ Read the I/O counters of this process from /proc if possible """
+    try:
+        io = dict()
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                io[key] = int(value)
+        return io
+    except (OSError, ValueError):
+        return None
+
+
+def _parse_timings(text):
+    """ Parse the contents of a timings file, which may be empty """
+    if text.strip() == '':
+        return dict()
+    try:
+        return json.loads(text)
+    except ValueError:
+        # a step was killed while writing the file, so start over
+        return dict()
+
+
+def _format_time(seconds):
+    """ Format a time in seconds as hours, minutes and seconds """
+    secs = round(seconds)
+    hours = secs // 3600
+    mins = (secs - 3600 * hours) // 60
+    secs -= 3600 * hours + 60 * mins
+    return f'{hours:d}:{mins:02d}:{secs:02d}'
+
+
+def _format_bytes(nbytes):
+    """ Format a number of bytes with a binary prefix """
+    value = float(nbytes)
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if value < 1024.:
+            return f'{value:.1f} {unit}'
+        value /= 1024.
+    return f'{value:.1f} TiB'
@@ -0,0 +1,222 @@
+import os
+import signal
+import sys
+import threading
+import time
+
+
+class StepTimeoutError(TimeoutError):
+    """
+    The exception raised when a step runs for longer than its time limit or
+    stops making progress
+    """
+    pass
+
+
+class StepWatchdog:
+    """
+    A context manager that stops a step running in the main thread if it
+    runs for longer than its time limit or if none of its output grows for
+    too long, which usually means it is hung.
+
+    A background thread checks on the step every few seconds.  If it needs
+    to be stopped, the thread sends ``SIGALRM`` to this process, and the
+    signal handler raises a :py:class:`polaris.run.watchdog.StepTimeoutError`
+    in the main thread.  If the step is waiting on a parallel executable
+    started by :py:func:`polaris.parallel.run_command()`, the exception makes
+    ``run_command()`` kill the executable and all of its child processes.
+
+    A step is making progress as long as the size or modification time of
+    something in its work directory (e.g. ``log.ocean.0000.out``), its log
+    file or this process's standard output changes.
+
+    Attributes
+    ----------
+    step : polaris.Step
+        The step
+
+    timeout : float or None
+        The maximum time in seconds the step may run
+
+    stall_timeout : float or None
+        The maximum time in seconds the step may go without making progress
+    """
+
+    # how often (in seconds) to check on the step
+    interval = 5.
+
+    def __init__(self, step, timeout=None, stall_timeout=None):
+        """
+        Create a watchdog for a step
+
+        Parameters
+        ----------
+        step : polaris.Step
+            The step
+
+        timeout : float, optional
+            The maximum time in seconds the step may run
+
+        stall_timeout : float, optional
+            The maximum time in seconds the step may go without making
+            progress
+        """
+        self.step = step
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self._reason = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._previous_handler = None
+
+    def __enter__(self):
+        if self.timeout is None and self.stall_timeout is None:
+            return self
+        self._previous_handler = signal.signal(signal.SIGALRM,
+                                               self._handle_alarm)
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        signal.signal(signal.SIGALRM, self._previous_handler)
+
+    def _watch(self):
+        """ Check on the step until it finishes or needs to be stopped """
+        start = time.monotonic()
+        last_progress = start
+        activity = self._get_activity()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            new_activity = self._get_activity()
+            if new_activity != activity:
+                activity = new_activity
+                last_progress = now
+            if self.timeout is not None and now - start > self.timeout:
+                self._reason = (f'step {self.step.path} exceeded its time '
+                                f'limit of {_format_seconds(self.timeout)}')
+            elif self.stall_timeout is not None and \
+                    now - last_progress > self.stall_timeout:
+                self._reason = (
+                    f'step {self.step.path} appears to be hung: no output '
+                    f'for {_format_seconds(self.stall_timeout)}')
+            if self._reason is not None:
+                os.kill(os.getpid(), signal.SIGALRM)
+                return
+
+    def _handle_alarm(self, signum, frame):
+        """ Raise an exception in the main thread to stop the step """
+        if self._reason is None:
+            # not from the watchdog
+            return
+        raise StepTimeoutError(self._reason)
+
+    def _get_activity(self):
+        """
+        The sizes and modification times of the step's output, which change
+        as long as it is making progress
+        """
+        activity = list()
+        filenames = list()
+        if self.step.log_filename:
+            filenames.append(self.step.log_filename)
+        try:
+            with os.scandir(self.step.work_dir) as entries:
+                for entry in entries:
+                    filenames.append(entry.path)
+        except OSError:
+            pass
+        for filename in sorted(filenames):
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            activity.append((filename, stat.st_size, stat.st_mtime_ns))
+        try:
+            stat = os.fstat(sys.stdout.fileno())
+            activity.append(('stdout', stat.st_size, stat.st_mtime_ns))
+        except (OSError, ValueError, AttributeError):
+            pass
+        return activity
+
+
+def get_step_limits(step, config):
+    """
+    Get the time limit and the time without progress after which a step is
+    stopped from the ``step_timeout``, ``timeout_factor``,
+    ``min_step_timeout`` and ``stall_timeout`` config options in the ``run``
+    section
+
+    Parameters
+    ----------
+    step : polaris.Step
+        The step
+
+    config : polaris.config.PolarisConfigParser
+        Config options for the test case
+
+    Returns
+    -------
+    timeout : float or None
+        The maximum time in seconds the step may run, or ``None`` for no
+        limit
+
+    stall_timeout : float or None
+        The maximum time in seconds the step may go without making progress,
+        or ``None`` for no limit
+    """
+    timeout = _get_seconds(config, 'step_timeout')
+    if timeout is None:
+        timeout = _get_timeout_from_history(step, config)
+    stall_timeout = _get_seconds(config, 'stall_timeout')
+    return timeout, stall_timeout
+
+
+def _get_timeout_from_history(step, config):
+    """
+    A time limit based on the typical runtime of a step, if it has run
+    before
+    """
+    factor = _get_seconds(config, 'timeout_factor')
+    if factor is None or step.ntasks is None or step.cpus_per_task is None:
+        return None
+    # imported here because only steps without a fixed time limit need it
+    from polaris.run.history import get_runtime_history
+
+    history = get_runtime_history(config)
+    if history is None:
+        return None
+    try:
+        expected = history.estimate('step', step.path, step.ntasks,
+                                    step.cpus_per_task)
+    finally:
+        history.close()
+    if expected is None:
+        return None
+    min_timeout = _get_seconds(config, 'min_step_timeout')
+    if min_timeout is None:
+        min_timeout = 0.
+    return max(factor * expected, min_timeout)
+
+
+def _get_seconds(config, option):
+    """ A float config option in the run section that may be empty """
+    if not config.has_option('run', option):
+        return None
+    value = config.get('run', option).strip()
+    if value in ['', 'None', 'none']:
+        return None
+    return float(value)
+
+
+def _format_seconds(seconds):
+    """ Format a number of seconds for a message """
+    seconds = round(seconds)
+    hours = seconds // 3600
+    mins = (seconds - 3600 * hours) // 60
+    secs = seconds - 3600 * hours - 60 * mins
+    return f'{hours:d}:{mins:02d}:{secs:02d}'
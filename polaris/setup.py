@@ -1,23 +1,34 @@
 import argparse
+import contextlib
+import io
 import os
-import pickle
 import sys
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List
 
 from mache import discover_machine
 
 from polaris import provenance
-from polaris.components import get_components
 from polaris.config import PolarisConfigParser
-from polaris.io import symlink
+from polaris.dag import StepGraph
+from polaris.database import DatabaseStore, get_group, get_max_size
+from polaris.dedup import deduplicate_steps
+from polaris.io import DownloadManager, symlink
 from polaris.job import write_job_script
+from polaris.manifest import (
+    write_step_manifest,
+    write_suite_index,
+    write_test_case,
+)
+from polaris.registry import get_test_case_descriptors
 from polaris.testcase import TestCase
 
 
 def setup_cases(work_dir, tests=None, numbers=None, config_file=None,
                 machine=None, baseline_dir=None, component_path=None,
-                suite_name='custom', cached=None, copy_executable=False):
+                suite_name='custom', cached=None, copy_executable=False,
+                jobs=1):
     """
     Set up one or more test cases
 
@@ -62,6 +73,10 @@ def setup_cases(work_dir, tests=None, numbers=None, config_file=None,
     copy_executable : bool, optional
         Whether to copy the model executable to the work directory
 
+    jobs : int, optional
+        The number of test cases to set up at the same time in separate
+        processes
+
     Returns
     -------
     test_cases : dict of polaris.TestCase
@@ -77,13 +92,8 @@ def setup_cases(work_dir, tests=None, numbers=None, config_file=None,
         work_dir = os.getcwd()
     work_dir = os.path.abspath(work_dir)
 
-    components = get_components()
-
-    all_test_cases = dict()
-    for component in components:
-        for test_group in component.test_groups.values():
-            for test_case in test_group.test_cases.values():
-                all_test_cases[test_case.path] = test_case
+    # only the test cases that are set up get constructed
+    all_test_cases = get_test_case_descriptors()
 
     test_cases: Dict[str, TestCase] = dict()
     cached_steps: Dict[str, List[str]] = dict()
@@ -100,24 +110,37 @@ def setup_cases(work_dir, tests=None, numbers=None, config_file=None,
     basic_config = _get_basic_config(config_file, machine, component_path,
                                      component)
 
-    provenance.write(work_dir, test_cases, config=basic_config)
-
     print('Setting up test cases:')
-    for path, test_case in test_cases.items():
-        setup_case(path, test_case, config_file, machine, work_dir,
-                   baseline_dir, component_path,
-                   cached_steps=cached_steps[path],
-                   copy_executable=copy_executable)
+    # collect the files to download for all test cases and download them
+    # together once they have all been set up
+    with DownloadManager(_get_parallel_downloads(basic_config)) as downloads:
+        if jobs > 1 and len(test_cases) > 1:
+            test_cases = _setup_cases_in_parallel(
+                test_cases, jobs, config_file, machine, work_dir,
+                baseline_dir, component_path, cached_steps, copy_executable,
+                downloads)
+        else:
+            for path, test_case in test_cases.items():
+                setup_case(path, test_case, config_file, machine, work_dir,
+                           baseline_dir, component_path,
+                           cached_steps=cached_steps[path],
+                           copy_executable=copy_executable)
+
+    _update_database(basic_config, work_dir)
+
+    if basic_config.has_option('setup', 'share_identical_steps') and \
+            basic_config.getboolean('setup', 'share_identical_steps'):
+        _share_identical_steps(test_cases)
+
+    provenance.write(work_dir, test_cases, config=basic_config)
 
-    test_suite = {'name': suite_name,
-                  'test_cases': test_cases,
-                  'work_dir': work_dir}
+    # resolve the dependencies between steps across all test cases
+    graph = StepGraph.from_test_cases(test_cases)
+    _print_missing_inputs(graph)
 
-    # pickle the test or step dictionary for use at runtime
-    pickle_file = os.path.join(test_suite['work_dir'],
-                               f'{suite_name}.pickle')
-    with open(pickle_file, 'wb') as handle:
-        pickle.dump(test_suite, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    # pickle an index of the test cases for use at runtime
+    pickle_file = os.path.join(work_dir, f'{suite_name}.pickle')
+    write_suite_index(pickle_file, suite_name, test_cases, work_dir, graph)
 
     if 'LOAD_POLARIS_ENV' in os.environ:
         script_filename = os.environ['LOAD_POLARIS_ENV']
@@ -129,6 +152,8 @@ def setup_cases(work_dir, tests=None, numbers=None, config_file=None,
     print(f'target cores: {max_cores}')
     print(f'minimum cores: {max_of_min_cores}')
 
+    _print_critical_path(graph, test_cases, max_cores)
+
     if machine is not None:
         write_job_script(basic_config, machine, max_cores, max_of_min_cores,
                          work_dir, suite=suite_name)
@@ -259,23 +284,13 @@ def setup_case(path, test_case, config_file, machine, work_dir, baseline_dir,
         # process input, output, namelist and streams files
         step.process_inputs_and_outputs()
 
-    # wait until we've set up all the steps before pickling because steps may
-    # need other steps to be set up
+    # wait until we've set up all the steps before writing manifests because
+    # steps may need other steps to be set up
     for step in test_case.steps.values():
+        write_step_manifest(test_case, step)
 
-        # pickle the test case and step for use at runtime
-        pickle_filename = os.path.join(step.work_dir, 'step.pickle')
-        with open(pickle_filename, 'wb') as handle:
-            pickle.dump((test_case, step), handle,
-                        protocol=pickle.HIGHEST_PROTOCOL)
-
-    # pickle the test case and step for use at runtime
-    pickle_filename = os.path.join(test_case.work_dir, 'test_case.pickle')
-    with open(pickle_filename, 'wb') as handle:
-        test_suite = {'name': 'test_case',
-                      'test_cases': {test_case.path: test_case},
-                      'work_dir': test_case.work_dir}
-        pickle.dump(test_suite, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    # pickle the test case for use at runtime
+    write_test_case(test_case)
 
     if 'LOAD_POLARIS_ENV' in os.environ:
         script_filename = os.environ['LOAD_POLARIS_ENV']
@@ -331,6 +346,10 @@ def main():
                         action="store_true",
                         help="If the model executable should be copied to the "
                              "work directory")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="The number of test cases to set up at the same "
+                             "time (default 1)",
+                        metavar="N")
 
     args = parser.parse_args(sys.argv[2:])
     cached = None
@@ -344,7 +363,101 @@ def main():
                 config_file=args.config_file, machine=args.machine,
                 work_dir=args.work_dir, baseline_dir=args.baseline_dir,
                 component_path=args.component_path, suite_name=args.suite_name,
-                cached=cached, copy_executable=args.copy_executable)
+                cached=cached, copy_executable=args.copy_executable,
+                jobs=args.jobs)
+
+
+def _setup_cases_in_parallel(test_cases, jobs, config_file, machine, work_dir,
+                             baseline_dir, component_path, cached_steps,
+                             copy_executable, downloads):
+    """
+    Set up test cases in a pool of processes.  Each test case is sent to a
+    worker, set up there (including pickling its steps) and sent back along
+    with the files it needs downloaded, which are added to ``downloads``.
+    The results are collected, and their output printed, in the original
+    order of the test cases so the suite is the same as if the test cases had
+    been set up one at a time.
+    """
+    set_up: Dict[str, TestCase] = dict()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = dict()
+        for path, test_case in test_cases.items():
+            futures[path] = executor.submit(
+                _setup_case_in_worker, path, test_case, config_file, machine,
+                work_dir, baseline_dir, component_path, cached_steps[path],
+                copy_executable)
+        for path, future in futures.items():
+            test_case, output, worker_downloads = future.result()
+            print(output, end='')
+            downloads.update(worker_downloads)
+            set_up[path] = test_case
+    return set_up
+
+
+def _setup_case_in_worker(path, test_case, config_file, machine, work_dir,
+                          baseline_dir, component_path, cached_steps,
+                          copy_executable):
+    """
+    Set up a test case in a worker process, returning the test case, what
+    would have been printed and the files it needs downloaded
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), \
+            DownloadManager(defer=True) as downloads:
+        setup_case(path, test_case, config_file, machine, work_dir,
+                   baseline_dir, component_path, cached_steps=cached_steps,
+                   copy_executable=copy_executable)
+    return test_case, output.getvalue(), downloads
+
+
+def _share_identical_steps(test_cases):
+    """
+    Share the outputs of steps that are identical across test cases and
+    update the files written during setup for the steps that changed
+    """
+    shared = deduplicate_steps(test_cases)
+    if len(shared) == 0:
+        return
+    print('Steps sharing the outputs of identical steps:')
+    changed = dict()
+    for step in shared:
+        print(f'  {step.path}\n    ==> {step.shared_from}')
+        write_step_manifest(step.test_case, step)
+        changed[step.test_case.path] = step.test_case
+    for test_case in changed.values():
+        write_test_case(test_case)
+
+
+def _update_database(config, work_dir):
+    """
+    Register the work directory with the local databases, so the files it
+    links to aren't pruned, and prune the databases if they have grown
+    larger than the ``max_size`` config option in the ``database`` section
+    """
+    database_root = config.get('paths', 'database_root')
+    if not os.path.isdir(database_root):
+        # nothing has been downloaded
+        return
+    store = DatabaseStore(database_root, group=get_group(config))
+    store.register_work_dir(work_dir)
+    max_size = get_max_size(config)
+    if max_size is None:
+        store.write()
+        return
+    removed, _ = store.prune(max_size)
+    if len(removed) > 0:
+        print(f'Removed {len(removed)} least recently used files from the '
+              f'databases in {database_root}')
+
+
+def _get_parallel_downloads(config):
+    """
+    The number of files to download at the same time from the
+    ``parallel_downloads`` config option in the ``download`` section
+    """
+    if not config.has_option('download', 'parallel_downloads'):
+        return 8
+    return max(1, config.getint('download', 'parallel_downloads'))
 
 
 def _get_required_cores(test_cases):
@@ -371,6 +484,37 @@ def _get_required_cores(test_cases):
     return max_cores, max_of_min_cores
 
 
+def _print_missing_inputs(graph):
+    """
+    Warn about inputs in the work directory that no step will produce
+    """
+    for path, missing in graph.missing.items():
+        missing_str = '\n    '.join(missing)
+        print(f'Warning: no step produces input(s) of {path}:\n'
+              f'    {missing_str}')
+
+
+def _print_critical_path(graph, test_cases, cores):
+    """
+    Print the longest chain of dependent steps to run and a lower bound on
+    the time to run them in task parallel
+    """
+    paths = list()
+    for test_case in test_cases.values():
+        for step_name in test_case.steps_to_run:
+            step = test_case.steps[step_name]
+            if not step.cached:
+                paths.append(step.path)
+    graph = graph.subgraph(paths)
+    length, critical_path = graph.critical_path()
+    makespan = graph.makespan_lower_bound(max(cores, 1))
+    print(f'critical path: {len(critical_path)} steps')
+    for path in critical_path:
+        print(f'  {path}')
+    print(f'lower bound on task-parallel runtime with {cores} cores: '
+          f'{makespan:g} step runtimes')
+
+
 def __get_machine_and_check_params(machine, config_file, tests, numbers,
                                    cached):
     if machine is None and 'POLARIS_MACHINE' in os.environ:
@@ -462,7 +606,7 @@ def _add_test_cases_by_number(numbers, all_test_cases, test_cases,
                 cached_steps[path] = ['_all']
             else:
                 cached_steps[path] = list()
-            test_cases[path] = all_test_cases[path]
+            test_cases[path] = all_test_cases[path].get_test_case()
 
 
 def _add_test_cases_by_name(tests, all_test_cases, cached, test_cases,
@@ -476,4 +620,4 @@ def _add_test_cases_by_name(tests, all_test_cases, cached, test_cases,
                 cached_steps[path] = cached[index]
             else:
                 cached_steps[path] = list()
-            test_cases[path] = all_test_cases[path]
+            test_cases[path] = all_test_cases[path].get_test_case()
@@ -1,14 +1,10 @@
-import grp
 import logging
 import os
-import shutil
-import stat
 
-import progressbar
 from mache import MachineInfo
 
 from polaris.config import PolarisConfigParser
-from polaris.io import download, imp_res, symlink
+from polaris.io import download, imp_res, stage_file, symlink
 
 
 class Step:
@@ -71,8 +67,9 @@ class Step:
 
     max_memory : int
         the amount of memory that the step is allowed to use in MB.
-        This is currently just a placeholder for later use with task
-        parallelism
+        When steps are run in task parallel, a step is only started
+        once this much memory, divided evenly between its tasks, is free on
+        the nodes its tasks run on
 
     input_data : list of dict
         a list of dict used to define input files typically to be
@@ -117,6 +114,11 @@ class Step:
         Whether to get all of the outputs for the step from the database of
         cached outputs for this component
 
+    shared_from : str or None
+        The path of an identical step in another test case whose outputs
+        this step links to instead of running, set during setup (see
+        :py:func:`polaris.dedup.deduplicate_steps()`)
+
     run_as_subprocess : bool
         Whether to run this step as a subprocess, rather than just running
         it directly from the test case.  It is useful to run a step as a
@@ -126,12 +128,20 @@ class Step:
 
     args : {list of str, None}
         A list of command-line arguments to call in parallel
+
+    memoize : bool
+        Whether the outputs of the step may be saved under the database root
+        after it runs and linked to by identical steps in other work
+        directories instead of running them (see :py:mod:`polaris.memoize`).
+        Only steps whose outputs depend on nothing but their inputs, config
+        options, attributes and the polaris code (e.g. steps that create
+        meshes or initial conditions) should set this to ``True``.
     """
 
     def __init__(self, test_case, name, subdir=None, cpus_per_task=1,
                  min_cpus_per_task=1, ntasks=1, min_tasks=1,
                  openmp_threads=1, max_memory=None, cached=False,
-                 run_as_subprocess=False):
+                 run_as_subprocess=False, memoize=False):
         """
         Create a new test case
 
@@ -172,8 +182,9 @@ class Step:
 
         max_memory : int, optional
             the amount of memory that the step is allowed to use in MB.
-            This is currently just a placeholder for later use with task
-            parallelism
+            When steps are run in task parallel, a step is only started
+            once this much memory, divided evenly between its tasks, is free
+            on the nodes its tasks run on
 
         cached : bool, optional
             Whether to get all of the outputs for the step from the database of
@@ -185,6 +196,12 @@ class Step:
             subprocess if there is not a good way to redirect output to a log
             file (e.g. if the step calls external code that, in turn, calls
             additional subprocesses).
+
+        memoize : bool, optional
+            Whether the outputs of the step may be saved under the database
+            root after it runs and linked to by identical steps in other
+            work directories instead of running them.  This is off by
+            default.
         """
         self.name = name
         self.test_case = test_case
@@ -227,6 +244,11 @@ class Step:
         # output caching
         self.cached = cached
 
+        # set during setup if another test case has an identical step
+        self.shared_from = None
+
+        self.memoize = memoize
+
     def set_resources(self, cpus_per_task=None, min_cpus_per_task=None,
                       ntasks=None, min_tasks=None, openmp_threads=None,
                       max_memory=None):
@@ -264,8 +286,9 @@ class Step:
 
         max_memory : int, optional
             the amount of memory that the step is allowed to use in MB.
-            This is currently just a placeholder for later use with task
-            parallelism
+            When steps are run in task parallel, a step is only started
+            once this much memory, divided evenly between its tasks, is free
+            on the nodes its tasks run on
         """
         if cpus_per_task is not None:
             self.cpus_per_task = cpus_per_task
@@ -337,9 +360,23 @@ class Step:
         """
         pass
 
+    def get_fingerprint_files(self):
+        """
+        Get files in the work directory, other than inputs, that determine
+        the results of the step and should be part of its fingerprint (see
+        :py:func:`polaris.fingerprint.compute_fingerprint()`).  A child class
+        can override this method if it generates such files during setup.
+
+        Returns
+        -------
+        filenames : list of str
+            The absolute paths of the files
+        """
+        return list()
+
     def add_input_file(self, filename=None, target=None, database=None,
                        database_component=None, url=None, work_dir_target=None,
-                       package=None, copy=False):
+                       package=None, copy=False, sha256=None):
         """
         Add an input file to the step (but not necessarily to the MPAS model).
         The file can be local, a symlink to a file that will be created in
@@ -389,6 +426,10 @@ class Step:
 
         copy : bool, optional
             Whether to make a copy of the file, rather than a symlink
+
+        sha256 : str, optional
+            The SHA-256 checksum the file should have if it is downloaded (or
+            is already in a database)
         """
         if filename is None:
             if target is None:
@@ -400,7 +441,8 @@ class Step:
                                     database=database,
                                     database_component=database_component,
                                     url=url, work_dir_target=work_dir_target,
-                                    package=package, copy=copy))
+                                    package=package, copy=copy,
+                                    sha256=sha256))
 
     def add_output_file(self, filename):
         """
@@ -436,27 +478,23 @@ class Step:
             self.input_data = list()
             for output in self.outputs:
                 filename = os.path.join(self.path, output)
-                if filename not in self.component.cached_files:
-                    raise ValueError(f'The file {filename} has not been added '
-                                     f'to the cache database')
-                target = self.component.cached_files[filename]
+                cached_file = self.component.get_cached_file(filename)
+                # with a checksum, a cached file that is already in the
+                # database is verified rather than downloaded again
                 self.add_input_file(
                     filename=output,
-                    target=target,
-                    database='polaris_cache')
+                    target=cached_file['filename'],
+                    database='polaris_cache',
+                    sha256=cached_file['sha256'])
 
+        # permissions on files downloaded to databases are fixed as they are
+        # downloaded (see polaris.database.fix_new_file_permissions())
         inputs = []
-        databases_with_downloads = set()
         for entry in self.input_data:
-            input_file, database_subdir = Step._process_input(
+            input_file = Step._process_input(
                 entry, config, base_work_dir, component, step_dir)
-            if database_subdir is not None:
-                databases_with_downloads.add(database_subdir)
             inputs.append(input_file)
 
-        if len(databases_with_downloads) > 0:
-            self._fix_permissions(databases_with_downloads)
-
         # convert inputs and outputs to absolute paths
         self.inputs = [os.path.abspath(os.path.join(step_dir, filename)) for
                        filename in inputs]
@@ -466,7 +504,6 @@ class Step:
 
     @staticmethod
     def _process_input(entry, config, base_work_dir, component, step_dir):
-        database_subdir = None
         filename = entry['filename']
         target = entry['target']
         database = entry['database']
@@ -475,6 +512,7 @@ class Step:
         work_dir_target = entry['work_dir_target']
         package = entry['package']
         copy = entry['copy']
+        sha256 = entry['sha256']
 
         if package is not None:
             if target is None:
@@ -491,6 +529,7 @@ class Step:
             download_target = filename
 
         download_path = None
+        database_root = None
 
         if database is not None:
             # we're downloading a file to a cache of a database (if it's
@@ -505,13 +544,15 @@ class Step:
             database_root = config.get('paths', 'database_root')
             download_path = os.path.join(database_root, database_component,
                                          database, download_target)
-            if not os.path.exists(download_path):
-                database_subdir = os.path.join(database_root, database)
         elif url is not None:
             download_path = download_target
 
         if url is not None:
-            download_target = download(url, download_path, config)
+            # a file that gets copied is needed now, rather than once the
+            # active download manager (if any) downloads everything
+            download_target = download(url, download_path, config,
+                                       immediate=copy, sha256=sha256,
+                                       database_root=database_root)
             if target is not None:
                 # this is the absolute path that we presumably want
                 target = download_target
@@ -519,131 +560,12 @@ class Step:
         if target is not None:
             filepath = os.path.join(step_dir, filename)
             if copy:
-                shutil.copy(target, filepath)
+                # the step may modify its copy, so it can't be a hard link
+                stage_file(target, filepath)
             else:
                 symlink(target, filepath)
             input_file = target
         else:
             input_file = filename
 
-        return input_file, database_subdir
-
-    def _fix_permissions(self, databases):  # noqa: C901
-        """
-        Fix permissions on the databases where files were downloaded so
-        everyone in the group can read/write to them
-        """
-        config = self.config
-
-        if not config.has_option('e3sm_unified', 'group'):
-            return
-
-        group = config.get('e3sm_unified', 'group')
-
-        new_uid = os.getuid()
-        new_gid = grp.getgrnam(group).gr_gid
-
-        write_perm = (stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP |
-                      stat.S_IWGRP | stat.S_IROTH)
-        exec_perm = (stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR |
-                     stat.S_IRGRP | stat.S_IWGRP | stat.S_IXGRP |
-                     stat.S_IROTH | stat.S_IXOTH)
-
-        mask = stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO
-
-        print('changing permissions on downloaded files')
-
-        # first the base directories that don't seem to be included in
-        # os.walk()
-        for directory in databases:
-            try:
-                dir_stat = os.stat(directory)
-            except OSError:
-                continue
-
-            perm = dir_stat.st_mode & mask
-
-            if dir_stat.st_uid != new_uid:
-                # current user doesn't own this dir so let's move on
-                continue
-
-            if perm == exec_perm and dir_stat.st_gid == new_gid:
-                continue
-
-            try:
-                os.chown(directory, new_uid, new_gid)
-                os.chmod(directory, exec_perm)
-            except OSError:
-                continue
-
-        files_and_dirs = []
-        for base in databases:
-            for root, dirs, files in os.walk(base):
-                files_and_dirs.extend(dirs)
-                files_and_dirs.extend(files)
-
-        widgets = [progressbar.Percentage(), ' ', progressbar.Bar(),
-                   ' ', progressbar.ETA()]
-        bar = progressbar.ProgressBar(widgets=widgets,
-                                      maxval=len(files_and_dirs)).start()
-        progress = 0
-        for base in databases:
-            for root, dirs, files in os.walk(base):
-                for directory in dirs:
-                    progress += 1
-                    bar.update(progress)
-
-                    directory = os.path.join(root, directory)
-
-                    try:
-                        dir_stat = os.stat(directory)
-                    except OSError:
-                        continue
-
-                    if dir_stat.st_uid != new_uid:
-                        # current user doesn't own this dir so let's move on
-                        continue
-
-                    perm = dir_stat.st_mode & mask
-
-                    if perm == exec_perm and dir_stat.st_gid == new_gid:
-                        continue
-
-                    try:
-                        os.chown(directory, new_uid, new_gid)
-                        os.chmod(directory, exec_perm)
-                    except OSError:
-                        continue
-
-                for file_name in files:
-                    progress += 1
-                    bar.update(progress)
-                    file_name = os.path.join(root, file_name)
-                    try:
-                        file_stat = os.stat(file_name)
-                    except OSError:
-                        continue
-
-                    if file_stat.st_uid != new_uid:
-                        # current user doesn't own this file so let's move on
-                        continue
-
-                    perm = file_stat.st_mode & mask
-
-                    if perm & stat.S_IXUSR:
-                        # executable, so make sure others can execute it
-                        new_perm = exec_perm
-                    else:
-                        new_perm = write_perm
-
-                    if perm == new_perm and file_stat.st_gid == new_gid:
-                        continue
-
-                    try:
-                        os.chown(file_name, new_uid, new_gid)
-                        os.chmod(file_name, new_perm)
-                    except OSError:
-                        continue
-
-        bar.finish()
-        print('  done.')
+        return input_file
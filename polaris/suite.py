@@ -8,7 +8,7 @@ from polaris.setup import setup_cases
 
 def setup_suite(component, suite_name, work_dir, config_file=None,
                 machine=None, baseline_dir=None, component_path=None,
-                copy_executable=False):
+                copy_executable=False, jobs=1):
     """
     Set up a test suite
 
@@ -43,6 +43,10 @@ def setup_suite(component, suite_name, work_dir, config_file=None,
 
     copy_executable : bool, optional
         Whether to copy the MPAS executable to the work directory
+
+    jobs : int, optional
+        The number of test cases to set up at the same time in separate
+        processes
     """
 
     text = imp_res.files(f'polaris.{component}.suites').joinpath(
@@ -53,7 +57,7 @@ def setup_suite(component, suite_name, work_dir, config_file=None,
     setup_cases(work_dir, tests, config_file=config_file, machine=machine,
                 baseline_dir=baseline_dir, component_path=component_path,
                 suite_name=suite_name, cached=cached,
-                copy_executable=copy_executable)
+                copy_executable=copy_executable, jobs=jobs)
 
 
 def main():
@@ -86,13 +90,17 @@ def main():
                         action="store_true",
                         help="If the model executable should be copied to the "
                              "work directory")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="The number of test cases to set up at the same "
+                             "time (default 1)",
+                        metavar="N")
     args = parser.parse_args(sys.argv[2:])
 
     setup_suite(component=args.component, suite_name=args.test_suite,
                 work_dir=args.work_dir, config_file=args.config_file,
                 machine=args.machine, baseline_dir=args.baseline_dir,
                 component_path=args.component_path,
-                copy_executable=args.copy_executable)
+                copy_executable=args.copy_executable, jobs=args.jobs)
 
 
 def _parse_suite(text):
@@ -1,3 +1,6 @@
+from polaris.registry import TestCaseDescriptor
+
+
 class TestGroup:
     """
     The base class for test groups, which are collections of test cases with
@@ -12,9 +15,11 @@ class TestGroup:
     component : polaris.Component
         the component that this test group belongs to
 
-    test_cases : dict
-        A dictionary of test cases in the test group with the names of the
-        test cases as keys
+    descriptors : dict
+        A dictionary of lightweight descriptions of the test cases in the test
+        group with the subdirectories of the test cases as keys.  Test cases
+        added with ``add_lazy_test_case()`` are only constructed when they are
+        needed.
     """
 
     def __init__(self, component, name):
@@ -32,8 +37,19 @@ class TestGroup:
         self.name = name
         self.component = component
 
-        # test cases will be added with calls to add_test_case()
-        self.test_cases = dict()
+        # test cases will be added with calls to add_test_case() or
+        # add_lazy_test_case()
+        self.descriptors = dict()
+
+    @property
+    def test_cases(self):
+        """
+        A dictionary of test cases in the test group with the subdirectories
+        of the test cases as keys.  Any test cases that have not been
+        constructed yet are constructed.
+        """
+        return {subdir: descriptor.get_test_case() for subdir, descriptor
+                in self.descriptors.items()}
 
     def add_test_case(self, test_case):
         """
@@ -44,4 +60,37 @@ class TestGroup:
         test_case : polaris.TestCase
             The test case to add
         """
-        self.test_cases[test_case.subdir] = test_case
+        descriptor = TestCaseDescriptor(
+            test_group=self, name=test_case.name, subdir=test_case.subdir,
+            test_case_class=type(test_case))
+        descriptor.test_case = test_case
+        self.descriptors[test_case.subdir] = descriptor
+
+    def add_lazy_test_case(self, test_case_class, name, subdir, **kwargs):
+        """
+        Add a test case to the test group that will only be constructed
+        (along with its steps) when it is needed, e.g. to set it up.  This
+        keeps ``polaris list`` and ``polaris setup`` fast no matter how many
+        test cases there are.
+
+        Parameters
+        ----------
+        test_case_class : type
+            The class of the test case, a subclass of
+            :py:class:`polaris.TestCase`
+
+        name : str
+            The name of the test case, which must match the name the test
+            case gives itself
+
+        subdir : str
+            The subdirectory of the test case, which must match the
+            subdirectory the test case gives itself
+
+        **kwargs
+            Keyword arguments other than ``test_group`` to pass to the
+            constructor of the test case
+        """
+        self.descriptors[subdir] = TestCaseDescriptor(
+            test_group=self, name=name, subdir=subdir,
+            test_case_class=test_case_class, kwargs=kwargs)
@@ -5,10 +5,17 @@ import re
 import numpy
 import xarray
 
+from polaris.database import parse_size
+
+# the default maximum size in bytes of the blocks of a variable that are read
+# at once when computing norms
+_DEFAULT_CHUNK_SIZE = 64 * 1024**2
+
 
 def compare_variables(test_case, variables, filename1, filename2=None,
                       l1_norm=0.0, l2_norm=0.0, linf_norm=0.0, quiet=True,
-                      check_outputs=True, skip_if_step_not_run=True):
+                      check_outputs=True, skip_if_step_not_run=True,
+                      chunk_size=None):
     """
     Compare variables between files in the current test case and/or with the
     baseline results.  The results of the comparison are added to the
@@ -66,6 +73,12 @@ def compare_variables(test_case, variables, filename1, filename2=None,
         both) of the steps involved in the comparison.  This would happen if
         users are running steps individually or has edited ``steps_to_run``
         in the config file to exclude one of the steps.
+
+    chunk_size : int, optional
+        The maximum size in bytes of the blocks of each variable that are
+        read from each file at once when computing norms, so that memory use
+        doesn't grow with the size of the variables.  By default, the
+        ``chunk_size`` config option in the ``validate`` section.
     """
     work_dir = test_case.work_dir
 
@@ -84,6 +97,9 @@ def compare_variables(test_case, variables, filename1, filename2=None,
     if skip_if_step_not_run and not all_steps_run:
         return
 
+    if chunk_size is None:
+        chunk_size = _get_chunk_size(test_case.config)
+
     if test_case.validation is not None:
         validation = test_case.validation
     else:
@@ -93,7 +109,7 @@ def compare_variables(test_case, variables, filename1, filename2=None,
     if filename2 is not None:
         internal_pass = _compare_variables(
             variables, path1, path2, l1_norm, l2_norm, linf_norm, quiet,
-            logger)
+            logger, chunk_size)
 
         if validation['internal_pass'] is None:
             validation['internal_pass'] = internal_pass
@@ -108,14 +124,15 @@ def compare_variables(test_case, variables, filename1, filename2=None,
         result = _compare_variables(
             variables, os.path.join(work_dir, filename1),
             os.path.join(baseline_root, filename1), l1_norm=0.0, l2_norm=0.0,
-            linf_norm=0.0, quiet=quiet, logger=logger)
+            linf_norm=0.0, quiet=quiet, logger=logger, chunk_size=chunk_size)
         baseline_pass = baseline_pass and result
 
         if filename2 is not None:
             result = _compare_variables(
                 variables, os.path.join(work_dir, filename2),
                 os.path.join(baseline_root, filename2), l1_norm=0.0,
-                l2_norm=0.0, linf_norm=0.0, quiet=quiet, logger=logger)
+                l2_norm=0.0, linf_norm=0.0, quiet=quiet, logger=logger,
+                chunk_size=chunk_size)
             baseline_pass = baseline_pass and result
 
         if validation['baseline_pass'] is None:
@@ -217,7 +234,7 @@ def _check_for_outputs(test_case, logger, path1, path2, filename1, filename2):
 
 
 def _compare_variables(variables, filename1, filename2, l1_norm, l2_norm,
-                       linf_norm, quiet, logger):
+                       linf_norm, quiet, logger, chunk_size):
     """ compare fields in the two files """
 
     for filename in [filename1, filename2]:
@@ -225,8 +242,9 @@ def _compare_variables(variables, filename1, filename2, l1_norm, l2_norm,
             logger.error(f'File {filename} does not exist.')
             return False
 
-    ds1 = xarray.open_dataset(filename1)
-    ds2 = xarray.open_dataset(filename2)
+    # without caching, only the blocks being compared are held in memory
+    ds1 = xarray.open_dataset(filename1, cache=False)
+    ds2 = xarray.open_dataset(filename2, cache=False)
 
     all_pass = True
 
@@ -276,14 +294,14 @@ def _compare_variables(variables, filename1, filename2, l1_norm, l2_norm,
                 slice1 = da1.isel(Time=time_index)
                 slice2 = da2.isel(Time=time_index)
                 result = _compute_norms(slice1, slice2, quiet, l1_norm,
-                                        l2_norm, linf_norm,
+                                        l2_norm, linf_norm, chunk_size,
                                         time_index=time_index)
                 variable_pass = variable_pass and result
 
         else:
             print(f'{variable}')
             result = _compute_norms(da1, da2, quiet, l1_norm, l2_norm,
-                                    linf_norm)
+                                    linf_norm, chunk_size)
             variable_pass = variable_pass and result
 
         # ANSI fail text: https://stackoverflow.com/a/287944/7728169
@@ -300,24 +318,45 @@ def _compare_variables(variables, filename1, filename2, l1_norm, l2_norm,
         print(f'       {filename2}\n')
         all_pass = all_pass and variable_pass
 
+    ds1.close()
+    ds2.close()
+
     return all_pass
 
 
 def _compute_norms(da1, da2, quiet, max_l1_norm, max_l2_norm, max_linf_norm,
-                   time_index=None):
-    """ Compute norms between variables in two DataArrays """
-
-    da1 = _rename_duplicate_dims(da1)
-    da2 = _rename_duplicate_dims(da2)
+                   chunk_size, time_index=None):
+    """
+    Compute norms between variables in two DataArrays, reading blocks of at
+    most ``chunk_size`` bytes from each at a time and accumulating the norms
+    """
 
     result = True
-    diff = numpy.abs(da1 - da2).values.ravel()
-    # skip entries where one field or both are a fill value
-    diff = diff[numpy.isfinite(diff)]
-
-    l1_norm = numpy.linalg.norm(diff, ord=1)
-    l2_norm = numpy.linalg.norm(diff, ord=2)
-    linf_norm = numpy.linalg.norm(diff, ord=numpy.inf)
+    # positional indexing works even if the variables have duplicate
+    # dimensions
+    var1 = da1.variable
+    var2 = da2.variable
+    itemsize = max(var1.dtype.itemsize, var2.dtype.itemsize)
+    max_elements = max(1, chunk_size // itemsize)
+
+    l1_norm = 0.
+    l2_norm_squared = 0.
+    linf_norm = 0.
+    for block in _get_blocks(var1.shape, max_elements):
+        diff = numpy.subtract(var1[block].values.ravel(),
+                              var2[block].values.ravel())
+        diff = numpy.abs(diff, out=diff)
+        # skip entries where one field or both are a fill value
+        finite = numpy.isfinite(diff)
+        if not finite.all():
+            diff = diff[finite]
+        if diff.size == 0:
+            continue
+        diff = diff.astype(numpy.float64, copy=False)
+        l1_norm += diff.sum()
+        l2_norm_squared += numpy.dot(diff, diff)
+        linf_norm = max(linf_norm, diff.max())
+    l2_norm = numpy.sqrt(l2_norm_squared)
 
     if time_index is None:
         diff_str = ''
@@ -407,21 +446,33 @@ def _find_timer_value(timer_name, directory):
     return timer_found, timer
 
 
-def _rename_duplicate_dims(da):
-    dims = list(da.dims)
-    new_dims = list(dims)
-    duplicates = False
-    for index, dim in enumerate(dims):
-        if dim in dims[index + 1:]:
-            duplicates = True
-            suffix = 2
-            for other_index, other in enumerate(dims[index + 1:]):
-                if other == dim:
-                    new_dims[other_index + index + 1] = f'{dim}_{suffix}'
-                    suffix += 1
-
-    if not duplicates:
-        return da
-
-    da = xarray.DataArray(data=da.values, dims=new_dims)
-    return da
+def _get_blocks(shape, max_elements):
+    """
+    Get the indices of blocks that cover an array of the given shape, each
+    with at most ``max_elements`` elements (unless a single element along
+    every dimension but the last is already more than that).  Blocks are
+    contiguous ranges along the first dimension, or along a later dimension
+    if a slice along the first dimension is too large.
+    """
+    if len(shape) == 0:
+        yield ()
+        return
+    row_size = int(numpy.prod(shape[1:]))
+    if row_size <= max_elements or len(shape) == 1:
+        rows = max(1, max_elements // max(1, row_size))
+        for start in range(0, shape[0], rows):
+            yield (slice(start, min(start + rows, shape[0])),)
+    else:
+        for index in range(shape[0]):
+            for block in _get_blocks(shape[1:], max_elements):
+                yield (slice(index, index + 1),) + block
+
+
+def _get_chunk_size(config):
+    """
+    The maximum size in bytes of the blocks of a variable to read at once
+    from the ``chunk_size`` config option in the ``validate`` section
+    """
+    if not config.has_option('validate', 'chunk_size'):
+        return _DEFAULT_CHUNK_SIZE
+    return parse_size(config.get('validate', 'chunk_size'))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import subprocess
+import sys
+
+from polaris.parallel import expand_hostlist
+
+
+def main():
+    """
+    Dispatch to the fake version of ``srun``, ``sinfo`` or ``squeue``
+    depending on the name this script was called with, or print the
+    environment variables for a fake job if called as ``fake_slurm.py``
+    """
+    command = os.path.basename(sys.argv[0])
+    if command == 'srun':
+        srun(sys.argv[1:])
+    elif command == 'sinfo':
+        sinfo(sys.argv[1:])
+    elif command == 'squeue':
+        squeue(sys.argv[1:])
+    else:
+        print_env(sys.argv[1:])
+
+
+def print_env(argv):
+    """
+    Print shell commands that set up a fake Slurm job with the given number
+    of nodes and cores per node
+    """
+    parser = argparse.ArgumentParser(
+        description='Print the environment for a fake Slurm job')
+    parser.add_argument('--nodes', dest='nodes', type=int, default=2,
+                        help='The number of nodes in the fake job')
+    parser.add_argument('--cores_per_node', dest='cores_per_node', type=int,
+                        default=4, help='The number of cores on each node')
+    parser.add_argument('--memory_per_node', dest='memory_per_node',
+                        type=int, default=16000,
+                        help='The memory on each node in MB')
+    parser.add_argument('--log', dest='log', default='fake_slurm.log',
+                        help='A file where job steps are logged')
+    args = parser.parse_args(argv)
+
+    bin_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
+    width = len(str(args.nodes))
+    nodelist = f'nid[{0:0{width}d}-{args.nodes - 1:0{width}d}]'
+    print(f'export PATH={bin_dir}:$PATH')
+    print('export SLURM_JOB_ID=1')
+    print(f'export SLURMD_NODENAME=nid{0:0{width}d}')
+    print(f'export SLURM_JOB_NODELIST={nodelist}')
+    print(f'export FAKE_SLURM_CORES_PER_NODE={args.cores_per_node}')
+    print(f'export FAKE_SLURM_MEMORY_PER_NODE={args.memory_per_node}')
+    print(f'export FAKE_SLURM_LOG={os.path.abspath(args.log)}')
+
+
+def srun(argv):
+    """
+    Check that a job step fits in the fake job, log the nodes it would run
+    on and run its command on the local machine
+    """
+    parser = argparse.ArgumentParser(prog='srun')
+    parser.add_argument('-c', '--cpus-per-task', dest='cpus_per_task',
+                        type=int, default=1)
+    parser.add_argument('-n', '--ntasks', dest='ntasks', type=int, default=1)
+    parser.add_argument('-N', '--nodes', dest='nodes', type=int)
+    parser.add_argument('-r', '--relative', dest='relative', type=int)
+    parser.add_argument('-w', '--nodelist', dest='nodelist')
+    parser.add_argument('--ntasks-per-node', dest='ntasks_per_node',
+                        type=int)
+    parser.add_argument('-m', '--distribution', dest='distribution')
+    parser.add_argument('--exclusive', dest='exclusive', action='store_true')
+    parser.add_argument('command', nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    job_nodes = expand_hostlist(os.environ['SLURM_JOB_NODELIST'])
+    cores_per_node = _get_cores_per_node()
+
+    if args.nodelist is not None:
+        nodes = expand_hostlist(args.nodelist)
+        unknown = [node for node in nodes if node not in job_nodes]
+        if len(unknown) > 0:
+            _fail(f'nodes not in the job: {unknown}')
+    else:
+        first = 0 if args.relative is None else args.relative
+        count = len(job_nodes) - first if args.nodes is None else args.nodes
+        if first + count > len(job_nodes):
+            _fail(f'--relative={first} --nodes={count} is beyond the '
+                  f'{len(job_nodes)} nodes in the job')
+        nodes = job_nodes[first:first + count]
+
+    if args.nodes is not None and args.nodes != len(nodes):
+        _fail(f'--nodes={args.nodes} does not match {nodes}')
+
+    tasks = _get_tasks_per_node(args, nodes)
+    for node, node_tasks in tasks.items():
+        cores = args.cpus_per_task * node_tasks
+        if cores > cores_per_node:
+            _fail(f'{cores} cores requested on {node} with {cores_per_node} '
+                  f'cores')
+
+    if 'FAKE_SLURM_LOG' in os.environ:
+        tasks_str = ','.join([f'{node}:{node_tasks}' for node, node_tasks
+                              in tasks.items()])
+        with open(os.environ['FAKE_SLURM_LOG'], 'a') as f:
+            f.write(f'nodes={",".join(nodes)} ntasks={args.ntasks} '
+                    f'tasks={tasks_str} '
+                    f'cpus_per_task={args.cpus_per_task} '
+                    f'exclusive={args.exclusive} '
+                    f'command={" ".join(args.command)}\n')
+
+    env = dict(os.environ)
+    env['SLURM_NTASKS'] = f'{args.ntasks}'
+    env['SLURM_CPUS_PER_TASK'] = f'{args.cpus_per_task}'
+    env['SLURM_STEP_NODELIST'] = ','.join(nodes)
+    sys.exit(subprocess.call(args.command, env=env))
+
+
+def sinfo(argv):
+    """
+    Report the sockets, cores per socket, threads per core or memory of the
+    fake nodes
+    """
+    parser = argparse.ArgumentParser(prog='sinfo')
+    parser.add_argument('--noheader', action='store_true')
+    parser.add_argument('--node', dest='node')
+    parser.add_argument('-o', dest='format')
+    args = parser.parse_args(argv)
+
+    values = {'%X': 1,
+              '%Y': _get_cores_per_node(),
+              '%Z': 1,
+              '%m': int(os.environ.get('FAKE_SLURM_MEMORY_PER_NODE', 16000))}
+    if args.format not in values:
+        _fail(f'unsupported format: {args.format}')
+    print(values[args.format])
+
+
+def squeue(argv):
+    """
+    Report the number of nodes in the fake job
+    """
+    parser = argparse.ArgumentParser(prog='squeue')
+    parser.add_argument('--noheader', action='store_true')
+    parser.add_argument('-j', dest='job_id')
+    parser.add_argument('-o', dest='format')
+    args = parser.parse_args(argv)
+
+    if args.format != '%D':
+        _fail(f'unsupported format: {args.format}')
+    print(len(expand_hostlist(os.environ['SLURM_JOB_NODELIST'])))
+
+
+def _get_tasks_per_node(args, nodes):
+    """
+    The number of tasks srun would put on each node: as listed in
+    ``$SLURM_HOSTFILE`` for the arbitrary distribution, the same number on
+    each node with ``--ntasks-per-node`` or, by default, a block
+    distribution that fills the first nodes first
+    """
+    tasks = {node: 0 for node in nodes}
+    if args.distribution == 'arbitrary':
+        if 'SLURM_HOSTFILE' not in os.environ:
+            _fail('--distribution=arbitrary requires SLURM_HOSTFILE')
+        with open(os.environ['SLURM_HOSTFILE']) as f:
+            hosts = f.read().replace(',', '\n').split()
+        if len(hosts) < args.ntasks:
+            _fail(f'SLURM_HOSTFILE lists {len(hosts)} hosts for '
+                  f'{args.ntasks} tasks')
+        for host in hosts[0:args.ntasks]:
+            if host not in tasks:
+                _fail(f'{host} from SLURM_HOSTFILE is not in {nodes}')
+            tasks[host] += 1
+    elif args.ntasks_per_node is not None:
+        if args.ntasks != args.ntasks_per_node * len(nodes):
+            _fail(f'--ntasks={args.ntasks} does not match '
+                  f'--ntasks-per-node={args.ntasks_per_node} on '
+                  f'{len(nodes)} nodes')
+        for node in nodes:
+            tasks[node] = args.ntasks_per_node
+    else:
+        cores_per_node = _get_cores_per_node()
+        per_node = max(1, cores_per_node // args.cpus_per_task)
+        remaining = args.ntasks
+        for node in nodes:
+            tasks[node] = min(per_node, remaining)
+            remaining -= tasks[node]
+        if remaining > 0:
+            _fail(f'{args.ntasks} tasks do not fit on {len(nodes)} nodes')
+    return tasks
+
+
+def _get_cores_per_node():
+    return int(os.environ.get('FAKE_SLURM_CORES_PER_NODE',
+                              str(os.cpu_count() or 1)))
+
+
+def _fail(message):
+    print(f'fake slurm: error: {message}', file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+# packages that are slow to import and that only some steps need, so the
+# ``polaris`` command itself should never import them
+HEAVY_MODULES = ['cartopy', 'cmocean', 'jigsawpy', 'lxml', 'matplotlib',
+                 'mpas_tools.viz', 'xarray']
+
+# modules that a module may not import if it isn't in HEAVY_MODULES.
+# ``polaris.run.serial`` is imported for every step run as a subprocess
+# (``polaris serial --step_is_subprocess``), which doesn't need the runtime
+# history (and its sqlite database)
+MODULE_HEAVY_MODULES = {
+    'polaris.run.serial': HEAVY_MODULES + ['sqlite3']}
+
+
+def main():
+    """
+    Check that starting the ``polaris`` command (or running a step with
+    ``polaris serial``) is quick and doesn't import any of the
+    slow-to-import packages that only some steps need
+    """
+    parser = argparse.ArgumentParser(
+        description='Check how long it takes to import the polaris command')
+    parser.add_argument('-m', '--module', dest='module',
+                        default='polaris.__main__',
+                        help='The module to import (default: '
+                             'polaris.__main__)')
+    parser.add_argument('-b', '--budget', dest='budget', type=float,
+                        default=0.5,
+                        help='The maximum time in seconds the import may take '
+                             '(default: 0.5)')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=5,
+                        help='The number of times to import the module, each '
+                             'in a new python process (default: 5)')
+    parser.add_argument('-n', '--number', dest='count', type=int, default=15,
+                        help='The number of slowest imports to list if the '
+                             'import is too slow (default: 15)')
+    args = parser.parse_args()
+
+    heavy = get_heavy_imports(args.module)
+    times = [time_import(args.module) for _ in range(args.repeat)]
+    elapsed = statistics.median(times)
+    print(f'import {args.module}: {elapsed:.3f} s (median of {args.repeat}, '
+          f'budget {args.budget:.3f} s)')
+
+    failed = False
+    if len(heavy) > 0:
+        print(f'{args.module} imports: {", ".join(heavy)}')
+        failed = True
+    if elapsed > args.budget:
+        print(f'Importing {args.module} took longer than the budget.  The '
+              f'slowest imports were:')
+        for cumulative, name in slowest_imports(args.module, args.count):
+            print(f'  {cumulative / 1e6:8.3f} s  {name}')
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+def time_import(module):
+    """
+    The time in seconds it takes to import a module in a new python process,
+    not counting starting python itself
+    """
+    code = (f'import time; start = time.perf_counter(); import {module}; '
+            f'print(time.perf_counter() - start)')
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return float(output.decode('utf-8').strip())
+
+
+def get_heavy_imports(module):
+    """ Which of the heavy modules importing a module also imports """
+    code = (f'import sys; import {module}; '
+            f'print(" ".join(sorted(sys.modules)))')
+    output = subprocess.check_output([sys.executable, '-c', code])
+    imported = set(output.decode('utf-8').split())
+    heavy = MODULE_HEAVY_MODULES.get(module, HEAVY_MODULES)
+    return [name for name in heavy if name in imported]
+
+
+def slowest_imports(module, count):
+    """
+    The imports with the largest cumulative times in microseconds from
+    ``python -X importtime``
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    imports = list()
+    for line in process.stderr.decode('utf-8').splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+if __name__ == '__main__':
+    main()